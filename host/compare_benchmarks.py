@@ -0,0 +1,73 @@
+"""Compare two runs of src/benchmarks/firmware_benchmark.py and flag regressions.
+
+Both files are captured benchmark output, from the device or from the host
+emulation. The JSON line the benchmark prints last is compared, all metrics
+are "lower is better". Exits with status 1 when any metric regressed.
+
+    python3 host/compare_benchmarks.py baseline.txt current.txt --tolerance 0.2
+"""
+
+import argparse
+import json
+import sys
+
+
+def load_results(path: str) -> dict:
+    with open(path) as file:
+        lines = [line for line in file if line.startswith("{")]
+    if not lines:
+        raise SystemExit(f"{path}: no benchmark results found")
+    # The emulator prints its own report after the benchmark results
+    for line in reversed(lines):
+        try:
+            return json.loads(line)
+        except json.JSONDecodeError:
+            continue
+    raise SystemExit(f"{path}: no benchmark results found")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="allowed relative increase before a metric counts as regressed",
+    )
+    parser.add_argument(
+        "--min-delta",
+        type=float,
+        default=1.0,
+        help="ignore increases smaller than this, in the metric's own unit",
+    )
+    args = parser.parse_args()
+
+    baseline = load_results(args.baseline)
+    current = load_results(args.current)
+    regressions = 0
+    print(f"{'metric':<44} {'baseline':>12} {'current':>12} {'change':>8}")
+    for name, value in current.items():
+        previous = baseline.get(name)
+        if previous is None:
+            print(f"{name:<44} {'-':>12} {value:>12} {'new':>8}")
+            continue
+        change = (value - previous) / previous if previous else 0.0
+        regressed = (
+            value - previous >= args.min_delta
+            and value > previous * (1 + args.tolerance)
+        )
+        regressions += regressed
+        marker = "  REGRESSED" if regressed else ""
+        print(f"{name:<44} {previous:>12} {value:>12} {change:>+8.0%}{marker}")
+    for name in baseline.keys() - current.keys():
+        print(f"{name:<44} {baseline[name]:>12} {'-':>12} {'gone':>8}")
+
+    if regressions:
+        print(f"{regressions} metric(s) regressed")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
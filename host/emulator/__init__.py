@@ -0,0 +1,10 @@
+"""Host emulation of the irrigation station firmware.
+
+See host/README.md for how to run src/main.py under CPython.
+"""
+
+from .broker import Broker, Message, topic_matches
+from .clock import VirtualClock
+from .core1 import SecondCore
+from .hardware import Board
+from .runtime import EmulationFinished, Emulator, MachineReset, current
@@ -0,0 +1,547 @@
+import asyncio
+import struct
+from collections import namedtuple
+from errno import EBADF, ECONNREFUSED, ECONNRESET, EHOSTUNREACH, ETIMEDOUT
+from typing import Callable
+
+from .clock import VirtualClock
+
+# MQTT 3.1.1 control packet types
+CONNECT = 1
+CONNACK = 2
+PUBLISH = 3
+PUBACK = 4
+SUBSCRIBE = 8
+SUBACK = 9
+UNSUBSCRIBE = 10
+UNSUBACK = 11
+PINGREQ = 12
+PINGRESP = 13
+DISCONNECT = 14
+
+PACKET_NAMES = {
+    CONNECT: "CONNECT",
+    PUBLISH: "PUBLISH",
+    PUBACK: "PUBACK",
+    SUBSCRIBE: "SUBSCRIBE",
+    UNSUBSCRIBE: "UNSUBSCRIBE",
+    PINGREQ: "PINGREQ",
+    DISCONNECT: "DISCONNECT",
+}
+
+# Bytes a TLS 1.2 AES-GCM record adds to its content: the 5 byte record
+# header, the 8 byte explicit nonce and the 16 byte authentication tag
+TLS_RECORD_OVERHEAD = 29
+
+# Client id used for messages injected by the emulation, e.g. Home Assistant
+EXTERNAL_CLIENT_ID = "home-assistant"
+
+Message = namedtuple(
+    "Message", ["time", "client_id", "topic", "payload", "qos", "retain"]
+)
+
+
+def topic_matches(topic_filter: str, topic: str) -> bool:
+    """Match a topic against a subscription filter with `+` and `#` wildcards."""
+    filter_levels = topic_filter.split("/")
+    topic_levels = topic.split("/")
+    if topic.startswith("$") and filter_levels[0] in ("+", "#"):
+        return False
+    for i, level in enumerate(filter_levels):
+        if level == "#":
+            return True
+        if i >= len(topic_levels):
+            return False
+        if level != "+" and level != topic_levels[i]:
+            return False
+    return len(filter_levels) == len(topic_levels)
+
+
+def _encode_length(length: int) -> bytes:
+    encoded = bytearray()
+    while True:
+        byte = length & 0x7F
+        length >>= 7
+        encoded.append(byte | 0x80 if length else byte)
+        if not length:
+            return bytes(encoded)
+
+
+def _encode_str(value: bytes) -> bytes:
+    return struct.pack("!H", len(value)) + value
+
+
+def _publish_packet(topic: str, payload: bytes, qos: int, retain: bool, pid: int):
+    body = _encode_str(topic.encode())
+    if qos:
+        body += struct.pack("!H", pid)
+    body += payload
+    header = 0x30 | qos << 1 | int(retain)
+    return bytes([header]) + _encode_length(len(body)) + body
+
+
+class BrokerSocket:
+    """Client end of an in-process broker connection.
+
+    Implements the subset of the MicroPython socket stream API that
+    umqtt.simple uses. Every write() is counted, on a TLS wrapped socket each
+    write becomes one TLS record on the wire.
+    """
+
+    def __init__(self, broker: "Broker") -> None:
+        self._broker = broker
+        self._connection = None
+        self._rx = bytearray()
+        self._timeout = None
+        self._closed = False
+        self._eof = False
+        self._waiters = []
+        self.tls = False
+        self.writes = 0
+        self.bytes_written = 0
+
+    def connect(self, addr) -> None:
+        self._connection = self._broker.accept(self)
+
+    def settimeout(self, timeout) -> None:
+        self._timeout = timeout
+
+    def setblocking(self, flag: bool) -> None:
+        self._timeout = None if flag else 0
+
+    def write(self, buf, length=None) -> int:
+        if self._closed:
+            raise OSError(EBADF)
+        if self._eof or self._connection is None:
+            raise OSError(ECONNRESET)
+        data = bytes(buf if length is None else memoryview(buf)[:length])
+        self.writes += 1
+        self.bytes_written += len(data)
+        self._broker.count_write(self, len(data))
+        self._connection.receive(data)
+        return len(data)
+
+    def read(self, size: int):
+        if self._closed:
+            raise OSError(EBADF)
+        if size == 0:
+            return b""
+        available = len(self._rx)
+        if available < size and not self._eof:
+            if self._timeout == 0:
+                if not available:
+                    return None
+            else:
+                if self._timeout is None and self._connection.hung:
+                    # Nothing will ever answer: the device blocks in this read
+                    # until the watchdog resets it
+                    self._broker.sleep(float("inf"))
+                # The broker answers synchronously, so nothing more can arrive
+                # while the only thread is blocked in this read
+                if self._timeout:
+                    self._broker.sleep(self._timeout)
+                raise OSError(ETIMEDOUT)
+        data = bytes(self._rx[:size])
+        del self._rx[:size]
+        return data
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        self._notify()
+        if self._connection is not None:
+            self._connection.client_closed()
+
+    def abandon(self) -> None:
+        """Die without the broker noticing, like a device that loses power."""
+        self._closed = True
+        self._notify()
+        if self._connection is not None:
+            self._connection.sock = None
+
+    def wrap_tls(self) -> "BrokerSocket":
+        self.tls = True
+        return self
+
+    # Broker side
+
+    def deliver(self, data: bytes) -> None:
+        self._rx += data
+        self._notify()
+
+    def server_closed(self) -> None:
+        self._eof = True
+        self._notify()
+
+    async def wait_readable(self) -> None:
+        while not self._rx and not self._eof and not self._closed:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            await waiter
+
+    def _notify(self) -> None:
+        waiters, self._waiters = self._waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+
+class _Session:
+    def __init__(self, client_id: str, clean: bool) -> None:
+        self.client_id = client_id
+        self.clean = clean
+        self.subscriptions: dict = {}
+        self.queued = []
+        # QoS 1 messages sent but not acknowledged yet, by packet id. They
+        # are sent again when the client resumes the session
+        self.inflight: dict = {}
+        self.connection = None
+
+
+class _Connection:
+    """Broker end of a connection: parses client packets and answers them."""
+
+    def __init__(self, broker: "Broker", sock: BrokerSocket) -> None:
+        self.broker = broker
+        self.sock = sock
+        self.session = None
+        self.client_id = None
+        self.keepalive = 0
+        self.will = None
+        self.last_seen = broker.clock.monotonic()
+        self.open = True
+        # Half-open: the connection stays open but nothing is answered
+        self.hung = False
+        self._inbox = bytearray()
+        self._pid = 0
+
+    def receive(self, data: bytes) -> None:
+        self.last_seen = self.broker.clock.monotonic()
+        self._inbox += data
+        while self.open and not self.hung:
+            packet = self._take_packet()
+            if packet is None:
+                return
+            self._handle(*packet)
+
+    def send(self, data: bytes) -> None:
+        if self.sock is not None:
+            self.sock.deliver(data)
+
+    def send_publish(self, message: Message, qos: int, retain: bool) -> None:
+        pid = 0
+        if qos:
+            self._pid = self._pid % 0xFFFF + 1
+            pid = self._pid
+            self.session.inflight[pid] = message
+        self.broker.stats["publishes_out"] += 1
+        self.send(_publish_packet(message.topic, message.payload, qos, retain, pid))
+
+    def client_closed(self) -> None:
+        # Closed without a DISCONNECT packet, so the will is published
+        self.close(publish_will=True)
+
+    def close(self, publish_will: bool) -> None:
+        if not self.open:
+            return
+        self.open = False
+        if self.sock is not None:
+            self.sock.server_closed()
+        self.broker.connection_closed(self, publish_will)
+
+    def _take_packet(self):
+        inbox = self._inbox
+        if len(inbox) < 2:
+            return None
+        length = 0
+        shift = 0
+        i = 1
+        while True:
+            if i >= len(inbox):
+                return None
+            byte = inbox[i]
+            length |= (byte & 0x7F) << shift
+            i += 1
+            if not byte & 0x80:
+                break
+            shift += 7
+        if len(inbox) < i + length:
+            return None
+        header = inbox[0]
+        body = bytes(inbox[i : i + length])
+        del inbox[: i + length]
+        return header >> 4, header & 0x0F, body
+
+    def _handle(self, packet_type: int, flags: int, body: bytes) -> None:
+        stats = self.broker.stats
+        name = PACKET_NAMES.get(packet_type, str(packet_type))
+        stats["packets_in"][name] = stats["packets_in"].get(name, 0) + 1
+        if packet_type == CONNECT:
+            self._handle_connect(body)
+        elif packet_type == PUBLISH:
+            self._handle_publish(flags, body)
+        elif packet_type == PUBACK:
+            (pid,) = struct.unpack_from("!H", body, 0)
+            self.session.inflight.pop(pid, None)
+        elif packet_type == SUBSCRIBE:
+            self._handle_subscribe(body)
+        elif packet_type == UNSUBSCRIBE:
+            pid = body[:2]
+            offset = 2
+            while offset < len(body):
+                (size,) = struct.unpack_from("!H", body, offset)
+                topic_filter = body[offset + 2 : offset + 2 + size].decode()
+                self.session.subscriptions.pop(topic_filter, None)
+                offset += 2 + size
+            self.send(bytes([UNSUBACK << 4, 2]) + pid)
+        elif packet_type == PINGREQ:
+            self.send(bytes([PINGRESP << 4, 0]))
+        elif packet_type == DISCONNECT:
+            self.will = None
+            self.close(publish_will=False)
+
+    def _handle_connect(self, body: bytes) -> None:
+        (name_size,) = struct.unpack_from("!H", body, 0)
+        offset = 2 + name_size + 1
+        connect_flags = body[offset]
+        (self.keepalive,) = struct.unpack_from("!H", body, offset + 1)
+        offset += 3
+
+        def take_str() -> bytes:
+            nonlocal offset
+            (size,) = struct.unpack_from("!H", body, offset)
+            value = body[offset + 2 : offset + 2 + size]
+            offset += 2 + size
+            return value
+
+        self.client_id = take_str().decode()
+        if connect_flags & 0x04:
+            will_topic = take_str().decode()
+            will_payload = take_str()
+            will_qos = (connect_flags >> 3) & 0x03
+            will_retain = bool(connect_flags & 0x20)
+            self.will = (will_topic, will_payload, will_qos, will_retain)
+        clean = bool(connect_flags & 0x02)
+        session_present = self.broker.attach(self, clean)
+        self.send(bytes([CONNACK << 4, 2, int(session_present), 0]))
+        self.broker.flush_queued(self.session)
+
+    def _handle_publish(self, flags: int, body: bytes) -> None:
+        qos = (flags >> 1) & 0x03
+        retain = bool(flags & 0x01)
+        (topic_size,) = struct.unpack_from("!H", body, 0)
+        topic = body[2 : 2 + topic_size].decode()
+        offset = 2 + topic_size
+        if qos:
+            pid = body[offset : offset + 2]
+            offset += 2
+            self.send(bytes([PUBACK << 4, 2]) + pid)
+        self.broker.route(self.client_id, topic, body[offset:], qos, retain)
+
+    def _handle_subscribe(self, body: bytes) -> None:
+        pid = body[:2]
+        offset = 2
+        granted = bytearray()
+        topic_filters = []
+        while offset < len(body):
+            (size,) = struct.unpack_from("!H", body, offset)
+            topic_filter = body[offset + 2 : offset + 2 + size].decode()
+            qos = min(body[offset + 2 + size], 1)
+            offset += 3 + size
+            self.session.subscriptions[topic_filter] = qos
+            topic_filters.append((topic_filter, qos))
+            granted.append(qos)
+        self.send(bytes([SUBACK << 4, 2 + len(granted)]) + pid + bytes(granted))
+        for topic_filter, qos in topic_filters:
+            self.broker.send_retained(self, topic_filter, qos)
+
+
+class Broker:
+    """Minimal in-process MQTT 3.1.1 broker with QoS 0/1, retained messages,
+    wills, keepalive timeouts and persistent sessions.
+
+    Every PUBLISH received from a client is recorded in `messages`, and
+    `publish()` injects messages as if another client (Home Assistant) sent
+    them. `stop()` and `start()` simulate a broker outage, `hang()` and
+    `resume()` connections that stop answering without being closed.
+    """
+
+    def __init__(
+        self,
+        clock: VirtualClock,
+        is_reachable: Callable[[], bool] = lambda: True,
+        sleep: Callable[[float], None] | None = None,
+    ) -> None:
+        self.clock = clock
+        self.is_reachable = is_reachable
+        self.sleep = sleep or clock.sleep
+        self.available = True
+        self.retained: dict = {}
+        self.messages: list = []
+        self._sessions: dict = {}
+        self._connections: list = []
+        self._observers = []
+        self.stats = {
+            "connects": 0,
+            "refused": 0,
+            "publishes_in": 0,
+            "publishes_out": 0,
+            "writes": 0,
+            "bytes_in": 0,
+            "wire_bytes_in": 0,
+            "wills": 0,
+            "packets_in": {},
+        }
+
+    # Emulation control
+
+    def stop(self) -> None:
+        """Take the broker down, dropping every connection."""
+        self.available = False
+        for connection in list(self._connections):
+            connection.close(publish_will=False)
+
+    def start(self) -> None:
+        self.available = True
+
+    def hang(self) -> None:
+        """Stop answering the open connections without closing them, like
+        half-open TCP connections. New connections are served as usual."""
+        for connection in self._connections:
+            connection.hung = True
+
+    def resume(self) -> None:
+        for connection in self._connections:
+            connection.hung = False
+
+    def link_down(self) -> None:
+        """The device lost its network link: its sockets see EOF while the broker
+        only notices through the keepalive timeout."""
+        for connection in self._connections:
+            if connection.sock is not None:
+                connection.sock.server_closed()
+                connection.sock = None
+
+    def publish(self, topic: str, payload, retain: bool = False, qos: int = 0) -> None:
+        """Publish a message from outside the firmware, e.g. a Home Assistant command."""
+        if isinstance(payload, str):
+            payload = payload.encode()
+        self.route(EXTERNAL_CLIENT_ID, topic, payload, qos, retain)
+
+    def observe(self, topic_filter: str, callback: Callable[[Message], None]) -> None:
+        """Call `callback` for every routed message that matches `topic_filter`."""
+        self._observers.append((topic_filter, callback))
+
+    def connected_clients(self) -> list:
+        return [c.client_id for c in self._connections if c.client_id]
+
+    def tick(self) -> None:
+        """Enforce keepalive: drop clients silent for 1.5 times their keepalive."""
+        now = self.clock.monotonic()
+        for connection in list(self._connections):
+            if connection.keepalive and (
+                now - connection.last_seen > connection.keepalive * 1.5
+            ):
+                connection.close(publish_will=True)
+
+    # Connection handling
+
+    def accept(self, sock: BrokerSocket) -> _Connection:
+        if not self.is_reachable():
+            raise OSError(EHOSTUNREACH)
+        if not self.available:
+            self.stats["refused"] += 1
+            raise OSError(ECONNREFUSED)
+        connection = _Connection(self, sock)
+        self._connections.append(connection)
+        return connection
+
+    def attach(self, connection: _Connection, clean: bool) -> bool:
+        """Bind a connection to its session and report whether one was resumed."""
+        self.stats["connects"] += 1
+        client_id = connection.client_id
+        session = self._sessions.get(client_id)
+        if session is not None and session.connection is not None:
+            # Session takeover, the previous connection is closed
+            session.connection.close(publish_will=True)
+        session_present = session is not None and not clean and not session.clean
+        if not session_present:
+            session = _Session(client_id, clean)
+            self._sessions[client_id] = session
+        session.clean = clean
+        session.connection = connection
+        connection.session = session
+        return session_present
+
+    def connection_closed(self, connection: _Connection, publish_will: bool) -> None:
+        if connection in self._connections:
+            self._connections.remove(connection)
+        session = connection.session
+        if session is not None and session.connection is connection:
+            session.connection = None
+            if session.clean:
+                self._sessions.pop(session.client_id, None)
+        if publish_will and connection.will is not None:
+            topic, payload, qos, retain = connection.will
+            self.stats["wills"] += 1
+            self.route(connection.client_id, topic, payload, qos, retain)
+
+    def count_write(self, sock: BrokerSocket, size: int) -> None:
+        self.stats["writes"] += 1
+        self.stats["bytes_in"] += size
+        self.stats["wire_bytes_in"] += size + TLS_RECORD_OVERHEAD if sock.tls else size
+
+    # Routing
+
+    def route(
+        self, client_id: str, topic: str, payload: bytes, qos: int, retain: bool
+    ) -> None:
+        message = Message(
+            self.clock.monotonic(), client_id, topic, payload, qos, retain
+        )
+        if client_id != EXTERNAL_CLIENT_ID:
+            self.stats["publishes_in"] += 1
+            self.messages.append(message)
+        if retain:
+            if payload:
+                self.retained[topic] = message
+            else:
+                self.retained.pop(topic, None)
+        for topic_filter, callback in self._observers:
+            if topic_matches(topic_filter, topic):
+                callback(message)
+        for session in list(self._sessions.values()):
+            granted = self._granted_qos(session, topic)
+            if granted is None:
+                continue
+            delivered_qos = min(granted, qos)
+            if session.connection is not None:
+                session.connection.send_publish(message, delivered_qos, False)
+            elif delivered_qos and not session.clean:
+                session.queued.append((message, delivered_qos))
+
+    def flush_queued(self, session: _Session) -> None:
+        inflight, session.inflight = session.inflight, {}
+        for message in inflight.values():
+            session.connection.send_publish(message, 1, False)
+        queued, session.queued = session.queued, []
+        for message, qos in queued:
+            session.connection.send_publish(message, qos, False)
+
+    def send_retained(
+        self, connection: _Connection, topic_filter: str, qos: int
+    ) -> None:
+        for topic, message in list(self.retained.items()):
+            if topic_matches(topic_filter, topic):
+                connection.send_publish(message, min(qos, message.qos), True)
+
+    @staticmethod
+    def _granted_qos(session: _Session, topic: str):
+        granted = None
+        for topic_filter, qos in session.subscriptions.items():
+            if topic_matches(topic_filter, topic) and (
+                granted is None or qos > granted
+            ):
+                granted = qos
+        return granted
@@ -0,0 +1,58 @@
+import time as _time
+
+# MicroPython ticks wrap around at 2**30
+TICKS_PERIOD = 1 << 30
+_TICKS_MAX = TICKS_PERIOD - 1
+_TICKS_HALFPERIOD = TICKS_PERIOD // 2
+
+_real_monotonic = _time.monotonic
+_real_sleep = _time.sleep
+
+
+class VirtualClock:
+    """Monotonic clock that runs at real speed while busy and skips ahead while idle.
+
+    CPU time spent in firmware code advances the clock 1:1, so handler
+    latencies stay meaningful. Sleeping advances the clock by the requested
+    duration but only waits `duration / speed` real seconds, so with
+    speed=inf the emulation runs as fast as the host allows.
+    """
+
+    def __init__(self, speed: float = float("inf")) -> None:
+        self.speed = speed
+        self._real_start = _real_monotonic()
+        self._skipped = 0.0
+
+    def monotonic(self) -> float:
+        return _real_monotonic() - self._real_start + self._skipped
+
+    def sleep(self, seconds: float) -> None:
+        if seconds <= 0:
+            return
+        real_seconds = 0.0 if self.speed == float("inf") else seconds / self.speed
+        if real_seconds:
+            _real_sleep(real_seconds)
+        self._skipped += seconds - real_seconds
+
+    def ticks_ms(self) -> int:
+        return int(self.monotonic() * 1000) & _TICKS_MAX
+
+    def ticks_us(self) -> int:
+        return int(self.monotonic() * 1_000_000) & _TICKS_MAX
+
+
+def ticks_add(ticks: int, delta: int) -> int:
+    return (ticks + delta) & _TICKS_MAX
+
+
+def ticks_diff(ticks1: int, ticks2: int) -> int:
+    diff = (ticks1 - ticks2) & _TICKS_MAX
+    return diff - TICKS_PERIOD if diff >= _TICKS_HALFPERIOD else diff
+
+
+def real_monotonic() -> float:
+    return _real_monotonic()
+
+
+def real_sleep(seconds: float) -> None:
+    _real_sleep(seconds)
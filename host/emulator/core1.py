@@ -0,0 +1,74 @@
+import threading
+import traceback
+
+
+class _Stop(BaseException):
+    """Unwinds the core 1 function when the board is power cycled."""
+
+
+class SecondCore:
+    """Runs the function given to `_thread.start_new_thread()` as core 1 of the RP2350.
+
+    The function gets its own host thread, but only one of the two threads
+    runs at a time: core 1 runs until it sleeps and then hands back to the
+    firmware's event loop. Its sleeps are machine timers on the virtual
+    clock, so core 1 blocking on the ADS1115 costs core 0 nothing, like on
+    the device, while everything stays deterministic.
+    """
+
+    def __init__(self, emulator) -> None:
+        self._emulator = emulator
+        self._thread = None
+        self._resume = threading.Semaphore(0)
+        self._yielded = threading.Semaphore(0)
+        self._stopping = False
+
+    def start_new_thread(self, function, args, kwargs=None) -> int:
+        if self._thread is not None:
+            raise OSError(16, "core1 in use")
+        self._thread = threading.Thread(
+            target=self._run, args=(function, args, kwargs or {}), daemon=True
+        )
+        self._thread.start()
+        self._emulator.start_timer(self, 0, False, self._switch)
+        return self._thread.ident
+
+    def is_current(self) -> bool:
+        return self._thread is not None and threading.current_thread() is self._thread
+
+    def sleep(self, seconds: float) -> None:
+        """Called on core 1: park until the virtual clock has advanced `seconds`."""
+        self._emulator.start_timer(self, seconds * 1000, False, self._switch)
+        self._yielded.release()
+        self._resume.acquire()
+        if self._stopping:
+            raise _Stop()
+
+    def stop(self) -> None:
+        """Unwind core 1 through its finally blocks, for a power cycle."""
+        if self._thread is None:
+            return
+        self._emulator.stop_timer(self)
+        self._stopping = True
+        self._switch()
+        self._stopping = False
+
+    def _switch(self, _=None) -> None:
+        # Runs on core 0 as a timer callback, blocks until core 1 sleeps again
+        self._resume.release()
+        self._yielded.acquire()
+
+    def _run(self, function, args, kwargs) -> None:
+        self._resume.acquire()
+        try:
+            if not self._stopping:
+                function(*args, **kwargs)
+        except _Stop:
+            pass
+        except Exception:
+            # MicroPython prints the traceback and only ends the thread
+            print("Unhandled exception in thread started by", function)
+            traceback.print_exc()
+        finally:
+            self._thread = None
+            self._yielded.release()
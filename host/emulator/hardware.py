@@ -0,0 +1,249 @@
+import math
+import time as _time
+from collections import deque
+from typing import Callable
+
+from .clock import VirtualClock
+
+# Seconds from the Unix epoch to 2021-01-01, where the rp2 RTC starts after a reset
+RTC_RESET_EPOCH = 1609459200
+
+# ADS1115 full scale voltage per gain setting and conversion time per rate index
+ADS_GAIN_VOLTS = (6.144, 4.096, 2.048, 1.024, 0.512, 0.256)
+ADS_RATES_SPS = (8, 16, 32, 64, 128, 250, 475, 860)
+# A single I2C register access at 400 kHz
+I2C_TRANSACTION_S = 0.0001
+
+# Transitions kept per pin, the onboard LED alone toggles every few seconds
+PIN_HISTORY_LENGTH = 1000
+
+# The board's crystal runs this much fast, so the RTC and ticks drift away
+# from the time NTP servers hand out, by about 1.7 s per day
+CRYSTAL_DRIFT_PPM = 20
+
+# Moisture sensors need a moment after powering on before their output settles
+SENSOR_SETTLE_S = 0.25
+
+# Status codes reported by the rp2 WLAN driver
+STAT_IDLE = 0
+STAT_CONNECTING = 1
+STAT_GOT_IP = 3
+STAT_CONNECT_FAIL = -1
+STAT_NO_AP_FOUND = -2
+
+# Connect phases of the CYW43: scanning every channel for the SSID, joining
+# the access point and getting a DHCP lease. A connect that names the BSSID
+# and channel skips the scan, a static IP skips DHCP
+WLAN_SCAN_S = 1.8
+WLAN_JOIN_S = 0.2
+WLAN_DHCP_S = 1.0
+
+
+def default_sensor_curve(phase: float) -> Callable[[float], float]:
+    """Sensor output that drifts between 1.5 V and 3.5 V once per simulated day."""
+
+    def curve(t: float) -> float:
+        return 2.5 + math.sin(2 * math.pi * t / 86400 + phase)
+
+    return curve
+
+
+class Board:
+    """State of the emulated Pico and everything wired to it.
+
+    Pins keep a history of (time, value) transitions, sensors are addressed by
+    (ads_address, ads_channel) and only produce their curve while the MOSFET
+    pin that powers them is on.
+    """
+
+    def __init__(self, clock: VirtualClock) -> None:
+        self.clock = clock
+        self.unique_id = bytes.fromhex("e6614104030e5b2a")
+        self.pins: dict = {}
+        self.pin_history: dict = {}
+        self.pin_listeners = []
+        self.sensor_curves: dict = {}
+        self.sensor_power_pins: dict = {}
+        self.ads_addresses: set = set()
+        # Offset of the RTC from the virtual clock, in epoch seconds
+        self.rtc_offset = RTC_RESET_EPOCH - clock.monotonic()
+        # Offset of the "real" time that NTP servers hand out
+        self.true_time_offset = _time.time() - clock.monotonic()
+        self.crystal_drift_ppm = CRYSTAL_DRIFT_PPM
+        self.wlan = WlanState(clock)
+        self.ntp_available = True
+        self.resets = []
+
+    # Pins
+
+    def set_pin(self, pin_id, value: int) -> None:
+        value = 1 if value else 0
+        if self.pins.get(pin_id) == value:
+            return
+        self.pins[pin_id] = value
+        history = self.pin_history.get(pin_id)
+        if history is None:
+            history = self.pin_history[pin_id] = deque((), PIN_HISTORY_LENGTH)
+        history.append((self.clock.monotonic(), value))
+        for listener in self.pin_listeners:
+            listener(pin_id, value)
+
+    def get_pin(self, pin_id) -> int:
+        return self.pins.get(pin_id, 0)
+
+    def pin_changed_since(self, pin_id, since: float):
+        """Return the time of the first transition of a pin at or after `since`."""
+        for changed_at, _ in self.pin_history.get(pin_id, ()):
+            if changed_at >= since:
+                return changed_at
+        return None
+
+    # Sensors
+
+    def wire_sensor(
+        self,
+        ads_address: int,
+        ads_channel: int,
+        power_pin,
+        curve: Callable[[float], float] | None = None,
+    ) -> None:
+        """Connect a sensor to an ADS channel, powered through `power_pin`."""
+        key = (ads_address, ads_channel)
+        self.ads_addresses.add(ads_address)
+        self.sensor_power_pins[key] = power_pin
+        if curve is None:
+            curve = default_sensor_curve(len(self.sensor_curves))
+        self.sensor_curves[key] = curve
+
+    def set_sensor_curve(
+        self, ads_address: int, ads_channel: int, curve: Callable[[float], float]
+    ) -> None:
+        """Script the voltage a sensor outputs as a function of virtual time."""
+        self.sensor_curves[(ads_address, ads_channel)] = curve
+
+    def sensor_volts(self, ads_address: int, ads_channel: int) -> float:
+        key = (ads_address, ads_channel)
+        curve = self.sensor_curves.get(key)
+        if curve is None:
+            return 0.0
+        now = self.clock.monotonic()
+        power_pin = self.sensor_power_pins.get(key)
+        if power_pin is None:
+            return curve(now)
+        if not self.get_pin(power_pin):
+            return 0.0
+        # Output ramps up to its final value while the sensor settles
+        powered_at = self.pin_history[power_pin][-1][0]
+        settled = min(1.0, (now - powered_at) / SENSOR_SETTLE_S)
+        return curve(now) * settled
+
+    # Time
+
+    def rtc_time(self) -> float:
+        return self.rtc_offset + self.clock.monotonic()
+
+    def set_rtc_time(self, epoch_seconds: float) -> None:
+        self.rtc_offset = epoch_seconds - self.clock.monotonic()
+
+    def true_time(self, at: float | None = None) -> float:
+        """NTP time at virtual time `at` (default now), the virtual clock runs fast."""
+        if at is None:
+            at = self.clock.monotonic()
+        return self.true_time_offset + at * (1 - self.crystal_drift_ppm / 1e6)
+
+
+class WlanState:
+    """Access point reachability and association state shared by WLAN instances."""
+
+    def __init__(self, clock: VirtualClock) -> None:
+        self.clock = clock
+        self.ap_available = True
+        self.ssid = "irrigation-test"
+        self.bssid = bytes.fromhex("a0b1c2d3e4f5")
+        self.channel = 6
+        self.ip = "192.168.1.42"
+        self.rssi = -61
+        self.status = STAT_IDLE
+        # ifconfig() tuple set by the firmware, None while DHCP is used
+        self.static_ifconfig = None
+        self._connect_started = 0.0
+        self._connect_time_s = 0.0
+        self._bssid_matches = True
+        self.connects = 0
+        # Time from connect() until the link was up, per successful connect
+        self.connect_durations = []
+        self._link_listeners = []
+        self.power_save = False
+        self._power_save_since = 0.0
+        self._power_save_s = 0.0
+
+    def start_connect(self, bssid=None, channel=None) -> None:
+        self.connects += 1
+        self.status = STAT_CONNECTING
+        self._connect_started = self.clock.monotonic()
+        targeted = bssid == self.bssid and channel == self.channel
+        # Joining a BSSID that isn't around fails once the scan is over
+        self._bssid_matches = bssid is None or bssid == self.bssid
+        self._connect_time_s = (
+            (0 if targeted else WLAN_SCAN_S)
+            + WLAN_JOIN_S
+            + (0 if self.static_ifconfig else WLAN_DHCP_S)
+        )
+
+    def poll_status(self) -> int:
+        if self.status == STAT_CONNECTING:
+            elapsed = self.clock.monotonic() - self._connect_started
+            if elapsed >= self._connect_time_s:
+                if self.ap_available and self._bssid_matches:
+                    self.status = STAT_GOT_IP
+                    self.connect_durations.append(elapsed)
+                else:
+                    self.status = STAT_NO_AP_FOUND
+        return self.status
+
+    def scan(self) -> list:
+        """Blocking scan, like the CYW43 driver: returns the access point if it is up."""
+        if not self.ap_available:
+            return []
+        return [(self.ssid.encode(), self.bssid, self.channel, self.rssi, 3, False)]
+
+    def current_ifconfig(self) -> tuple:
+        if self.static_ifconfig:
+            return self.static_ifconfig
+        return (self.ip, "255.255.255.0", "192.168.1.1", "192.168.1.1")
+
+    def set_power_save(self, enabled: bool) -> None:
+        """Track the time the radio spends in a power save mode."""
+        if enabled == self.power_save:
+            return
+        now = self.clock.monotonic()
+        if self.power_save:
+            self._power_save_s += now - self._power_save_since
+        self.power_save = enabled
+        self._power_save_since = now
+
+    def power_save_seconds(self) -> float:
+        if not self.power_save:
+            return self._power_save_s
+        return self._power_save_s + self.clock.monotonic() - self._power_save_since
+
+    def is_connected(self) -> bool:
+        return self.poll_status() == STAT_GOT_IP
+
+    def on_link_down(self, listener: Callable[[], None]) -> None:
+        self._link_listeners.append(listener)
+
+    def drop(self) -> None:
+        """Lose the access point, dropping every connection that runs over it."""
+        self.ap_available = False
+        self.set_link_down()
+
+    def restore(self) -> None:
+        self.ap_available = True
+
+    def set_link_down(self) -> None:
+        was_up = self.status == STAT_GOT_IP
+        self.status = STAT_CONNECT_FAIL
+        if was_up:
+            for listener in self._link_listeners:
+                listener()
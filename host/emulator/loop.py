@@ -0,0 +1,157 @@
+import asyncio
+import selectors
+import threading
+import time
+from types import SimpleNamespace
+
+from .clock import VirtualClock, ticks_add
+
+
+class _VirtualTimeSelector:
+    """Selector that lets the virtual clock jump over idle time.
+
+    When no file descriptor is ready, the loop would block until its next
+    timer. Instead the clock sleeps, which only waits `timeout / speed`
+    real seconds.
+    """
+
+    def __init__(self, clock: VirtualClock) -> None:
+        self._clock = clock
+        self._selector = selectors.DefaultSelector()
+
+    def select(self, timeout=None):
+        events = self._selector.select(0)
+        if events or timeout == 0:
+            return events
+        if timeout is None:
+            # Nothing scheduled: only another thread can wake the loop up
+            return self._selector.select(None)
+        self._clock.sleep(timeout)
+        return self._selector.select(0)
+
+    def __getattr__(self, name):
+        return getattr(self._selector, name)
+
+
+class VirtualTimeEventLoop(asyncio.SelectorEventLoop):
+    """asyncio event loop that schedules on the virtual clock."""
+
+    def __init__(self, clock: VirtualClock) -> None:
+        self._clock = clock
+        # Callback that fires the due machine.Timer callbacks, set by the emulator
+        self.interrupt_handle = None
+        super().__init__(_VirtualTimeSelector(clock))
+
+    def time(self) -> float:
+        return self._clock.monotonic()
+
+    def next_callback_time(self):
+        """When the loop runs its next callback, not counting machine timer interrupts."""
+        if self._ready:
+            return self.time()
+        return min(
+            (
+                handle.when()
+                for handle in self._scheduled
+                if handle is not self.interrupt_handle and not handle.cancelled()
+            ),
+            default=None,
+        )
+
+
+class ThreadSafeFlag:
+    """CPython version of MicroPython's asyncio.ThreadSafeFlag.
+
+    set() may be called from timer callbacks and other threads, a single
+    task waits on it and wait() clears the flag again.
+    """
+
+    def __init__(self) -> None:
+        self._flag = False
+        self._waiter = None
+
+    def set(self) -> None:
+        self._flag = True
+        waiter = self._waiter
+        if waiter is None or waiter.done():
+            return
+        loop = waiter.get_loop()
+        if loop._thread_id == threading.get_ident():
+            waiter.set_result(None)
+        else:
+            loop.call_soon_threadsafe(self._wake, waiter)
+
+    def clear(self) -> None:
+        self._flag = False
+
+    async def wait(self) -> None:
+        if not self._flag:
+            self._waiter = asyncio.get_running_loop().create_future()
+            try:
+                await self._waiter
+            finally:
+                self._waiter = None
+        self._flag = False
+
+    @staticmethod
+    def _wake(waiter) -> None:
+        if not waiter.done():
+            waiter.set_result(None)
+
+
+class SocketStream:
+    """Stand-in for MicroPython's asyncio.StreamReader(sock) on a BrokerSocket.
+
+    Only the zero-length read that parks a task until the socket is
+    readable is supported.
+    """
+
+    def __init__(self, sock, *_) -> None:
+        self._sock = sock
+
+    async def read(self, size: int = -1) -> bytes:
+        await self._sock.wait_readable()
+        if size == 0:
+            return b""
+        return self._sock.read(size) or b""
+
+
+class _QueuedTask:
+    __slots__ = ("ph_key",)
+
+    def __init__(self, ph_key: int) -> None:
+        self.ph_key = ph_key
+
+
+class _TaskQueueHead:
+    """The part of MicroPython's asyncio.core._task_queue the firmware uses: peek().
+
+    The head's `ph_key` is the ticks_ms() time at which the loop runs its
+    next callback.
+    """
+
+    def peek(self):
+        loop = asyncio.get_running_loop()
+        when = loop.next_callback_time()
+        if when is None:
+            return None
+        delay_ms = round((when - loop.time()) * 1000)
+        return _QueuedTask(ticks_add(time.ticks_ms(), delay_ms))
+
+
+async def sleep_ms(ms: int) -> None:
+    await asyncio.sleep(ms / 1000)
+
+
+async def wait_for_ms(awaitable, timeout_ms: int):
+    return await asyncio.wait_for(awaitable, timeout_ms / 1000)
+
+
+def install_asyncio_extensions() -> None:
+    """Add the MicroPython asyncio API the firmware uses to CPython's asyncio."""
+    asyncio.ThreadSafeFlag = ThreadSafeFlag
+    asyncio.sleep_ms = sleep_ms
+    asyncio.wait_for_ms = wait_for_ms
+    asyncio.core = SimpleNamespace(_task_queue=_TaskQueueHead())
+    # Only the package attribute is replaced, asyncio.streams keeps its own class
+    asyncio.StreamReader = SocketStream
@@ -0,0 +1,98 @@
+import struct
+from errno import EAGAIN, EBADF
+
+from .hardware import Board
+
+# Round trip to a pool server and the time a DNS lookup blocks
+NTP_ROUND_TRIP_S = 0.03
+DNS_LOOKUP_S = 0.02
+# Seconds from 1900-01-01, where NTP time starts, to the Unix epoch
+NTP_DELTA = 2208988800
+# lwIP's getaddrinfo() failure, as MicroPython raises it
+EAI_FAIL = -2
+
+
+class NtpServers:
+    """The NTP pool as seen from the board: every host name gets its own server.
+
+    Servers answer with the board's true time, which the RTC drifts away
+    from, as long as the access point is up and `board.ntp_available` is
+    set. Names in `failing_hosts` resolve but never answer.
+    """
+
+    def __init__(self, board: Board, sleep) -> None:
+        self._board = board
+        self._sleep = sleep
+        self._hosts: dict = {}
+        self.failing_hosts: set = set()
+        self.requests = 0
+        self.replies = 0
+
+    def resolve(self, host: str, port: int) -> tuple:
+        self._sleep(DNS_LOOKUP_S)
+        if not self._board.wlan.is_connected():
+            raise OSError(EAI_FAIL)
+        address = self._hosts.get(host)
+        if address is None:
+            address = self._hosts[host] = f"10.0.123.{len(self._hosts) + 1}"
+        return (address, port)
+
+    def request(self, address: tuple):
+        """Send a request, return (arrives_at, reply) or None if nothing comes back."""
+        self.requests += 1
+        host = next((h for h, a in self._hosts.items() if a == address[0]), None)
+        board = self._board
+        if (
+            host is None
+            or host in self.failing_hosts
+            or not board.ntp_available
+            or not board.wlan.is_connected()
+        ):
+            return None
+        self.replies += 1
+        now = board.clock.monotonic()
+        # Stamped by the server halfway through the round trip
+        true_time = board.true_time(now + NTP_ROUND_TRIP_S / 2)
+        seconds = int(true_time)
+        fraction = int((true_time - seconds) * (1 << 32))
+        reply = bytearray(48)
+        # LI 0, version 4, mode 4: server, stratum 2
+        reply[0] = 0x24
+        reply[1] = 2
+        struct.pack_into("!II", reply, 40, seconds + NTP_DELTA, fraction)
+        return now + NTP_ROUND_TRIP_S, bytes(reply)
+
+    def open_socket(self) -> "UdpSocket":
+        return UdpSocket(self, self._board.clock)
+
+
+class UdpSocket:
+    """A non-blocking UDP socket that can only talk to the NTP servers."""
+
+    def __init__(self, servers: NtpServers, clock) -> None:
+        self._servers = servers
+        self._clock = clock
+        self._reply = None
+        self._closed = False
+
+    def setblocking(self, flag: bool) -> None:
+        if flag:
+            raise NotImplementedError("only non-blocking UDP sockets are emulated")
+
+    def sendto(self, buf, address) -> int:
+        if self._closed:
+            raise OSError(EBADF)
+        self._reply = self._servers.request(address)
+        return len(buf)
+
+    def recv(self, size: int) -> bytes:
+        if self._closed:
+            raise OSError(EBADF)
+        reply = self._reply
+        if reply is None or self._clock.monotonic() < reply[0]:
+            raise OSError(EAGAIN)
+        self._reply = None
+        return reply[1][:size]
+
+    def close(self) -> None:
+        self._closed = True
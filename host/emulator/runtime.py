@@ -0,0 +1,551 @@
+import _thread
+import asyncio
+import calendar
+import gc
+import importlib.util
+import json
+import os
+import runpy
+import ssl
+import sys
+import time
+import tracemalloc
+from array import array
+from pathlib import Path
+from typing import Callable
+
+from . import clock as _clock
+from .broker import Broker, BrokerSocket
+from .clock import VirtualClock
+from .core1 import SecondCore
+from .hardware import RTC_RESET_EPOCH, STAT_IDLE, Board
+from .loop import VirtualTimeEventLoop, install_asyncio_extensions
+from .ntp import NtpServers
+
+HOST_DIR = Path(__file__).resolve().parents[1]
+REPO_DIR = HOST_DIR.parent
+FIRMWARE_DIR = REPO_DIR / "src"
+STUBS_DIR = HOST_DIR / "stubs"
+
+# Usable MicroPython heap on a Pico 2 W. gc.mem_alloc() reports the bytes the
+# firmware allocated and gc.mem_free() what is left of this
+HEAP_SIZE = 480 * 1024
+MEM_SNAPSHOT_INTERVAL_S = 1.0
+# The rp2 port rejects longer watchdog timeouts
+WDT_MAX_TIMEOUT_MS = 8388
+# How often the event loop lag probe fires, in virtual seconds
+LAG_PROBE_INTERVAL_S = 0.1
+BROKER_TICK_INTERVAL_S = 1.0
+
+_real_gmtime = time.gmtime
+_real_collect = gc.collect
+
+_current = None
+
+
+def current() -> "Emulator":
+    """Return the installed emulator, for the stand-in modules."""
+    if _current is None:
+        raise RuntimeError("Host emulation is not installed, run through host/run.py")
+    return _current
+
+
+class MachineReset(SystemExit):
+    """Raised by machine.reset(), ends the current boot of the firmware."""
+
+
+class EmulationFinished(SystemExit):
+    """Raised when the configured run duration has elapsed."""
+
+
+class _HostSSLContext:
+    """Stand-in for MicroPython's ssl.SSLContext that skips the handshake.
+
+    The certificate paths are recorded but the files don't need to exist.
+    """
+
+    def __init__(self, protocol=None) -> None:
+        self.protocol = protocol
+        self.verify_mode = None
+        self.cafile = None
+        self.certfile = None
+
+    def load_verify_locations(self, cafile=None, cadata=None) -> None:
+        self.cafile = cafile
+
+    def load_cert_chain(self, certfile, keyfile=None) -> None:
+        self.certfile = certfile
+
+    def wrap_socket(self, sock, server_side=False, server_hostname=None, **_):
+        return sock.wrap_tls()
+
+
+class _HardwareWatchdog:
+    """Owner of the watchdog's timer, it can't be stopped once started."""
+
+    def __init__(self, timeout_ms: int) -> None:
+        self.timeout_ms = timeout_ms
+
+
+class _Timer:
+    __slots__ = ("deadline", "period", "periodic", "callback", "owner")
+
+    def __init__(self, deadline, period, periodic, callback, owner) -> None:
+        self.deadline = deadline
+        self.period = period
+        self.periodic = periodic
+        self.callback = callback
+        self.owner = owner
+
+
+class Emulator:
+    """Runs the unmodified firmware from src/ under CPython.
+
+    The stand-in modules in host/stubs delegate to the emulator returned by
+    current(): machine timers, pins, the RTC, WLAN, NTP, the ADS1115 and the
+    MQTT broker all live here and share one virtual clock. Scenario events
+    are scheduled with at() in virtual seconds since the emulator started.
+    """
+
+    def __init__(
+        self,
+        speed: float = float("inf"),
+        work_dir: str | None = None,
+        trace_memory: bool = True,
+        heap_size: int = HEAP_SIZE,
+    ) -> None:
+        self.clock = VirtualClock(speed)
+        self.board = Board(self.clock)
+        self.broker = Broker(self.clock, self.board.wlan.is_connected, self.sleep)
+        self.board.wlan.on_link_down(self.broker.link_down)
+        self.ntp = NtpServers(self.board, self.sleep)
+        self.board.pin_listeners.append(self.on_pin_change)
+        self.core1 = SecondCore(self)
+        self.work_dir = Path(work_dir) if work_dir else None
+        self.trace_memory = trace_memory
+        self.heap_size = heap_size
+        self._emulator_bytes = 0
+        self._emulator_bytes_at = float("-inf")
+        self.loop = None
+        self.boots = 0
+        self.end_time = None
+        self.lags = array("d")
+        self.command_latencies = []
+        self.lightsleep_s = 0.0
+        self._pending_commands = []
+        self._timers: dict = {}
+        self._watchdog = None
+        self.watchdog_resets = []
+        self._timer_handle = None
+        # The emulator's own periodic callbacks, cancelled with their loop
+        self._tick_handle = None
+        self._probe_handle = None
+        self._events = []
+        self._sockets = []
+        self._started_real = _clock.real_monotonic()
+
+    # Installation
+
+    def install(self) -> None:
+        """Make the MicroPython API importable and route time through the virtual clock."""
+        global _current
+        _current = self
+        for path in (str(FIRMWARE_DIR), str(STUBS_DIR)):
+            if path not in sys.path:
+                sys.path.insert(0, path)
+
+        time.sleep = self.sleep
+        time.sleep_ms = lambda ms: self.sleep(ms / 1000)
+        time.sleep_us = lambda us: self.sleep(us / 1_000_000)
+        time.ticks_ms = self.clock.ticks_ms
+        time.ticks_us = self.clock.ticks_us
+        time.ticks_cpu = self.clock.ticks_us
+        time.ticks_add = _clock.ticks_add
+        time.ticks_diff = _clock.ticks_diff
+        # MicroPython has no time zones, the RTC runs in UTC
+        time.time = lambda: int(self.board.rtc_time())
+        time.gmtime = self._gmtime
+        time.localtime = self._gmtime
+        time.mktime = lambda t: calendar.timegm(tuple(t[:6]) + (0, 0, 0))
+
+        if self.trace_memory:
+            tracemalloc.start()
+        gc.mem_alloc = self._mem_alloc
+        gc.mem_free = lambda: self.heap_size - self._mem_alloc()
+        gc.collect = self._collect
+        ssl.SSLContext = _HostSSLContext
+        # asyncio already holds CPython's socket module, later imports of
+        # `socket` from the firmware get the UDP stand-in
+        sys.modules["socket"] = _load_stub("socket")
+        # The emulator's own threads are started through `threading`
+        _thread.start_new_thread = self.core1.start_new_thread
+        install_asyncio_extensions()
+        asyncio.run = self._run_on_virtual_loop
+
+        if self.work_dir is not None:
+            self.work_dir.mkdir(parents=True, exist_ok=True)
+            os.chdir(self.work_dir)
+
+    def wire_config(self, config_path: str = "./config.json") -> None:
+        """Wire a sensor to every ADS channel and MOSFET pin named in the config."""
+        with open(config_path) as config_file:
+            conf = json.load(config_file)
+        self.board.wlan.ssid = conf["network"]["wifi_ssid"]
+        for point in conf["irrigation_points"]:
+            self.board.wire_sensor(
+                int(point["ads_address"], 16), point["ads_channel"], point["mosfet_pin"]
+            )
+
+    # Running
+
+    def run_firmware(
+        self, duration_s: float, reboot: bool = True, script: str | None = None
+    ) -> None:
+        """Boot src/main.py and keep it running for `duration_s` virtual seconds.
+
+        machine.reset() reboots the firmware with fresh module state, like a
+        power cycle, unless `reboot` is False. `script` runs another file
+        instead of main.py, e.g. one of the benchmarks in src/benchmarks.
+        """
+        self.end_time = self.clock.monotonic() + duration_s
+        script = script or str(FIRMWARE_DIR / "main.py")
+        while True:
+            self.boots += 1
+            try:
+                runpy.run_path(script, run_name="__main__")
+                return
+            except EmulationFinished:
+                return
+            except MachineReset:
+                self.board.resets.append(self.clock.monotonic())
+                self._power_cycle()
+                if not reboot:
+                    return
+            finally:
+                self._close_loop()
+
+    def at(self, seconds: float, action: Callable[[], None]) -> None:
+        """Run `action` once the virtual clock reaches `seconds`."""
+        self._events.append((seconds, action))
+        if self.loop is not None:
+            self._schedule_event(seconds, action)
+
+    def send_command(self, seconds: float, topic: str, payload: str, pin) -> None:
+        """Publish a command at `seconds` and record how long until `pin` changes."""
+
+        def send() -> None:
+            self._pending_commands.append((pin, self.clock.monotonic()))
+            # Home Assistant publishes valve commands with the QoS 1 of their discovery
+            self.broker.publish(topic, payload, qos=1)
+
+        self.at(seconds, send)
+
+    def sleep(self, seconds: float) -> None:
+        """Blocking sleep that still fires machine.Timer callbacks, like soft IRQs."""
+        if self.core1.is_current():
+            self.core1.sleep(seconds)
+            return
+        end = self.clock.monotonic() + seconds
+        while True:
+            now = self.clock.monotonic()
+            if self.end_time is not None and now >= self.end_time:
+                raise EmulationFinished()
+            deadline = self._next_timer_deadline()
+            if self.end_time is not None:
+                deadline = min(deadline or self.end_time, self.end_time)
+            if deadline is None or deadline >= end:
+                self.clock.sleep(end - now)
+                return
+            self.clock.sleep(deadline - now)
+            self._fire_due_timers()
+
+    # machine API
+
+    def machine_reset(self) -> None:
+        raise MachineReset()
+
+    def lightsleep(self, time_ms=None) -> None:
+        """Sleep until `time_ms` passed or, like the CYW43 wake interrupt, the outside world acts.
+
+        Scenario events and broker traffic are callbacks on the event loop,
+        so the sleep ends at the loop's next callback at the latest.
+        """
+        now = self.clock.monotonic()
+        end = now + (time_ms / 1000 if time_ms is not None else float("inf"))
+        wake = self.loop.next_callback_time() if self.loop is not None else None
+        if wake is not None:
+            end = min(end, wake)
+        if end == float("inf"):
+            raise ValueError("lightsleep without timeout or wake source")
+        self.sleep(end - now)
+        self.lightsleep_s += self.clock.monotonic() - now
+
+    def start_timer(self, owner, period_ms: int, periodic: bool, callback) -> None:
+        period = max(period_ms, 1) / 1000
+        self._timers[owner] = _Timer(
+            self.clock.monotonic() + period, period, periodic, callback, owner
+        )
+        self._arm_timer_handle()
+
+    def stop_timer(self, owner) -> None:
+        if self._timers.pop(owner, None) is not None:
+            self._arm_timer_handle()
+
+    def start_watchdog(self, timeout_ms: int) -> None:
+        if not 1 <= timeout_ms <= WDT_MAX_TIMEOUT_MS:
+            raise ValueError("timeout out of range")
+        self._watchdog = _HardwareWatchdog(timeout_ms)
+        self.feed_watchdog()
+
+    def feed_watchdog(self) -> None:
+        watchdog = self._watchdog
+        timer = self._timers.get(watchdog)
+        if timer is None:
+            self.start_timer(
+                watchdog, watchdog.timeout_ms, False, self._watchdog_expired
+            )
+            return
+        # Like the device, feeding only reloads a counter. Moving the deadline
+        # later needs no re-arm, an early wake-up finds nothing due
+        timer.deadline = self.clock.monotonic() + watchdog.timeout_ms / 1000
+
+    def _watchdog_expired(self, _) -> None:
+        self.watchdog_resets.append(self.clock.monotonic())
+        raise MachineReset()
+
+    def open_socket(self) -> BrokerSocket:
+        sock = BrokerSocket(self.broker)
+        self._sockets.append(sock)
+        return sock
+
+    def on_pin_change(self, pin_id, value: int) -> None:
+        still_pending = []
+        for pin, sent_at in self._pending_commands:
+            if pin == pin_id:
+                self.command_latencies.append(self.clock.monotonic() - sent_at)
+            else:
+                still_pending.append((pin, sent_at))
+        self._pending_commands = still_pending
+
+    # Reporting
+
+    def report(self) -> dict:
+        """Summarize the run: timing, loop lag, memory, recovery and MQTT traffic."""
+        virtual_s = self.clock.monotonic()
+        real_s = _clock.real_monotonic() - self._started_real
+        lags = sorted(self.lags)
+        report = {
+            "virtual_s": round(virtual_s, 1),
+            "real_s": round(real_s, 2),
+            "speedup": round(virtual_s / real_s, 1) if real_s else None,
+            "boots": self.boots,
+            "resets_at_s": [round(t, 1) for t in self.board.resets],
+            "watchdog_resets_at_s": [round(t, 1) for t in self.watchdog_resets],
+            "wifi_connects": self.board.wlan.connects,
+            "wifi_connect_ms": [
+                round(t * 1000) for t in self.board.wlan.connect_durations
+            ],
+            "loop_lag_ms": {
+                "p50": _percentile_ms(lags, 50),
+                "p99": _percentile_ms(lags, 99),
+                "max": _percentile_ms(lags, 100),
+            },
+            "command_latency_ms": [round(t * 1000, 1) for t in self.command_latencies],
+            "power": {
+                "lightsleep_fraction": round(self.lightsleep_s / virtual_s, 3),
+                "wlan_power_save_fraction": round(
+                    self.board.wlan.power_save_seconds() / virtual_s, 3
+                ),
+            },
+            "ntp": {"requests": self.ntp.requests, "replies": self.ntp.replies},
+            "mqtt": {
+                key: value
+                for key, value in self.broker.stats.items()
+                if key != "packets_in"
+            },
+            "mqtt_packets_in": dict(self.broker.stats["packets_in"]),
+        }
+        if self.trace_memory:
+            traced, peak = tracemalloc.get_traced_memory()
+            report["memory"] = {
+                "firmware_bytes": _firmware_bytes(),
+                "traced_bytes": traced,
+                "peak_bytes": peak,
+            }
+        return report
+
+    # Internals
+
+    def _run_on_virtual_loop(self, coro):
+        self._close_loop()
+        self.loop = VirtualTimeEventLoop(self.clock)
+        self.loop.set_exception_handler(_ignore_resets)
+        asyncio.set_event_loop(self.loop)
+        now = self.clock.monotonic()
+        for seconds, action in self._events:
+            if seconds >= now:
+                self._schedule_event(seconds, action)
+        self._tick_handle = self.loop.call_at(
+            now + BROKER_TICK_INTERVAL_S, self._broker_tick
+        )
+        self._probe_handle = self.loop.call_at(
+            now + LAG_PROBE_INTERVAL_S, self._probe_lag, now
+        )
+        if self.end_time is not None:
+            self.loop.call_at(self.end_time, self._finish)
+        self._arm_timer_handle()
+        return self.loop.run_until_complete(coro)
+
+    def _close_loop(self) -> None:
+        loop = self.loop
+        if loop is None or loop.is_running():
+            return
+        # Cancelling the tasks below runs the old loop once more, its
+        # periodic callbacks would find self.loop gone
+        for handle in (self._timer_handle, self._tick_handle, self._probe_handle):
+            if handle is not None:
+                handle.cancel()
+        self.loop = None
+        self._timer_handle = None
+        self._tick_handle = None
+        self._probe_handle = None
+        tasks = asyncio.all_tasks(loop)
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            end_time, self.end_time = self.end_time, None
+            try:
+                loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            except SystemExit:
+                pass
+            self.end_time = end_time
+        loop.close()
+        asyncio.set_event_loop(None)
+
+    def _power_cycle(self) -> None:
+        """Reset the board the way machine.reset() would."""
+        self.core1.stop()
+        # A reset disables the watchdog until the firmware starts it again
+        self._watchdog = None
+        self._timers.clear()
+        for sock in self._sockets:
+            sock.abandon()
+        self._sockets.clear()
+        for pin_id in list(self.board.pins):
+            self.board.set_pin(pin_id, 0)
+        self.board.set_rtc_time(RTC_RESET_EPOCH)
+        self.board.wlan.status = STAT_IDLE
+        self.board.wlan.static_ifconfig = None
+        self.board.wlan.set_power_save(False)
+        firmware_dir = str(FIRMWARE_DIR)
+        for name, module in list(sys.modules.items()):
+            module_file = getattr(module, "__file__", None) or ""
+            if module_file.startswith(firmware_dir):
+                del sys.modules[name]
+
+    def _schedule_event(self, seconds: float, action) -> None:
+        self.loop.call_at(seconds, action)
+
+    def _finish(self) -> None:
+        raise EmulationFinished()
+
+    def _broker_tick(self) -> None:
+        self.broker.tick()
+        self._tick_handle = self.loop.call_at(
+            self.loop.time() + BROKER_TICK_INTERVAL_S, self._broker_tick
+        )
+
+    def _probe_lag(self, scheduled: float) -> None:
+        now = self.loop.time()
+        self.lags.append(now - scheduled - LAG_PROBE_INTERVAL_S)
+        self._probe_handle = self.loop.call_at(
+            now + LAG_PROBE_INTERVAL_S, self._probe_lag, now
+        )
+
+    def _next_timer_deadline(self):
+        if not self._timers:
+            return None
+        return min(timer.deadline for timer in self._timers.values())
+
+    def _fire_due_timers(self) -> None:
+        now = self.clock.monotonic()
+        due = [timer for timer in self._timers.values() if timer.deadline <= now]
+        for timer in sorted(due, key=lambda t: t.deadline):
+            if self._timers.get(timer.owner) is not timer:
+                continue
+            if timer.periodic:
+                timer.deadline += timer.period
+            else:
+                del self._timers[timer.owner]
+            timer.callback(timer.owner)
+        self._arm_timer_handle()
+
+    def _arm_timer_handle(self) -> None:
+        if self.loop is None or self.loop.is_closed():
+            return
+        if self._timer_handle is not None:
+            self._timer_handle.cancel()
+            self._timer_handle = None
+        deadline = self._next_timer_deadline()
+        if deadline is not None:
+            self._timer_handle = self.loop.call_at(deadline, self._on_timer_due)
+        self.loop.interrupt_handle = self._timer_handle
+
+    def _on_timer_due(self) -> None:
+        self._timer_handle = None
+        self._fire_due_timers()
+
+    def _mem_alloc(self) -> int:
+        if not tracemalloc.is_tracing():
+            return 0
+        # A snapshot is slow, so the emulator's share of the traced bytes is
+        # refreshed once per virtual second and after a collection. In
+        # between, what is allocated or freed counts for the firmware, so a
+        # tight loop measuring its own allocations sees exact differences
+        now = self.clock.monotonic()
+        if now - self._emulator_bytes_at >= MEM_SNAPSHOT_INTERVAL_S:
+            firmware = _firmware_bytes()
+            # Read after the snapshot, which leaves a few KB in CPython's
+            # free lists
+            traced = tracemalloc.get_traced_memory()[0]
+            self._emulator_bytes = traced - firmware
+            self._emulator_bytes_at = now
+            return firmware
+        return tracemalloc.get_traced_memory()[0] - self._emulator_bytes
+
+    def _collect(self) -> None:
+        _real_collect()
+        # The collection freed the emulator's garbage too
+        self._emulator_bytes_at = float("-inf")
+
+    def _gmtime(self, secs=None):
+        return _real_gmtime(self.board.rtc_time() if secs is None else secs)
+
+
+def _firmware_bytes() -> int:
+    """Live bytes allocated from src/, not by the emulator, asyncio or CPython itself."""
+    firmware = tracemalloc.take_snapshot().filter_traces(
+        [tracemalloc.Filter(True, str(FIRMWARE_DIR / "*"))]
+    )
+    return sum(stat.size for stat in firmware.statistics("filename"))
+
+
+def _load_stub(name: str):
+    spec = importlib.util.spec_from_file_location(name, STUBS_DIR / f"{name}.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _ignore_resets(loop, context) -> None:
+    # A task that called machine.reset() has no one to retrieve its exception
+    if isinstance(context.get("exception"), SystemExit):
+        return
+    loop.default_exception_handler(context)
+
+
+def _percentile_ms(sorted_values, percentile: int):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, len(sorted_values) * percentile // 100)
+    return round(sorted_values[index] * 1000, 3)
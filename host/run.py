@@ -0,0 +1,129 @@
+"""Run the firmware from src/ on the host under the emulator.
+
+Example: one simulated day with a broker outage between 02:00 and 03:00
+and a valve command after an hour, without the firmware's log output:
+
+    python3 host/run.py --duration 86400 --broker-outage 7200:10800 \\
+        --command 3600:irrigation/<station_id>/<point_id>/valve/set:OPEN:2 --quiet
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import runpy
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+from emulator import Emulator
+from emulator.runtime import REPO_DIR
+
+
+def _parse_window(value: str) -> tuple:
+    start, end = value.split(":")
+    return float(start), float(end)
+
+
+def _parse_command(value: str) -> tuple:
+    at, topic, payload, pin = value.split(":")
+    return float(at), topic, payload, int(pin)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--config",
+        default=str(REPO_DIR / "config.template.json"),
+        help="station config.json to boot with (default: config.template.json)",
+    )
+    parser.add_argument(
+        "--duration", type=float, default=3600, help="virtual seconds to run"
+    )
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=float("inf"),
+        help="idle time speed-up factor, 1 runs in real time (default: unlimited)",
+    )
+    parser.add_argument(
+        "--work-dir", help="directory for the device filesystem (default: temporary)"
+    )
+    parser.add_argument(
+        "--broker-outage",
+        type=_parse_window,
+        action="append",
+        default=[],
+        metavar="START:END",
+        help="take the MQTT broker down between two virtual times",
+    )
+    parser.add_argument(
+        "--wifi-outage",
+        type=_parse_window,
+        action="append",
+        default=[],
+        metavar="START:END",
+        help="take the access point down between two virtual times",
+    )
+    parser.add_argument(
+        "--command",
+        type=_parse_command,
+        action="append",
+        default=[],
+        metavar="AT:TOPIC:PAYLOAD:PIN",
+        help="publish a command and measure the latency until PIN changes",
+    )
+    parser.add_argument(
+        "--scenario",
+        action="append",
+        default=[],
+        help="python file with a `scenario(emulator)` function to script events,"
+        " can be given more than once",
+    )
+    parser.add_argument(
+        "--script",
+        help="run this file instead of src/main.py, e.g. a benchmark from src/benchmarks",
+    )
+    parser.add_argument(
+        "--no-reboot",
+        action="store_true",
+        help="stop at the first machine.reset() instead of rebooting",
+    )
+    parser.add_argument(
+        "--quiet", action="store_true", help="hide the firmware's printed log output"
+    )
+    args = parser.parse_args()
+    # The emulator changes into the work dir, resolve paths relative to the caller
+    script = str(Path(args.script).resolve()) if args.script else None
+    scenarios = [str(Path(scenario).resolve()) for scenario in args.scenario]
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="irrigation-host-")
+    Path(work_dir).mkdir(parents=True, exist_ok=True)
+    shutil.copy(args.config, Path(work_dir) / "config.json")
+
+    emulator = Emulator(speed=args.speed, work_dir=work_dir)
+    emulator.install()
+    emulator.wire_config()
+    for start, end in args.broker_outage:
+        emulator.at(start, emulator.broker.stop)
+        emulator.at(end, emulator.broker.start)
+    for start, end in args.wifi_outage:
+        emulator.at(start, emulator.board.wlan.drop)
+        emulator.at(end, emulator.board.wlan.restore)
+    for at, topic, payload, pin in args.command:
+        emulator.send_command(at, topic, payload, pin)
+    for scenario in scenarios:
+        runpy.run_path(scenario)["scenario"](emulator)
+
+    output = io.StringIO() if args.quiet else sys.stdout
+    with contextlib.redirect_stdout(output):
+        emulator.run_firmware(args.duration, reboot=not args.no_reboot, script=script)
+
+    report = emulator.report()
+    report["work_dir"] = work_dir
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,27 @@
+"""Host stand-in for robert-hh's `ads1x15` driver, sampling the emulated sensor curves."""
+
+from emulator import current
+from emulator.hardware import ADS_GAIN_VOLTS, ADS_RATES_SPS, I2C_TRANSACTION_S
+
+
+class ADS1115:
+    def __init__(self, i2c, address=0x48, gain=1) -> None:
+        if address not in current().board.ads_addresses:
+            raise OSError(19)  # ENODEV, nothing acknowledges this address
+        self.i2c = i2c
+        self.address = address
+        self.gain = gain
+
+    def read(self, rate=4, channel1=0, channel2=None) -> int:
+        """Single-shot conversion, blocking for one sample period like the driver."""
+        emulator = current()
+        # Config write, busy polling and result read take a few I2C transactions
+        emulator.sleep(1 / ADS_RATES_SPS[rate] + 3 * I2C_TRANSACTION_S)
+        volts = emulator.board.sensor_volts(self.address, channel1)
+        if channel2 is not None:
+            volts -= emulator.board.sensor_volts(self.address, channel2)
+        raw = int(volts / ADS_GAIN_VOLTS[self.gain] * 32768)
+        return max(-32768, min(32767, raw))
+
+    def raw_to_v(self, raw: int) -> float:
+        return raw * ADS_GAIN_VOLTS[self.gain] / 32768
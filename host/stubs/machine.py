@@ -0,0 +1,113 @@
+"""Host stand-in for MicroPython's `machine` module on the rp2 port."""
+
+from emulator import current
+
+
+def unique_id() -> bytes:
+    return current().board.unique_id
+
+
+def reset() -> None:
+    current().machine_reset()
+
+
+def freq(hz=None):
+    return 150_000_000
+
+
+def lightsleep(time_ms=None) -> None:
+    current().lightsleep(time_ms)
+
+
+class Pin:
+    IN = 0
+    OUT = 1
+    OPEN_DRAIN = 2
+    PULL_UP = 1
+    PULL_DOWN = 2
+
+    def __init__(self, id, mode=-1, pull=-1, *, value=None) -> None:
+        self._id = id
+        if value is not None:
+            self.value(value)
+
+    def init(self, mode=-1, pull=-1, *, value=None) -> None:
+        if value is not None:
+            self.value(value)
+
+    def value(self, value=None):
+        board = current().board
+        if value is None:
+            return board.get_pin(self._id)
+        board.set_pin(self._id, value)
+
+    def on(self) -> None:
+        self.value(1)
+
+    def off(self) -> None:
+        self.value(0)
+
+    high = on
+    low = off
+
+    def toggle(self) -> None:
+        self.value(not self.value())
+
+    def __call__(self, value=None):
+        return self.value(value)
+
+    def __repr__(self) -> str:
+        return f"Pin({self._id})"
+
+
+class I2C:
+    def __init__(self, id, *, scl=None, sda=None, freq=400_000) -> None:
+        self._id = id
+
+    def scan(self) -> list:
+        return sorted(current().board.ads_addresses)
+
+
+class Timer:
+    """Software timer, callbacks run like soft IRQs: between tasks or during sleeps."""
+
+    ONE_SHOT = 0
+    PERIODIC = 1
+
+    def __init__(self, id=-1, **kwargs) -> None:
+        if kwargs:
+            self.init(**kwargs)
+
+    def init(self, *, mode=PERIODIC, period=-1, freq=-1, callback=None) -> None:
+        if freq > 0:
+            period = 1000 // freq
+        current().start_timer(self, period, mode == Timer.PERIODIC, callback)
+
+    def deinit(self) -> None:
+        current().stop_timer(self)
+
+
+class WDT:
+    """Hardware watchdog: power cycles the board unless fed within `timeout` ms."""
+
+    def __init__(self, id=0, timeout=5000) -> None:
+        current().start_watchdog(timeout)
+
+    def feed(self) -> None:
+        current().feed_watchdog()
+
+
+class RTC:
+    def datetime(self, datetimetuple=None):
+        """Get or set (year, month, day, weekday, hours, minutes, seconds, subseconds)."""
+        board = current().board
+        if datetimetuple is not None:
+            year, month, day, _, hours, minutes, seconds = datetimetuple[:7]
+            from time import mktime
+
+            board.set_rtc_time(mktime((year, month, day, hours, minutes, seconds)))
+            return None
+        from time import gmtime
+
+        t = gmtime(int(board.rtc_time()))
+        return (t[0], t[1], t[2], t[6], t[3], t[4], t[5], 0)
@@ -0,0 +1,30 @@
+"""Host stand-in for the `micropython` module."""
+
+
+def const(value):
+    return value
+
+
+def native(function):
+    return function
+
+
+viper = native
+
+
+def opt_level(level=None):
+    return 0
+
+
+def alloc_emergency_exception_buf(size: int) -> None:
+    pass
+
+
+def schedule(function, arg) -> None:
+    function(arg)
+
+
+def mem_info(verbose=False) -> None:
+    import gc
+
+    print(f"mem: total={gc.mem_alloc() + gc.mem_free()}, used={gc.mem_alloc()}")
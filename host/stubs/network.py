@@ -0,0 +1,79 @@
+"""Host stand-in for MicroPython's `network` module, backed by the emulated access point."""
+
+from emulator import current
+from emulator.hardware import (
+    STAT_CONNECT_FAIL,
+    STAT_CONNECTING,
+    STAT_GOT_IP,
+    STAT_IDLE,
+    STAT_NO_AP_FOUND,
+    WLAN_SCAN_S,
+)
+
+STA_IF = 0
+AP_IF = 1
+STAT_WRONG_PASSWORD = -3
+
+
+class WLAN:
+    PM_NONE = 0x10
+    PM_PERFORMANCE = 0xA11142
+    PM_POWERSAVE = 0x111022
+
+    def __init__(self, interface_id: int = STA_IF) -> None:
+        self._active = False
+
+    def active(self, is_active=None):
+        if is_active is None:
+            return self._active
+        self._active = bool(is_active)
+        if not self._active:
+            wlan = current().board.wlan
+            wlan.set_link_down()
+            # Reinitializing the interface drops a static IP, DHCP is back on,
+            # and the power management mode returns to the default
+            wlan.static_ifconfig = None
+            wlan.set_power_save(False)
+
+    def connect(self, ssid=None, key=None, *, bssid=None, channel=0) -> None:
+        current().board.wlan.start_connect(bssid, channel)
+
+    def scan(self) -> list:
+        current().sleep(WLAN_SCAN_S)
+        return current().board.wlan.scan()
+
+    def disconnect(self) -> None:
+        wlan = current().board.wlan
+        wlan.set_link_down()
+        wlan.status = STAT_IDLE
+
+    def isconnected(self) -> bool:
+        return current().board.wlan.is_connected()
+
+    def status(self, param=None):
+        wlan = current().board.wlan
+        if param == "rssi":
+            return wlan.rssi
+        return wlan.poll_status()
+
+    def ifconfig(self, config=None):
+        wlan = current().board.wlan
+        if config is None:
+            return wlan.current_ifconfig()
+        wlan.static_ifconfig = tuple(config)
+
+    def config(self, *args, **kwargs):
+        wlan = current().board.wlan
+        if "pm" in kwargs:
+            wlan.set_power_save(kwargs["pm"] == WLAN.PM_POWERSAVE)
+        if args == ("pm",):
+            return WLAN.PM_POWERSAVE if wlan.power_save else WLAN.PM_PERFORMANCE
+        if args == ("mac",):
+            return current().board.unique_id[:6]
+        if args == ("rssi",):
+            return wlan.rssi
+        if args == ("channel",):
+            return wlan.channel
+        if args == ("ssid",):
+            return wlan.ssid
+        return None
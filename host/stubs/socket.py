@@ -0,0 +1,23 @@
+"""Host stand-in for MicroPython's `socket` module, for UDP to the emulated NTP servers.
+
+The emulator installs this as `socket` once CPython's own socket module is
+loaded, so only the firmware sees it. MQTT doesn't go through here, the
+umqtt.simple stand-in opens its broker connection directly.
+"""
+
+from emulator import current
+
+AF_INET = 2
+SOCK_STREAM = 1
+SOCK_DGRAM = 2
+
+
+def getaddrinfo(host, port, af=0, type=0, proto=0, flags=0) -> list:
+    address = current().ntp.resolve(host, port)
+    return [(AF_INET, SOCK_DGRAM, 0, "", address)]
+
+
+def socket(af=AF_INET, type=SOCK_STREAM, proto=0):
+    if type != SOCK_DGRAM:
+        raise NotImplementedError("only UDP sockets are emulated")
+    return current().ntp.open_socket()
@@ -0,0 +1,56 @@
+"""Runs host/run.py in a subprocess, every emulation patches process-wide modules."""
+
+import json
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+HOST_DIR = Path(__file__).resolve().parent.parent
+CONFIG_TEMPLATE_PATH = HOST_DIR.parent / "config.template.json"
+SCENARIO_DIR = Path(__file__).resolve().parent / "scenarios"
+
+
+def run_emulator(duration: float, *args: str) -> dict:
+    """Emulate `duration` virtual seconds and return the JSON report."""
+    result = subprocess.run(
+        [
+            sys.executable,
+            str(HOST_DIR / "run.py"),
+            "--duration",
+            str(duration),
+            "--quiet",
+            *args,
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(result.stdout)
+
+
+def scenario(name: str) -> str:
+    """Arguments for run_emulator() that script a run with scenarios/`name`.py."""
+    return f"--scenario={SCENARIO_DIR / name}.py"
+
+
+def read_log(report: dict) -> str:
+    """The firmware's log file of an emulated run."""
+    return (Path(report["work_dir"]) / "log.txt").read_text()
+
+
+def read_messages(report: dict) -> list:
+    """(time, topic, payload) of the messages recorded by a scenario."""
+    with open(Path(report["work_dir"]) / "messages.txt") as messages:
+        return [tuple(line.rstrip("\n").split("\t")) for line in messages]
+
+
+def write_config(**options) -> str:
+    """Write config.template.json with `options` replaced, return the path."""
+    conf = json.loads(CONFIG_TEMPLATE_PATH.read_text())
+    conf.update(options)
+    with tempfile.NamedTemporaryFile(
+        "w", prefix="config-", suffix=".json", delete=False
+    ) as config_file:
+        json.dump(conf, config_file)
+    return config_file.name
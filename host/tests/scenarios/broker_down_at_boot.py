@@ -0,0 +1,8 @@
+"""The broker is unreachable when the station boots and comes back after 10 minutes."""
+
+BROKER_BACK_AT_S = 600
+
+
+def scenario(emulator):
+    emulator.broker.stop()
+    emulator.at(BROKER_BACK_AT_S, emulator.broker.start)
@@ -0,0 +1,12 @@
+"""The station's connection to the broker goes half-open before a broker connectivity test.
+
+The station sends its first QoS 1 connectivity test 30 minutes after setup.
+The broker keeps the connection open without answering it, new connections
+are served.
+"""
+
+BROKER_HANGS_AT_S = 1700
+
+
+def scenario(emulator):
+    emulator.at(BROKER_HANGS_AT_S, emulator.broker.hang)
@@ -0,0 +1,9 @@
+"""The broker is down for an hour, the readings taken meanwhile are replayed."""
+
+BROKER_DOWN_AT_S = 600
+BROKER_BACK_AT_S = 4200
+
+
+def scenario(emulator):
+    emulator.at(BROKER_DOWN_AT_S, emulator.broker.stop)
+    emulator.at(BROKER_BACK_AT_S, emulator.broker.start)
@@ -0,0 +1,12 @@
+"""The station reboots with a cached access point, but the broker can't be reached."""
+
+import json
+
+BROKER_BACK_AT_S = 600
+
+
+def scenario(emulator):
+    cache = {"bssid": emulator.board.wlan.bssid.hex(), "channel": 6}
+    (emulator.work_dir / "wifi-cache.json").write_text(json.dumps(cache))
+    emulator.broker.stop()
+    emulator.at(BROKER_BACK_AT_S, emulator.broker.start)
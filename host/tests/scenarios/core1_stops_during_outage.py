@@ -0,0 +1,15 @@
+"""Core 1 stops during a broker outage, the stalled sweeps reset the station.
+
+Readings queued since the outage began are still batched in RAM when the
+watchdog resets the station for the stalled sweeps.
+"""
+
+BROKER_DOWN_AT_S = 600
+CORE1_STOPS_AT_S = 1500
+BROKER_BACK_AT_S = 3000
+
+
+def scenario(emulator):
+    emulator.at(BROKER_DOWN_AT_S, emulator.broker.stop)
+    emulator.at(CORE1_STOPS_AT_S, emulator.core1.stop)
+    emulator.at(BROKER_BACK_AT_S, emulator.broker.start)
@@ -0,0 +1,29 @@
+"""Home Assistant comes back online, the station republishes everything.
+
+Writes the station's messages after the restart to ha_restart.txt in the work
+dir, one line per message: `write<TAB>topic`, where `write` numbers the socket
+writes (TLS records) they arrived in.
+"""
+
+from emulator.broker import EXTERNAL_CLIENT_ID
+
+HA_RESTART_AT_S = 1000
+# Long enough for the station to answer, too short for a periodic publish
+RECORD_FOR_S = 5
+
+
+def scenario(emulator):
+    broker = emulator.broker
+    log = open(emulator.work_dir / "ha_restart.txt", "w")
+
+    def record(message):
+        if message.client_id == EXTERNAL_CLIENT_ID:
+            return
+        if HA_RESTART_AT_S <= message.time < HA_RESTART_AT_S + RECORD_FOR_S:
+            log.write(f"{broker.stats['writes']}\t{message.topic}\n")
+            log.flush()
+
+    broker.observe("#", record)
+    emulator.at(
+        HA_RESTART_AT_S, lambda: broker.publish("homeassistant/status", "online")
+    )
@@ -0,0 +1,15 @@
+"""Write the firmware's moisture for every raw ADS1115 reading from 0 to 5 V.
+
+One value per line in raw_to_moisture.txt in the work dir, line `n` holds
+raw_to_moisture(n).
+"""
+
+# Raw reading of 5 V at gain 0, the top of the sensor's range
+FULL_SCALE_RAW = 26667
+
+
+def scenario(emulator):
+    from sensor import raw_to_moisture
+
+    values = (str(raw_to_moisture(raw)) for raw in range(FULL_SCALE_RAW + 1))
+    (emulator.work_dir / "raw_to_moisture.txt").write_text("\n".join(values))
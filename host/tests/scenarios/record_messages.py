@@ -0,0 +1,18 @@
+"""Write every message the station publishes to messages.txt in the work dir.
+
+One line per message: `time<TAB>topic<TAB>payload`, read back with
+emulation.read_messages().
+"""
+
+
+def scenario(emulator):
+    log = open(emulator.work_dir / "messages.txt", "w")
+
+    def record(message):
+        payload = message.payload
+        if isinstance(payload, (bytes, bytearray)):
+            payload = bytes(payload).decode()
+        log.write(f"{message.time:.3f}\t{message.topic}\t{payload}\n")
+        log.flush()
+
+    emulator.broker.observe("irrigation/#", record)
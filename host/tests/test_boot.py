@@ -0,0 +1,40 @@
+import unittest
+
+from emulation import read_log, run_emulator, scenario
+
+
+class BrokerDownAtBootTest(unittest.TestCase):
+    """Setup must not wait for the broker, the watchdog would reset the station."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.report = run_emulator(1200, scenario("broker_down_at_boot"))
+
+    def test_boots_once_without_watchdog_resets(self):
+        self.assertEqual(self.report["boots"], 1)
+        self.assertEqual(self.report["watchdog_resets_at_s"], [])
+
+    def test_connects_once_the_broker_is_back(self):
+        self.assertGreater(self.report["mqtt"]["refused"], 0)
+        self.assertEqual(self.report["mqtt"]["connects"], 1)
+        log = read_log(self.report)
+        self.assertIn("Connected to MQTT Broker", log)
+        self.assertIn("Subscribed to", log)
+
+    def test_subscribes_in_one_packet(self):
+        # The valve commands and Home Assistant status share one SUBSCRIBE
+        self.assertEqual(self.report["mqtt_packets_in"]["SUBSCRIBE"], 1)
+
+    def test_arms_the_watchdog_after_setup(self):
+        log = read_log(self.report)
+        self.assertLess(
+            log.index("Broker connectivity monitoring started"),
+            log.index("WatchDog initialized"),
+        )
+
+    def test_replays_the_readings_taken_while_disconnected(self):
+        self.assertRegex(read_log(self.report), r"Replayed \d+ queued readings")
+
+
+if __name__ == "__main__":
+    unittest.main()
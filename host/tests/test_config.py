@@ -0,0 +1,21 @@
+import unittest
+
+from emulation import read_log, run_emulator
+
+
+class ConfigLogTest(unittest.TestCase):
+    """The config printed at boot shows options by the names they were set with."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.log = read_log(run_emulator(30))
+
+    def test_log_level_by_name(self):
+        self.assertIn("log_level:        info\n", self.log)
+
+    def test_smoothing_by_name(self):
+        self.assertIn("smoothing:        ema\n", self.log)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,47 @@
+import unittest
+from pathlib import Path
+
+from emulation import run_emulator, scenario, write_config
+
+DURATION_S = 1010
+
+
+def restart_messages(report: dict) -> list:
+    """(write, topic) of the messages the station sent after Home Assistant restarted."""
+    with open(Path(report["work_dir"]) / "ha_restart.txt") as messages:
+        return [tuple(line.rstrip("\n").split("\t")) for line in messages]
+
+
+class DeviceDiscoveryRestartTest(unittest.TestCase):
+    """With device discovery, recovering from a Home Assistant restart is one write."""
+
+    @classmethod
+    def setUpClass(cls):
+        config = write_config(device_discovery=True)
+        report = run_emulator(DURATION_S, f"--config={config}", scenario("ha_restart"))
+        cls.messages = restart_messages(report)
+
+    def test_discovery_and_states_share_one_write(self):
+        topics = [topic for _, topic in self.messages]
+        self.assertTrue(any(t.startswith("homeassistant/device/") for t in topics))
+        self.assertTrue(any(t.endswith("/locationa/valve/state") for t in topics))
+        self.assertTrue(any(t.endswith("/locationb/sensor") for t in topics))
+        self.assertEqual(len({write for write, _ in self.messages}), 1)
+
+
+class EntityDiscoveryRestartTest(unittest.TestCase):
+    """Per entity discovery messages are batched up to the packet buffer limit."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.messages = restart_messages(
+            run_emulator(DURATION_S, scenario("ha_restart"))
+        )
+
+    def test_discovery_is_batched(self):
+        self.assertEqual(len(self.messages), 20)
+        self.assertLessEqual(len({write for write, _ in self.messages}), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,32 @@
+import unittest
+
+from emulation import read_log, run_emulator, scenario
+
+# Boot holds up the loop for 1.7 s, a PUBACK waited for by blocking held it
+# up for the whole ACK_TIMEOUT_MS of 5 s
+MAX_LOOP_LAG_MS = 2500
+
+
+class AckTimeoutTest(unittest.TestCase):
+    """A PUBACK that never comes counts as a lost connection, not a stalled station."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.report = run_emulator(2000, scenario("broker_hangs"))
+        cls.log = read_log(cls.report)
+
+    def test_no_watchdog_reset(self):
+        self.assertEqual(self.report["watchdog_resets_at_s"], [])
+        self.assertEqual(self.report["boots"], 1)
+
+    def test_loop_keeps_running_while_waiting(self):
+        self.assertLess(self.report["loop_lag_ms"]["max"], MAX_LOOP_LAG_MS)
+
+    def test_reconnects_after_the_timeout(self):
+        self.assertIn("Broker connectivity test failed", self.log)
+        self.assertIn("Reconnected to MQTT", self.log)
+        self.assertEqual(self.report["mqtt"]["connects"], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
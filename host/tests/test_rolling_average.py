@@ -0,0 +1,107 @@
+import random
+import sys
+import unittest
+from pathlib import Path
+
+HOST_DIR = Path(__file__).resolve().parent.parent
+# rolling_average only needs the micropython stub, no emulator
+sys.path[:0] = [str(HOST_DIR.parent / "src"), str(HOST_DIR / "stubs")]
+
+from emulation import run_emulator, scenario  # noqa: E402
+from rolling_average import (  # noqa: E402
+    _EMA_FRACTION_BITS,
+    ALPHA_SCALE,
+    EMA,
+    SMA,
+    RollingAverage,
+)
+
+ALPHAS = (0.01, 0.0123, 0.05, 0.1, 0.2, 0.5, 1.0)
+# The ADS1115 at gain 0 with a sensor that outputs 0-5 V
+GAIN_VOLTS = 6.144
+SENSOR_VOLTS = 5.0
+
+
+def float_moisture(raw: int) -> float:
+    """The float pipeline the fixed-point one replaced: raw_to_v, then round(v / 5, 2)."""
+    return round(raw * GAIN_VOLTS / 32768 / SENSOR_VOLTS, 2)
+
+
+def is_tie(raw: int) -> bool:
+    """Whether raw lands exactly on a half percent, where float rounding is noise."""
+    # moisture in percent is raw * 3 / 800
+    return raw * 3 % 800 == 400
+
+
+def float_ema(alpha: float, readings: list) -> list:
+    averages = []
+    ema = None
+    for reading in readings:
+        ema = reading if ema is None else alpha * reading + (1 - alpha) * ema
+        averages.append(ema)
+    return averages
+
+
+class FixedPointPipelineTest(unittest.TestCase):
+    """Raw reading to published moisture matches the float pipeline to 0.01 percentage point."""
+
+    @classmethod
+    def setUpClass(cls):
+        report = run_emulator(1, scenario("raw_to_moisture"))
+        table = Path(report["work_dir"]) / "raw_to_moisture.txt"
+        cls.moisture = [int(value) for value in table.read_text().split()]
+        cls.raws = [raw for raw in range(len(cls.moisture)) if not is_tie(raw)]
+
+    def test_raw_to_moisture_matches_the_float_conversion(self):
+        for raw in self.raws:
+            expected = round(float_moisture(raw) * 10000)
+            self.assertEqual(self.moisture[raw], expected, raw)
+
+    def test_matches_the_float_pipeline(self):
+        rng = random.Random(1)
+        for alpha in ALPHAS:
+            for _ in range(50):
+                raws = [rng.choice(self.raws) for _ in range(200)]
+                readings = [float_moisture(raw) for raw in raws]
+                average = RollingAverage(alpha=alpha, mode=EMA)
+                for raw, expected in zip(raws, float_ema(alpha, readings)):
+                    average.add_reading(self.moisture[raw])
+                    # Published in percent with two decimals, as before
+                    published = round(expected * 100, 2)
+                    difference = abs(average.get_average() / 100 - published)
+                    self.assertLessEqual(difference, 0.01 + 1e-9, alpha)
+
+
+class FixedPointEmaTest(unittest.TestCase):
+    """The integer EMA keeps the configured alpha and stays in small ints."""
+
+    def test_settles_on_a_constant_reading(self):
+        for alpha in ALPHAS:
+            for start, reading in ((0, 5000), (10000, 4200), (3300, 3400)):
+                average = RollingAverage(alpha=alpha, mode=EMA)
+                average.add_reading(start)
+                for _ in range(5000):
+                    average.add_reading(reading)
+                self.assertEqual(average.get_ema(), reading, alpha)
+
+    def test_alpha_is_the_configured_value(self):
+        for alpha in ALPHAS:
+            self.assertEqual(RollingAverage(alpha=alpha)._alpha / ALPHA_SCALE, alpha)
+
+    def test_arithmetic_stays_in_small_ints(self):
+        # MicroPython small ints hold 31 bits, larger values go on the heap
+        largest_ema = 16000 << _EMA_FRACTION_BITS
+        largest_whole = ALPHA_SCALE * (largest_ema >> _EMA_FRACTION_BITS)
+        largest_fraction = 2 * (ALPHA_SCALE << _EMA_FRACTION_BITS)
+        for value in (largest_ema, largest_whole, largest_fraction):
+            self.assertLess(value, 1 << 30)
+
+    def test_sma_rounds_the_window_mean(self):
+        average = RollingAverage(window_size=3, mode=SMA)
+        for reading in (4000, 4100, 4100, 4300):
+            average.add_reading(reading)
+        self.assertEqual(average.get_sma(), 4167)
+
+
+if __name__ == "__main__":
+    unittest.main()
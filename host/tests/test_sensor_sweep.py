@@ -0,0 +1,78 @@
+import json
+import os
+import unittest
+
+from emulation import read_messages, run_emulator, scenario, write_config
+
+POINT_COUNT = 4
+# sensor.STABILIZATION_MS, and one ADS1115 conversion at 8 SPS plus its I2C
+# transactions under the emulator
+STABILIZATION_MS = 300
+READ_MS = 125.3
+# Scheduling and the Python work around the reads
+SLACK_MS = 20
+
+
+def sweep_points() -> list:
+    """Four points on the channels of one ADS1115, each with its own MOSFET."""
+    return [
+        {
+            "name": f"Point {channel}",
+            "valve_pin": 2 + channel,
+            "mosfet_pin": 18 + channel,
+            "ads_address": "0x48",
+            "ads_channel": channel,
+        }
+        for channel in range(POINT_COUNT)
+    ]
+
+
+def last_sweep_ms(parallel: bool, dual_core: bool) -> int:
+    """Duration of the last sweep, as the station reports it in its telemetry."""
+    config_path = write_config(
+        irrigation_points=sweep_points(),
+        parallel_sensor_sweep=parallel,
+        dual_core=dual_core,
+        # A sweep every 20 s, rolling_window sweeps per publish interval
+        publish_interval_minutes=1,
+    )
+    try:
+        report = run_emulator(
+            300, f"--config={config_path}", scenario("record_messages")
+        )
+    finally:
+        os.remove(config_path)
+    telemetry = [
+        json.loads(payload)
+        for _, topic, payload in read_messages(report)
+        if topic.endswith("/telemetry")
+    ]
+    return telemetry[-1]["last_sweep_duration"]
+
+
+class SensorSweepTest(unittest.TestCase):
+    """A parallel sweep shares one stabilization window between all points."""
+
+    def assert_duration(self, measured_ms: int, expected_ms: float) -> None:
+        self.assertGreaterEqual(measured_ms, expected_ms - SLACK_MS)
+        self.assertLessEqual(measured_ms, expected_ms + SLACK_MS)
+
+    def test_parallel_sweep_takes_one_window_and_the_reads(self):
+        for dual_core in (False, True):
+            with self.subTest(dual_core=dual_core):
+                self.assert_duration(
+                    last_sweep_ms(parallel=True, dual_core=dual_core),
+                    STABILIZATION_MS + POINT_COUNT * READ_MS,
+                )
+
+    def test_sequential_sweep_takes_a_window_per_point(self):
+        for dual_core in (False, True):
+            with self.subTest(dual_core=dual_core):
+                self.assert_duration(
+                    last_sweep_ms(parallel=False, dual_core=dual_core),
+                    POINT_COUNT * (STABILIZATION_MS + READ_MS),
+                )
+
+
+if __name__ == "__main__":
+    unittest.main()
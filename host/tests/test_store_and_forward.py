@@ -0,0 +1,61 @@
+import unittest
+
+from emulation import read_log, read_messages, run_emulator, scenario
+
+
+class ReplayTest(unittest.TestCase):
+    """Queued readings must not replace the current state in Home Assistant."""
+
+    @classmethod
+    def setUpClass(cls):
+        report = run_emulator(
+            5400, scenario("record_messages"), scenario("broker_outage_with_replay")
+        )
+        cls.messages = [
+            (float(time), topic, payload)
+            for time, topic, payload in read_messages(report)
+            if topic.endswith("/sensor") or topic.endswith("/sensor/replay")
+        ]
+
+    def test_replays_go_to_the_replay_topics(self):
+        replays = [m for m in self.messages if m[1].endswith("/replay")]
+        # Ten publish intervals for each of the two sensors during the outage
+        self.assertGreaterEqual(len(replays), 20)
+        for _, _, payload in replays:
+            self.assertIn('"timestamp"', payload)
+        for _, topic, payload in self.messages:
+            if not topic.endswith("/replay"):
+                self.assertNotIn('"timestamp"', payload)
+
+    def test_state_topics_are_current_after_the_drain(self):
+        last_replay = max(m[0] for m in self.messages if m[1].endswith("/replay"))
+        after = [m for m in self.messages if m[0] >= last_replay]
+        self.assertEqual(
+            {topic for _, topic, _ in after if not topic.endswith("/replay")},
+            {
+                "irrigation/030e5b2a/locationa/sensor",
+                "irrigation/030e5b2a/locationb/sensor",
+            },
+        )
+        first_state = min(m[0] for m in after if not m[1].endswith("/replay"))
+        self.assertLess(first_state - last_replay, 5)
+
+
+class ResetDuringOutageTest(unittest.TestCase):
+    """Readings batched in RAM are written to flash before the watchdog resets."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.report = run_emulator(3300, scenario("core1_stops_during_outage"))
+        cls.log = read_log(cls.report)
+
+    def test_batched_readings_survive_the_reset(self):
+        self.assertEqual(self.report["boots"], 2)
+        self.assertIn("Previous reset: subsystem 'sensor_sweep' stalled", self.log)
+        # The publish intervals between the outage and the reset, fewer than a batch
+        self.assertIn("Loaded 4 queued readings", self.log)
+        self.assertIn("Replayed 8 queued readings, 0 left", self.log)
+
+
+if __name__ == "__main__":
+    unittest.main()
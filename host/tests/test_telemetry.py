@@ -0,0 +1,43 @@
+import json
+import unittest
+
+from emulation import read_messages, run_emulator, scenario
+
+# Usable heap of the emulated Pico 2 W, see host/emulator/runtime.py
+HEAP_SIZE = 480 * 1024
+
+
+class HeapTelemetryTest(unittest.TestCase):
+    """The emulated heap counts what the firmware allocates, not the emulator."""
+
+    @classmethod
+    def setUpClass(cls):
+        report = run_emulator(400, scenario("record_messages"))
+        cls.telemetry = [
+            json.loads(payload)
+            for _, topic, payload in read_messages(report)
+            if topic.endswith("/telemetry")
+        ]
+
+    def test_telemetry_is_published(self):
+        self.assertTrue(self.telemetry)
+
+    def test_heap_adds_up(self):
+        for telemetry in self.telemetry:
+            self.assertGreater(telemetry["heap_allocated"], 0)
+            self.assertGreater(telemetry["heap_free"], 0)
+            self.assertAlmostEqual(
+                telemetry["heap_free"] + telemetry["heap_allocated"],
+                HEAP_SIZE,
+                delta=1024,
+            )
+
+    def test_largest_free_block_fits_in_heap(self):
+        # Measured after a collection, so it may exceed heap_free from before
+        for telemetry in self.telemetry:
+            self.assertGreater(telemetry["largest_free_block"], 0)
+            self.assertLess(telemetry["largest_free_block"], HEAP_SIZE)
+
+
+if __name__ == "__main__":
+    unittest.main()
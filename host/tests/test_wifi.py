@@ -0,0 +1,26 @@
+import unittest
+
+from emulation import read_log, run_emulator, scenario
+
+
+class WiFiCacheTest(unittest.TestCase):
+    """A cached access point skips the scan, DHCP stays on to renew the lease."""
+
+    def test_rejoins_the_cached_access_point_with_dhcp(self):
+        report = run_emulator(600, "--wifi-outage=120:180")
+        self.assertIn("(cached access point)", read_log(report))
+        # Every join took the 1 s of DHCP, no stored lease was applied
+        self.assertEqual(len(report["wifi_connect_ms"]), 2)
+        for connect_ms in report["wifi_connect_ms"]:
+            self.assertGreaterEqual(connect_ms, 1000)
+
+    def test_scans_when_the_broker_is_unreachable_after_a_cached_join(self):
+        report = run_emulator(900, scenario("broker_unreachable_after_cached_join"))
+        log = read_log(report)
+        self.assertIn("Broker unreachable through the cached access point", log)
+        self.assertLess(log.index("(cached access point)"), log.index("(scan)"))
+        self.assertEqual(report["mqtt"]["connects"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,212 @@
+from time import sleep, ticks_ms, ticks_us, ticks_diff
+from json import dump, dumps, load
+from os import remove
+import asyncio
+import gc
+import logger
+import scheduler
+from logger import Logger
+from config import Config
+from irrigation_station import IrrigationStation
+from mqtt_hass_manager import MqttHassManager
+from mqtt_robust_client import CONNECT_TIMEOUT_S
+from time_keeper import TimeKeeper
+from wifi_manager import WiFiManager
+
+CONFIG_PATH = "./config.json"
+BENCH_CONFIG_PATH = "./bench-config.json"
+BENCH_LOG_FILE_PATH = "./bench-log.txt"
+BENCH_LOG_FILE_PATH_OLD = "./bench-log-old.txt"
+ITERATIONS = 20
+# Network round trips and sensor sweeps are slow, so they get fewer iterations
+SLOW_ITERATIONS = 3
+SWEEP_POINT_COUNTS = (1, 4, 8, 16)
+MESSAGE = 'irrigation/abcdef12/locationa/sensor::{"moisture": 42.5}'
+
+# Every result is "lower is better", the unit is the suffix of its name
+results = {}
+
+
+def record(name: str, value) -> None:
+    results[name] = round(value, 1)
+    print(f"  {name:<44} {results[name]:>12}")
+
+
+def measure(name: str, fn, iterations: int = ITERATIONS) -> None:
+    """Record time and heap allocated per call, with the GC paused so nothing is reclaimed."""
+    gc.collect()
+    gc.disable()
+    try:
+        before = gc.mem_alloc()
+        start = ticks_us()
+        for _ in range(iterations):
+            fn()
+        elapsed_us = ticks_diff(ticks_us(), start)
+        after = gc.mem_alloc()
+    finally:
+        gc.enable()
+    record(name + "_us", elapsed_us / iterations)
+    record(name + "_bytes", (after - before) / iterations)
+
+
+async def measure_async(name: str, coro_fn, iterations: int = SLOW_ITERATIONS):
+    """Like measure(), for a handler that awaits. Time spent sleeping is included."""
+    gc.collect()
+    gc.disable()
+    try:
+        before = gc.mem_alloc()
+        start = ticks_us()
+        for _ in range(iterations):
+            await coro_fn()
+        elapsed_us = ticks_diff(ticks_us(), start)
+        after = gc.mem_alloc()
+    finally:
+        gc.enable()
+    record(name + "_ms", elapsed_us / iterations / 1000)
+    record(name + "_bytes", (after - before) / iterations)
+
+
+def write_bench_config(point_count: int) -> None:
+    """Write a config with `point_count` points, reusing the wiring of the real points.
+
+    Cycling through the configured MOSFET pins and ADS channels keeps the
+    sweep safe on a real station: only the actual sensors get powered.
+    """
+    with open(CONFIG_PATH) as file:
+        conf = load(file)
+    points = conf["irrigation_points"]
+    bench_points = []
+    for i in range(point_count):
+        point = dict(points[i % len(points)])
+        point["name"] = f"Bench point {i}"
+        bench_points.append(point)
+    conf["irrigation_points"] = bench_points
+    # Sweeps are timed on this core, core 1 can only run one worker anyway
+    conf["dual_core"] = False
+    with open(BENCH_CONFIG_PATH, "w") as file:
+        dump(conf, file)
+
+
+def stop_station(station: IrrigationStation) -> None:
+    station._measurement_job.cancel()
+    if station._worker is not None:
+        # Hand the pins back to this core so the sweep can be timed here
+        station._worker.stop()
+
+
+def stop_manager(manager: MqttHassManager) -> None:
+    manager._publish_job.cancel()
+    manager._broker_connectivity_job.cancel()
+    manager._telemetry_job.cancel()
+
+
+async def bench_startup(bench_logger: Logger):
+    """Replay the boot sequence of main.main() up to the first publish."""
+    print("Startup (ms since the start of the boot sequence):")
+    start = ticks_ms()
+    config = Config(CONFIG_PATH)
+    station = IrrigationStation(config, bench_logger)
+    wifi_manager = WiFiManager(config.network, bench_logger)
+    time_keeper = TimeKeeper(bench_logger)
+    manager = MqttHassManager(config, bench_logger, station)
+    record("startup_init_ms", ticks_diff(ticks_ms(), start))
+    await wifi_manager.setup()
+    record("startup_wifi_connected_ms", ticks_diff(ticks_ms(), start))
+    await time_keeper.initialize_ntp_synchronization()
+    record("startup_ntp_synced_ms", ticks_diff(ticks_ms(), start))
+    manager.setup()
+    # The first connect of MqttRobustClient.run() split up so the first
+    # publish can be timed
+    manager._client.connect(clean_session=False, timeout=CONNECT_TIMEOUT_S)
+    # Reads the SUBACKs and PUBACKs the handlers wait for, until the run ends
+    asyncio.create_task(manager._listen_for_messages())
+    manager._set_online()
+    record("startup_first_publish_ms", ticks_diff(ticks_ms(), start))
+    await manager._handle_pending_reconnect()
+    record("startup_discovery_done_ms", ticks_diff(ticks_ms(), start))
+    return config, station, wifi_manager, time_keeper, manager
+
+
+async def bench_handlers(
+    bench_logger: Logger,
+    station: IrrigationStation,
+    wifi_manager: WiFiManager,
+    time_keeper: TimeKeeper,
+    manager: MqttHassManager,
+) -> None:
+    """Time one iteration of the work behind every task gathered in main.main()."""
+    print("Handlers (per iteration):")
+    job = scheduler.job("bench", lambda: None)
+    measure("scheduler_reschedule", lambda: job.reschedule(60000))
+    job.cancel()
+    measure("logger_log", lambda: bench_logger.log(MESSAGE))
+    measure("logger_flush", bench_logger.flush)
+    measure("wifi_check_connection", wifi_manager._check_connection)
+    measure("mqtt_listen_idle", manager._client.check_msg)
+    measure("mqtt_publish_moisture", manager._publish_moisture_levels)
+    measure("mqtt_discovery", manager._publish_discovery, SLOW_ITERATIONS)
+    await measure_async("mqtt_reconnect", manager._handle_pending_reconnect)
+    await measure_async(
+        "mqtt_broker_test", manager._handle_pending_broker_connectivity_test
+    )
+    await measure_async("ntp_sync", time_keeper._sync_ntp)
+    await measure_async("sensor_sweep", station._measure_all_sensors)
+    measure("gc_collect", gc.collect, SLOW_ITERATIONS)
+
+
+async def bench_sweeps(bench_logger: Logger) -> None:
+    """Time IrrigationStation._measure_all_sensors for growing numbers of points."""
+    print("Sensor sweeps (per sweep):")
+    for point_count in SWEEP_POINT_COUNTS:
+        write_bench_config(point_count)
+        station = IrrigationStation(Config(BENCH_CONFIG_PATH), bench_logger)
+        stop_station(station)
+        for parallel in (True, False):
+            station._config.parallel_sensor_sweep = parallel
+            mode = "parallel" if parallel else "sequential"
+            await measure_async(
+                f"sweep_{mode}_{point_count}_points", station._measure_all_sensors
+            )
+    remove(BENCH_CONFIG_PATH)
+
+
+async def run_benchmarks() -> None:
+    bench_logger = Logger(should_print=False)
+    config, station, wifi_manager, time_keeper, manager = await bench_startup(
+        bench_logger
+    )
+    stop_station(station)
+    stop_manager(manager)
+    await bench_handlers(bench_logger, station, wifi_manager, time_keeper, manager)
+    await bench_sweeps(bench_logger)
+    time_keeper._sync_job.cancel()
+    time_keeper._store_job.cancel()
+    bench_logger.flush()
+
+
+def remove_bench_files() -> None:
+    for path in (BENCH_LOG_FILE_PATH, BENCH_LOG_FILE_PATH_OLD):
+        try:
+            remove(path)
+        except OSError:
+            pass
+
+
+def main() -> None:
+    # Wait 5 seconds so we are sure to catch all output on the terminal
+    sleep(5)
+
+    # Point the logger at scratch files so the device log is left untouched
+    logger.LOG_FILE_PATH = BENCH_LOG_FILE_PATH
+    logger.LOG_FILE_PATH_OLD = BENCH_LOG_FILE_PATH_OLD
+    remove_bench_files()
+
+    asyncio.run(run_benchmarks())
+    remove_bench_files()
+
+    # Machine readable results, compare two runs with host/compare_benchmarks.py
+    print(dumps(results))
+
+
+if __name__ == "__main__":
+    main()
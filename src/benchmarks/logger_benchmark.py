@@ -0,0 +1,58 @@
+from os import remove, stat, sync
+from time import sleep, ticks_us, ticks_diff
+import logger
+from logger import Logger
+
+BENCH_LOG_FILE_PATH = "./bench-log.txt"
+BENCH_LOG_FILE_PATH_OLD = "./bench-log-old.txt"
+ITERATIONS = 200
+MESSAGE = 'irrigation/abcdef12/locationa/sensor::{"moisture": 42.5}'
+
+
+def log_unbuffered(msg: str) -> None:
+    """Per-call cost of the previous Logger.log: append, sync and stat every message."""
+    with open(BENCH_LOG_FILE_PATH, "a") as curr_file:
+        curr_file.write(msg + "\n")
+        sync()
+    stat(BENCH_LOG_FILE_PATH)
+
+
+def remove_bench_files() -> None:
+    for path in (BENCH_LOG_FILE_PATH, BENCH_LOG_FILE_PATH_OLD):
+        try:
+            remove(path)
+        except OSError:
+            pass
+
+
+def measure_us_per_call(log_fn) -> float:
+    start = ticks_us()
+    for _ in range(ITERATIONS):
+        log_fn(MESSAGE)
+    return ticks_diff(ticks_us(), start) / ITERATIONS
+
+
+def main() -> None:
+    # Wait 5 seconds so we are sure to catch all output on the terminal
+    sleep(5)
+
+    # Point the logger at scratch files so the device log is left untouched
+    logger.LOG_FILE_PATH = BENCH_LOG_FILE_PATH
+    logger.LOG_FILE_PATH_OLD = BENCH_LOG_FILE_PATH_OLD
+    remove_bench_files()
+
+    unbuffered_us = measure_us_per_call(log_unbuffered)
+    remove_bench_files()
+
+    buffered_logger = Logger(should_print=False)
+    buffered_us = measure_us_per_call(buffered_logger.log)
+    buffered_logger.flush()
+    remove_bench_files()
+
+    print(f"Logger.log cost over {ITERATIONS} calls:")
+    print(f"  unbuffered (sync + stat per call): {unbuffered_us:.1f} us/call")
+    print(f"  buffered (batched flushes):        {buffered_us:.1f} us/call")
+
+
+if __name__ == "__main__":
+    main()
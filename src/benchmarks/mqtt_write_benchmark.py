@@ -0,0 +1,113 @@
+from time import sleep
+from umqtt.simple import MQTTClient
+import asyncio
+from config import Config
+from logger import Logger
+from mqtt_hass_manager import PORT, create_ssl_context
+from mqtt_robust_client import MqttRobustClient
+from wifi_manager import WiFiManager
+
+CONFIG_PATH = "./config.json"
+ITERATIONS = 20
+# Moisture publishes of a station with this many points, one per point
+BATCH_SIZE = 4
+TOPIC = b"irrigation/bench/locationa/sensor"
+PAYLOAD = b'{"moisture": 45.50}'
+# TLS 1.2 AES-GCM record header, explicit nonce and authentication tag
+TLS_RECORD_OVERHEAD = 29
+
+
+class CountingSocket:
+    """Wraps the TLS socket and counts the writes, each one a TLS record."""
+
+    def __init__(self, sock) -> None:
+        self._sock = sock
+        self.writes = 0
+        self.bytes = 0
+
+    def write(self, buf, length=None):
+        self.writes += 1
+        self.bytes += len(buf) if length is None else length
+        if length is None:
+            return self._sock.write(buf)
+        return self._sock.write(buf, length)
+
+    def read(self, size):
+        return self._sock.read(size)
+
+    def setblocking(self, flag):
+        return self._sock.setblocking(flag)
+
+    def close(self):
+        return self._sock.close()
+
+    def reset(self) -> None:
+        self.writes = 0
+        self.bytes = 0
+
+
+def report(name: str, sock: CountingSocket, publishes: int) -> None:
+    wire_bytes = sock.bytes + sock.writes * TLS_RECORD_OVERHEAD
+    print(
+        f"  {name:<26} {sock.writes / publishes:6.2f} records"
+        f" {wire_bytes / publishes:8.1f} bytes on the wire"
+    )
+
+
+async def read_acks(client: MqttRobustClient) -> None:
+    """Reads the PUBACKs, like the listener task of the firmware."""
+    while True:
+        client.check_msg()
+        await asyncio.sleep_ms(1)
+
+
+async def publish_acked(client: MqttRobustClient) -> None:
+    reader = asyncio.create_task(read_acks(client))
+    for _ in range(ITERATIONS):
+        await client.publish_acked(TOPIC, PAYLOAD)
+    reader.cancel()
+
+
+def main() -> None:
+    # Wait 5 seconds so we are sure to catch all output on the terminal
+    sleep(5)
+
+    config = Config(CONFIG_PATH)
+    asyncio.run(WiFiManager(config.network, Logger(should_print=False)).setup())
+    client = MqttRobustClient(
+        client_id=config.station_mqtt_id + "-bench",
+        server=config.network.mqtt_broker_ip,
+        port=PORT,
+        ssl=create_ssl_context(),
+    )
+    client.connect()
+    sock = CountingSocket(client.sock)
+    client.sock = sock
+
+    print(f"MQTT writes per publish over {ITERATIONS} publishes:")
+    for _ in range(ITERATIONS):
+        MQTTClient.publish(client, TOPIC, PAYLOAD)
+    report("umqtt.simple (before)", sock, ITERATIONS)
+
+    sock.reset()
+    for _ in range(ITERATIONS):
+        client.publish(TOPIC, PAYLOAD)
+    report("single write", sock, ITERATIONS)
+
+    sock.reset()
+    for _ in range(ITERATIONS):
+        client.begin_batch()
+        for _ in range(BATCH_SIZE):
+            client.publish(TOPIC, PAYLOAD)
+        client.flush()
+    report(f"batches of {BATCH_SIZE}", sock, ITERATIONS * BATCH_SIZE)
+
+    sock.reset()
+    asyncio.run(publish_acked(client))
+    report("single write, QoS 1", sock, ITERATIONS)
+
+    client.disconnect()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+from time import sleep, ticks_us, ticks_diff
+from json import dumps
+import gc
+from config import IrrigationPointConfig
+from irrigation_point import IrrigationPoint
+from logger import Logger
+from mqtt_hass_entities import MessagerParams, MqttHassSensor, MqttHassValve
+from telemetry import largest_free_block
+
+ITERATIONS = 500
+# Publishes with the GC running, about ten weeks of one sensor at 5 minutes
+SOAK_PUBLISHES = 20_000
+POINT_CONF = {
+    "name": "Bench point",
+    "valve_pin": 2,
+    "mosfet_pin": 21,
+    "ads_address": "0x48",
+    "ads_channel": 0,
+}
+
+
+class SinkClient:
+    """Takes the place of the broker connection, so only serialization is measured."""
+
+    def publish(self, topic, msg, retain=False) -> bool:
+        return len(topic) + len(msg) > 0
+
+    def subscribe(self, *filters) -> bool:
+        return True
+
+
+class BenchPoint:
+    """An irrigation point whose moisture changes on every read, without hardware."""
+
+    def __init__(self) -> None:
+        self.config = IrrigationPointConfig(POINT_CONF)
+        self._value = 0
+
+    def get_sensor_value(self) -> int:
+        self._value = (self._value + 37) % 10001
+        return self._value
+
+    def get_valve_state(self) -> str:
+        return IrrigationPoint.STATE_CLOSED
+
+
+def dumps_publish(client: SinkClient, sensor: MqttHassSensor) -> None:
+    """The previous moisture publish: a dict serialized by json.dumps every time."""
+    payload = dumps({"moisture": sensor.get_moisture_value() / 100})
+    client.publish(sensor._state_topic, payload)
+
+
+def measure_per_call(fn) -> tuple:
+    """Time and heap bytes per call, with the GC paused so nothing is reclaimed."""
+    gc.collect()
+    gc.disable()
+    try:
+        before = gc.mem_alloc()
+        start = ticks_us()
+        for _ in range(ITERATIONS):
+            fn()
+        elapsed_us = ticks_diff(ticks_us(), start)
+        after = gc.mem_alloc()
+    finally:
+        gc.enable()
+    return elapsed_us / ITERATIONS, (after - before) / ITERATIONS
+
+
+def soak(fn) -> tuple:
+    """Collections triggered and the largest free block after SOAK_PUBLISHES calls."""
+    gc.collect()
+    collections = 0
+    free = gc.mem_free()
+    for _ in range(SOAK_PUBLISHES):
+        fn()
+        # The free heap only grows back when the GC ran
+        now_free = gc.mem_free()
+        if now_free > free:
+            collections += 1
+        free = now_free
+    return collections, largest_free_block()
+
+
+def main() -> None:
+    # Wait 5 seconds so we are sure to catch all output on the terminal
+    sleep(5)
+
+    client = SinkClient()
+    params = MessagerParams(
+        mqtt_client=client,
+        station_id="bench",
+        irrigation_point=BenchPoint(),
+        device_info={},
+        availability_topic="irrigation/bench/availability",
+        station_state_topic=None,
+        # Skips serializing a discovery message per entity
+        device_discovery=True,
+        logger=Logger(should_print=False),
+    )
+    sensor = MqttHassSensor(params)
+    valve = MqttHassValve(params)
+    publishes = (
+        ("dict + dumps (before)", lambda: dumps_publish(client, sensor)),
+        ("sensor", sensor.publish_moisture_level),
+        ("replayed sensor", lambda: sensor.publish_replayed_moisture_level(4550, 0)),
+        ("valve", valve.publish_valve_state),
+    )
+
+    print(f"Payload cost over {ITERATIONS} publishes:")
+    for name, fn in publishes:
+        us, allocated = measure_per_call(fn)
+        print(f"  {name:<22} {us:8.1f} us {allocated:8.1f} bytes")
+
+    print(f"Heap after {SOAK_PUBLISHES} moisture publishes:")
+    for name, fn in publishes[:2]:
+        collections, largest = soak(fn)
+        print(f"  {name:<22} {collections:8d} GCs {largest:8d} bytes largest block")
+
+
+if __name__ == "__main__":
+    main()
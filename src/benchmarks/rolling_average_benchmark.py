@@ -0,0 +1,63 @@
+from time import sleep
+import gc
+from rolling_average import RollingAverage, SMA, EMA, SMA_AND_EMA
+
+ITERATIONS = 500
+WINDOW_SIZE = 3
+ALPHA = 0.2
+
+
+class ListRollingAverage:
+    """The previous list based implementation: append and pop(0) on every reading."""
+
+    def __init__(self, window_size: int, alpha: float) -> None:
+        self._window_size = window_size
+        self._alpha = alpha
+        self._values = []
+        self._ema_value = None
+
+    def add_reading(self, value: float) -> None:
+        if self._ema_value is None:
+            self._ema_value = value
+        else:
+            self._ema_value = self._alpha * value + (1 - self._alpha) * self._ema_value
+        self._values.append(value)
+        if len(self._values) > self._window_size:
+            self._values.pop(0)
+
+
+def measure_bytes_per_reading(average) -> float:
+    """Heap bytes allocated per add_reading, with the GC paused so nothing is reclaimed."""
+    # Precompute the readings (moisture in hundredths of a percent) so
+    # creating them isn't counted
+    readings = [(i * 37) % 10000 for i in range(ITERATIONS)]
+    gc.collect()
+    gc.disable()
+    try:
+        before = gc.mem_alloc()
+        for value in readings:
+            average.add_reading(value)
+        after = gc.mem_alloc()
+    finally:
+        gc.enable()
+    return (after - before) / ITERATIONS
+
+
+def main() -> None:
+    # Wait 5 seconds so we are sure to catch all output on the terminal
+    sleep(5)
+
+    results = [
+        ("list (before)", ListRollingAverage(WINDOW_SIZE, ALPHA)),
+        ("ring buffer, ema", RollingAverage(WINDOW_SIZE, ALPHA, EMA)),
+        ("ring buffer, sma", RollingAverage(WINDOW_SIZE, ALPHA, SMA)),
+        ("ring buffer, both", RollingAverage(WINDOW_SIZE, ALPHA, SMA_AND_EMA)),
+    ]
+
+    print(f"Heap allocated per add_reading over {ITERATIONS} readings:")
+    for name, average in results:
+        print(f"  {name:<18} {measure_bytes_per_reading(average):.1f} bytes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+from machine import RTC
+from time import sleep, ticks_us, ticks_diff
+import datetime
+import gc
+from logger import Logger
+from time_keeper import TimeKeeper
+
+ITERATIONS = 500
+
+
+def datetime_timestamp(rtc: RTC) -> str:
+    """The previous log timestamp: datetime objects and both DST boundaries per call."""
+    t = rtc.datetime()
+    utc_time = datetime.datetime(t[0], t[1], t[2], t[4], t[5], t[6])
+    year = utc_time.year
+    march = datetime.date(year, 3, 31)
+    last_sunday_march = march - datetime.timedelta(
+        days=march.weekday() + 1 if march.weekday() != 6 else 0
+    )
+    dst_start = datetime.datetime.combine(last_sunday_march, datetime.time(1, 0))
+    october = datetime.date(year, 10, 31)
+    last_sunday_october = october - datetime.timedelta(
+        days=october.weekday() + 1 if october.weekday() != 6 else 0
+    )
+    dst_end = datetime.datetime.combine(last_sunday_october, datetime.time(1, 0))
+    if dst_start <= utc_time < dst_end:
+        c = utc_time + datetime.timedelta(hours=2)
+    else:
+        c = utc_time + datetime.timedelta(hours=1)
+    return f"{c.year}/{c.month:02}/{c.day:02}-{c.hour:02}:{c.minute:02}:{c.second:02}"
+
+
+def measure_per_call(fn) -> tuple:
+    """Time and heap bytes per call, with the GC paused so nothing is reclaimed."""
+    gc.collect()
+    gc.disable()
+    try:
+        before = gc.mem_alloc()
+        start = ticks_us()
+        for _ in range(ITERATIONS):
+            fn()
+        elapsed_us = ticks_diff(ticks_us(), start)
+        after = gc.mem_alloc()
+    finally:
+        gc.enable()
+    return elapsed_us / ITERATIONS, (after - before) / ITERATIONS
+
+
+def main() -> None:
+    # Wait 5 seconds so we are sure to catch all output on the terminal
+    sleep(5)
+
+    rtc = RTC()
+    time_keeper = TimeKeeper(Logger(should_print=False))
+    # Fills the DST and date caches, like the first log line after boot
+    time_keeper.get_current_cet_datetime_str()
+
+    def new_second() -> None:
+        # Forget the last stamp, as if the second changed since the last log line
+        time_keeper._stamped_at = -1
+        time_keeper.get_current_cet_datetime_str()
+
+    print(f"Log timestamp cost over {ITERATIONS} calls:")
+    for name, (us, allocated) in (
+        ("datetime (before)", measure_per_call(lambda: datetime_timestamp(rtc))),
+        ("new second", measure_per_call(new_second)),
+        ("same second", measure_per_call(time_keeper.get_current_cet_datetime_str)),
+    ):
+        print(f"  {name:<18} {us:8.1f} us {allocated:8.1f} bytes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+from machine import Timer, WDT
+from time import sleep, ticks_us, ticks_diff
+import gc
+import watchdog
+from logger import Logger
+from watchdog import Watchdog, WDT_TIMEOUT_MS
+
+ITERATIONS = 500
+SUBSYSTEMS = ("mqtt", "sensor_sweep", "wifi")
+
+
+class TimerWatchdog:
+    """The previous watchdog: a software timer re-initialized on every feed."""
+
+    def __init__(self, timeout_ms: int) -> None:
+        self._timeout_ms = timeout_ms
+        self._timer = Timer(-1)
+        self.feed()
+
+    def _timeout_callback(self, _) -> None:
+        pass
+
+    def feed(self) -> None:
+        self._timer.init(
+            period=self._timeout_ms,
+            mode=Timer.ONE_SHOT,
+            callback=self._timeout_callback,
+        )
+
+    def stop(self) -> None:
+        self._timer.deinit()
+
+
+def measure_per_feed(feed) -> tuple:
+    """Time and heap bytes per feed, with the GC paused so nothing is reclaimed."""
+    gc.collect()
+    gc.disable()
+    try:
+        before = gc.mem_alloc()
+        start = ticks_us()
+        for _ in range(ITERATIONS):
+            feed()
+        elapsed_us = ticks_diff(ticks_us(), start)
+        after = gc.mem_alloc()
+    finally:
+        gc.enable()
+    return elapsed_us / ITERATIONS, (after - before) / ITERATIONS
+
+
+def main() -> None:
+    """Compare the feed cost of the old timer watchdog with the hardware WDT.
+
+    Meant for the host emulation: on the device the hardware watchdog can't
+    be stopped again, so the board resets a few seconds after this ends.
+    """
+    # Wait 5 seconds so we are sure to catch all output on the terminal
+    sleep(5)
+
+    timer_watchdog = TimerWatchdog(120_000)
+    timer_cost = measure_per_feed(timer_watchdog.feed)
+    timer_watchdog.stop()
+
+    wdt = WDT(timeout=WDT_TIMEOUT_MS)
+    wdt_cost = measure_per_feed(wdt.feed)
+
+    station_watchdog = Watchdog(Logger(should_print=False))
+    station_watchdog.start()
+    for name in SUBSYSTEMS:
+        watchdog.heartbeat(name, 60_000)
+    heartbeat_cost = measure_per_feed(station_watchdog.feed)
+
+    print(f"Watchdog feed cost over {ITERATIONS} feeds:")
+    for name, (us, allocated) in (
+        ("Timer re-init (before)", timer_cost),
+        ("machine.WDT.feed", wdt_cost),
+        (f"WDT + {len(SUBSYSTEMS)} heartbeats", heartbeat_cost),
+    ):
+        print(f"  {name:<24} {us:8.1f} us {allocated:8.1f} bytes")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,8 @@
 import re
 from json import load
 from machine import unique_id
+from logger import LEVELS
+from rolling_average import MODES, EMA
 
 
 def _get_if_valid(key: str, conf: dict, value_type: type) -> any:  # type: ignore
@@ -20,6 +22,12 @@ def _get_if_valid(key: str, conf: dict, value_type: type) -> any:  # type: ignor
     return val
 
 
+def _get_optional(key: str, conf: dict, value_type: type, default: any) -> any:  # type: ignore
+    if key not in conf:
+        return default
+    return _get_if_valid(key, conf, value_type)
+
+
 def _load_json_file(file_path: str) -> dict:
     with open(file_path) as file:
         conf = load(file)
@@ -70,11 +78,54 @@ def _parse_ads_channel(conf: dict) -> int:
     return channel
 
 
+def _name_of(value: int, names: dict) -> str:
+    """Map a parsed option back to the name it was configured with."""
+    for name, named_value in names.items():
+        if named_value == value:
+            return name
+    return str(value)
+
+
+def _parse_log_level(conf: dict) -> int:
+    """Fetch and validate the optional log level name."""
+    level_name: str = _get_optional("log_level", conf, str, "info")
+    if level_name not in LEVELS:
+        raise ValueError(
+            f"Invalid log_level '{level_name}': must be one of {', '.join(LEVELS)}"
+        )
+    return LEVELS[level_name]
+
+
+def _parse_smoothing(conf: dict) -> int:
+    """Fetch and validate the optional smoothing mode name."""
+    mode_name: str = _get_optional("smoothing", conf, str, "ema")
+    if mode_name not in MODES:
+        raise ValueError(
+            f"Invalid smoothing '{mode_name}': must be one of {', '.join(MODES)}"
+        )
+    return MODES[mode_name]
+
+
+def _parse_static_ip(conf: dict) -> tuple | None:
+    """Fetch the optional static IP config as an ifconfig() tuple."""
+    static_ip: dict | None = _get_optional("static_ip", conf, dict, None)
+    if static_ip is None:
+        return None
+    return (
+        _get_if_valid("ip", static_ip, str),
+        _get_if_valid("subnet", static_ip, str),
+        _get_if_valid("gateway", static_ip, str),
+        _get_if_valid("dns", static_ip, str),
+    )
+
+
 class NetworkConfig:
     def __init__(self, conf: dict) -> None:
         self.wifi_ssid: str = _get_if_valid("wifi_ssid", conf, str)
         self.wifi_password: str = _get_if_valid("wifi_password", conf, str)
         self.mqtt_broker_ip: str = _get_if_valid("mqtt_broker_ip", conf, str)
+        # Skips DHCP on every connect: (ip, subnet, gateway, dns)
+        self.static_ip: tuple | None = _parse_static_ip(conf)
 
 
 class IrrigationPointConfig:
@@ -88,6 +139,7 @@ class IrrigationPointConfig:
         # These will be set from global config
         self.rolling_window: int = 5
         self.ema_alpha: float = 0.2
+        self.smoothing: int = EMA
 
 
 class Config:
@@ -107,15 +159,44 @@ class Config:
         # Global smoothing parameters
         self.rolling_window: int = _get_if_valid("rolling_window", conf, int)
         self.ema_alpha: float = _get_if_valid("ema_alpha", conf, float)
+        self.smoothing: int = _parse_smoothing(conf)
 
         # Publish interval in minutes, converted to ms
         self.publish_interval_ms: int = _get_publish_interval_ms(conf)
 
+        # Entries below this level are dropped before they are formatted
+        self.log_level: int = _parse_log_level(conf)
+
+        # Publish all sensor values in one station state document per interval
+        self.combined_state_topic: bool = _get_optional(
+            "combined_state_topic", conf, bool, False
+        )
+
+        # Register all entities through a single Home Assistant device discovery message
+        self.device_discovery: bool = _get_optional(
+            "device_discovery", conf, bool, False
+        )
+
+        # Publish the station's own health as Home Assistant diagnostic sensors
+        self.telemetry: bool = _get_optional("telemetry", conf, bool, True)
+
+        # Power all sensors together and share one stabilization window per sweep
+        self.parallel_sensor_sweep: bool = _get_optional(
+            "parallel_sensor_sweep", conf, bool, True
+        )
+
+        # Run the sensor sweeps and valve pins on core 1, networking stays on core 0
+        self.dual_core: bool = _get_optional("dual_core", conf, bool, True)
+
+        # Lightsleep between tasks and keep the radio in power save between publishes
+        self.power_save: bool = _get_optional("power_save", conf, bool, False)
+
         for irrigation_point_conf in irrigation_points_conf:
             irrigation_point = IrrigationPointConfig(irrigation_point_conf)
             # Copy global smoothing params to each point for convenience
             irrigation_point.rolling_window = self.rolling_window
             irrigation_point.ema_alpha = self.ema_alpha
+            irrigation_point.smoothing = self.smoothing
             self.irrigation_points[irrigation_point.id] = irrigation_point
 
     def __str__(self) -> str:
@@ -127,9 +208,18 @@ class Config:
             "network:",
             f"  wifi_ssid:      {self.network.wifi_ssid}",
             f"  mqtt_broker_ip: {self.network.mqtt_broker_ip}",
+            f"  static_ip:      {self.network.static_ip}",
             f"rolling_window:   {self.rolling_window}",
             f"ema_alpha:        {self.ema_alpha}",
+            f"smoothing:        {_name_of(self.smoothing, MODES)}",
             f"publish_interval: {self.publish_interval_ms // 60000} min ({self.publish_interval_ms} ms)",
+            f"log_level:        {_name_of(self.log_level, LEVELS)}",
+            f"parallel_sensor_sweep: {self.parallel_sensor_sweep}",
+            f"combined_state_topic: {self.combined_state_topic}",
+            f"device_discovery: {self.device_discovery}",
+            f"telemetry: {self.telemetry}",
+            f"dual_core: {self.dual_core}",
+            f"power_save: {self.power_save}",
             "irrigation_points:",
         ]
         for ip in self.irrigation_points.values():
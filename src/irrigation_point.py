@@ -3,6 +3,7 @@ from config import IrrigationPointConfig
 from sensor import Sensor
 from valve import Valve
 from logger import Logger
+from sensor_worker import CommandQueue
 
 
 class IrrigationPoint:
@@ -11,7 +12,12 @@ class IrrigationPoint:
     """Represents a single irrigation point with sensor and valve components."""
 
     def __init__(
-        self, config: IrrigationPointConfig, ads: ADS1115, logger: Logger
+        self,
+        config: IrrigationPointConfig,
+        ads: ADS1115,
+        logger: Logger,
+        valve_commands: CommandQueue | None = None,
+        index: int = 0,
     ) -> None:
         """Initialize an irrigation point with its sensor and valve components."""
         self.config = config
@@ -19,15 +25,35 @@ class IrrigationPoint:
 
         # Initialize sensor and valve components
         self._sensor = Sensor(config, ads, logger)
-        self._valve = Valve(config, logger)
+        self._valve = Valve(config, logger, valve_commands, index)
 
-    def get_sensor_value(self) -> float:
-        """Get the current averaged soil moisture sensor value (0.0-1.0)."""
+    def get_sensor_value(self) -> int:
+        """Get the current averaged soil moisture in hundredths of a percent (0-10000)."""
         return self._sensor.get_value()
 
-    def measure_sensor(self) -> None:
+    async def measure_sensor(self) -> None:
         """Measure the sensor and update the rolling average without returning the value."""
-        self._sensor.measure()
+        await self._sensor.measure()
+
+    def power_on_sensor(self) -> None:
+        """Power on the sensor so it can stabilize as part of a sweep."""
+        self._sensor.power_on()
+
+    def read_sensor(self) -> None:
+        """Read the powered sensor and update the rolling average."""
+        self._sensor.read()
+
+    def sample_sensor(self) -> int:
+        """Read the powered sensor and return its moisture without averaging it."""
+        return self._sensor.sample()
+
+    def add_sensor_reading(self, moisture: int) -> None:
+        """Add a moisture sampled on core 1 to the rolling average."""
+        self._sensor.add_reading(moisture)
+
+    def power_off_sensor(self) -> None:
+        """Power off the sensor after a sweep."""
+        self._sensor.power_off()
 
     def open_valve(self) -> None:
         """Open the irrigation valve for this point."""
@@ -37,6 +63,10 @@ class IrrigationPoint:
         """Close the irrigation valve for this point."""
         self._valve.close()
 
+    def drive_valve(self, value: int) -> None:
+        """Write the valve pin directly, only on the core that owns it."""
+        self._valve.drive(value)
+
     def get_valve_state(self) -> str:
         """Return the current state (open/closed) of the valve."""
         return self._valve.get_state()
@@ -1,8 +1,16 @@
-from machine import I2C, Pin, Timer
+from machine import I2C, Pin
 from ads1x15 import ADS1115
 from config import Config
 from irrigation_point import IrrigationPoint
 from logger import Logger
+from sensor import STABILIZATION_MS
+from sensor_worker import SensorWorker, CommandQueue
+from array import array
+from time import ticks_us, ticks_diff
+import asyncio
+import profiler
+import scheduler
+import watchdog
 
 
 class IrrigationStation:
@@ -13,8 +21,20 @@ class IrrigationStation:
         self._config = config
         self._points: dict[str, IrrigationPoint] = {}
         self._logger = logger
-        self._measurement_timer = Timer(-1)
-        self._pending_measurement = False
+        self._measurement_job = scheduler.job(
+            "sensor_measurement", self._set_pending_measurement
+        )
+        self._pending_measurement = asyncio.ThreadSafeFlag()
+        self._sweep_phase = profiler.phase("sensor_sweep")
+        self.last_sweep_ms: int = 0
+        # Missing a few sweeps in a row means the sweep, or core 1, is stuck
+        self._heartbeat = watchdog.heartbeat(
+            "sensor_sweep", 3 * self._measurement_interval_ms()
+        )
+        # With dual_core, sweeps and valve pins run on core 1 and this core only
+        # collects the readings and queues valve commands
+        self._valve_commands = CommandQueue() if config.dual_core else None
+        self._worker: SensorWorker | None = None
         # Initialize I2C bus (shared for all ADS modules)
         self._i2c = I2C(0, scl=Pin(1), sda=Pin(0), freq=400000)
 
@@ -22,12 +42,25 @@ class IrrigationStation:
         self._setup_ads_modules()
 
         # Initialize irrigation points with their corresponding ADS modules
-        for point_id, point_conf in self._config.irrigation_points.items():
+        for index, (point_id, point_conf) in enumerate(
+            self._config.irrigation_points.items()
+        ):
             ads = self._ads_modules[point_conf.ads_address]
-            self._points[point_id] = IrrigationPoint(point_conf, ads, self._logger)
+            self._points[point_id] = IrrigationPoint(
+                point_conf, ads, self._logger, self._valve_commands, index
+            )
+
+        # Read channels grouped per ADS module so a sweep walks each module in turn
+        self._points_by_ads_read_order: list[IrrigationPoint] = sorted(
+            self._points.values(),
+            key=lambda p: (p.config.ads_address, p.config.ads_channel),
+        )
 
         # Start periodic measurements
-        self._start_measurement_timer()
+        if self._valve_commands is not None:
+            self._start_worker()
+        else:
+            self._start_measurement_job()
 
     def _setup_ads_modules(self) -> None:
         """Deduplicate ADS addresses and initialize ADS modules."""
@@ -39,12 +72,14 @@ class IrrigationStation:
         for address in unique_addresses:
             try:
                 self._ads_modules[address] = ADS1115(self._i2c, address=address, gain=0)
-                self._logger.log(
-                    f"[ADS1115] Initialized module at address {hex(address)}"
+                self._logger.info(
+                    "[ADS1115] Initialized module at address %s", hex(address)
                 )
             except Exception as e:
-                self._logger.log(
-                    f"[ADS1115] Failed to initialize module at address {hex(address)}: {e}"
+                self._logger.error(
+                    "[ADS1115] Failed to initialize module at address %s: %s",
+                    hex(address),
+                    e,
                 )
                 raise
 
@@ -54,28 +89,87 @@ class IrrigationStation:
             raise ValueError(f"Irrigation point '{point_id}' not found.")
         return self._points[point_id]
 
-    def _start_measurement_timer(self) -> None:
-        """Start the periodic measurement timer."""
-        # Calculate interval to collect rolling_window samples over the publish interval
-        interval_ms = self._config.publish_interval_ms // self._config.rolling_window
-        self._measurement_timer.init(
-            period=interval_ms,
-            mode=Timer.PERIODIC,
-            callback=self._set_pending_measurement,
+    def _measurement_interval_ms(self) -> int:
+        # Collect rolling_window samples over the publish interval
+        return self._config.publish_interval_ms // self._config.rolling_window
+
+    def _start_measurement_job(self) -> None:
+        """Start the periodic measurement job."""
+        interval_ms = self._measurement_interval_ms()
+        self._measurement_job.start(interval_ms, periodic=True)
+        self._logger.info(
+            "Periodic sensor measurement started (every %d ms)", interval_ms
         )
-        self._logger.log(
-            f"Periodic sensor measurement started (every {interval_ms} ms)"
+
+    def _start_worker(self) -> None:
+        """Hand the sweeps and the valve pins over to core 1."""
+        interval_ms = self._measurement_interval_ms()
+        self._worker = SensorWorker(
+            list(self._points.values()),
+            self._points_by_ads_read_order,
+            interval_ms,
+            self._config.parallel_sensor_sweep,
+            self._valve_commands,
+            self._pending_measurement,
+        )
+        self._worker.start()
+        self._logger.info(
+            "Sensor measurement started on core 1 (every %d ms)", interval_ms
         )
 
     def _set_pending_measurement(self, _=None) -> None:
-        self._pending_measurement = True
+        self._pending_measurement.set()
 
-    def handle_pending_measurement(self) -> None:
-        if self._pending_measurement:
-            self._measure_all_sensors()
-            self._pending_measurement = False
+    async def run(self) -> None:
+        """Measure all sensors every time the measurement timer fires."""
+        if self._worker is not None:
+            await self._collect_worker_sweeps()
+        while True:
+            await self._pending_measurement.wait()
+            start = ticks_us()
+            await self._measure_all_sensors()
+            duration_us = ticks_diff(ticks_us(), start)
+            self._sweep_phase.record(duration_us)
+            self.last_sweep_ms = duration_us // 1000
+            self._heartbeat.beat()
 
-    def _measure_all_sensors(self) -> None:
+    async def _collect_worker_sweeps(self) -> None:
+        """Average the sweeps core 1 finished, every time it signals one."""
+        ring = self._worker.ring
+        row = array("h", [0] * len(self._points_by_ads_read_order))
+        while True:
+            await self._pending_measurement.wait()
+            while True:
+                duration_us = ring.pop_into(row)
+                if duration_us < 0:
+                    break
+                for index, point in enumerate(self._points_by_ads_read_order):
+                    point.add_sensor_reading(row[index])
+                self._sweep_phase.record(duration_us)
+                self.last_sweep_ms = duration_us // 1000
+                self._heartbeat.beat()
+            if ring.dropped:
+                self._logger.warning("Core 1 overwrote %d sweeps", ring.dropped)
+                ring.dropped = 0
+
+    async def _measure_all_sensors(self) -> None:
         """Measure all sensors to update their rolling averages."""
-        for point in self._points.values():
-            point.measure_sensor()
+        if self._config.parallel_sensor_sweep:
+            await self._sweep_all_sensors()
+        else:
+            for point in self._points.values():
+                await point.measure_sensor()
+
+    async def _sweep_all_sensors(self) -> None:
+        """Power all sensors together, wait one shared stabilization window and read them back to back."""
+        points = self._points_by_ads_read_order
+        try:
+            for point in points:
+                point.power_on_sensor()
+            await asyncio.sleep_ms(STABILIZATION_MS)
+            for point in points:
+                point.read_sensor()
+        finally:
+            # Always power off all sensors
+            for point in points:
+                point.power_off_sensor()
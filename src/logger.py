@@ -1,42 +1,155 @@
 from typing import Callable
 from os import rename, stat, sync
+from time import ticks_ms, ticks_us, ticks_diff
+from micropython import const
+import asyncio
+import profiler
 import sys
 
-
 LOG_FILE_PATH = "./log.txt"
 LOG_FILE_PATH_OLD = "./log-old.txt"
 # Storage capicity is 4MB, 4194304 bytes
 # Max capacity dedicated to logging 25%
 # This is distributed over 2 files
 MAX_FILE_SIZE = int((4194304 * 0.25) / 2)
+# Log entries are collected in RAM and written to flash in batches.
+# A batch is flushed when the buffer is full or when its oldest entry
+# has been waiting for FLUSH_INTERVAL_MS
+BUFFER_SIZE = 2048
+FLUSH_INTERVAL_MS = 60_000
+
+# Log levels, entries at ERROR level are flushed to flash immediately.
+# The config's log_level is the only switch. Debug statements on hot paths
+# are guarded with `if logger.is_enabled(DEBUG):`, so the arguments aren't
+# even packed into a tuple while the level filters them out
+DEBUG = const(10)
+INFO = const(20)
+WARNING = const(30)
+ERROR = const(40)
+LEVELS = {"debug": DEBUG, "info": INFO, "warning": WARNING, "error": ERROR}
 
 
 def _return_empty_str() -> str:
     return ""
 
 
+def _get_file_size(file_path: str) -> int:
+    try:
+        return stat(file_path)[6]
+    except OSError:
+        return 0
+
+
 class Logger:
-    def __init__(self, should_print: bool = False) -> None:
+    def __init__(self, should_print: bool = False, level: int = INFO) -> None:
         self._should_print: bool = should_print
+        self._level: int = level
         self._get_timestamp: Callable[[], str] = _return_empty_str
+        self._buffer = bytearray(BUFFER_SIZE)
+        self._buffer_view = memoryview(self._buffer)
+        self._buffered_bytes: int = 0
+        self._oldest_entry_ms: int = 0
+        # Tracked in memory so rotation doesn't need a stat() per message
+        self._file_size: int = _get_file_size(LOG_FILE_PATH)
+        # Total written to flash since boot, across rotations
+        self.bytes_written: int = 0
+        self._flush_phase = profiler.phase("log_flush")
+
+    def set_level(self, level: int) -> None:
+        """Drop all log entries below the given level."""
+        self._level = level
+
+    def is_enabled(self, level: int) -> bool:
+        """Whether entries at `level` pass the filter."""
+        return level >= self._level
+
+    def debug(self, template: str, *args) -> None:
+        """Log a DEBUG entry, formatting `template % args` only when it passes the level filter."""
+        if self._level <= DEBUG:
+            self._log_lazy(DEBUG, template, args)
+
+    def info(self, template: str, *args) -> None:
+        """Log an INFO entry, formatting `template % args` only when it passes the level filter."""
+        if self._level <= INFO:
+            self._log_lazy(INFO, template, args)
+
+    def warning(self, template: str, *args) -> None:
+        """Log a WARNING entry, formatting `template % args` only when it passes the level filter."""
+        if self._level <= WARNING:
+            self._log_lazy(WARNING, template, args)
+
+    def error(self, template: str, *args) -> None:
+        """Log an ERROR entry and flush the buffer to flash."""
+        self._log_lazy(ERROR, template, args)
+
+    def log(self, msg: str, level: int = INFO) -> None:
+        """Log a preformatted message to the flash buffer and optionally print it."""
+        if level < self._level:
+            return
 
-    def log(self, msg: str) -> None:
-        """Log a message to file and optionally print it."""
         log_msg: str = self._format_msg(msg)
 
         if self._should_print:
             print(log_msg)
 
-        with open(LOG_FILE_PATH, "a") as curr_file:
-            curr_file.write(log_msg + "\n")
-            sync()
+        self._append((log_msg + "\n").encode())
+
+        if (
+            level >= ERROR
+            or ticks_diff(ticks_ms(), self._oldest_entry_ms) >= FLUSH_INTERVAL_MS
+        ):
+            self.flush()
 
+    def flush(self) -> None:
+        """Write all buffered log entries to flash."""
+        if self._buffered_bytes == 0:
+            return
+        self._write(self._buffer_view[: self._buffered_bytes])
+        self._buffered_bytes = 0
         self._rotate_file_if_needed()
 
+    async def run(self) -> None:
+        """Flush the buffer periodically so entries don't linger during quiet periods."""
+        while True:
+            await asyncio.sleep_ms(FLUSH_INTERVAL_MS)
+            start = ticks_us()
+            self.flush()
+            self._flush_phase.record(ticks_diff(ticks_us(), start))
+
     def enable_timestamp_prefix(self, get_timestamp: Callable[[], str]) -> None:
         """Enable timestamp prefix for log messages."""
         self._get_timestamp = get_timestamp
 
+    def _log_lazy(self, level: int, template: str, args: tuple) -> None:
+        self.log(template % args if args else template, level)
+
+    def _append(self, data: bytes) -> None:
+        """Copy an encoded entry into the buffer, flushing first when it doesn't fit."""
+        size = len(data)
+        if self._buffered_bytes + size > BUFFER_SIZE:
+            self.flush()
+        if size > BUFFER_SIZE:
+            # Entry larger than the whole buffer, write it straight through
+            self._write(data)
+            self._rotate_file_if_needed()
+            return
+        if self._buffered_bytes == 0:
+            self._oldest_entry_ms = ticks_ms()
+        end = self._buffered_bytes + size
+        self._buffer_view[self._buffered_bytes : end] = data
+        self._buffered_bytes = end
+
+    def _write(self, data) -> None:
+        """Append data to the log file and sync it to flash."""
+        try:
+            with open(LOG_FILE_PATH, "ab") as curr_file:
+                curr_file.write(data)
+            sync()
+            self._file_size += len(data)
+            self.bytes_written += len(data)
+        except OSError as e:
+            print(self._format_msg(f"Writing log file failed: {e}"))
+
     def _format_msg(self, msg: str) -> str:
         """Format a log message with optional timestamp."""
         is_single_line: bool = msg.count("\n") == 0
@@ -52,20 +165,19 @@ class Logger:
 
     def _rotate_file_if_needed(self) -> None:
         """Rotate log file if it exceeds the maximum allowed size."""
+        if self._file_size < MAX_FILE_SIZE:
+            return
         try:
-            file_size_bytes: int = stat(LOG_FILE_PATH)[6]
-            if file_size_bytes >= MAX_FILE_SIZE:
-                rename(LOG_FILE_PATH, LOG_FILE_PATH_OLD)
-                # Avoid recursion: write directly to file instead of calling self.log
-                msg = self._format_msg("Rotated log file")
-                with open(LOG_FILE_PATH, "a") as curr_file:
-                    curr_file.write(msg + "\n")
-                    sync()
-                if self._should_print:
-                    print(msg)
+            rename(LOG_FILE_PATH, LOG_FILE_PATH_OLD)
+            self._file_size = 0
+            # Avoid recursion: write directly to file instead of calling self.log
+            msg = self._format_msg("Rotated log file")
+            self._write((msg + "\n").encode())
+            if self._should_print:
+                print(msg)
         except OSError as e:
             print(
                 self._format_msg(
-                    f"Log file rotation failed, will try again on next log: {e}"
+                    f"Log file rotation failed, will try again on next flush: {e}"
                 )
             )
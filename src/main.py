@@ -1,15 +1,21 @@
-from machine import reset, Pin
+from machine import Pin
 from time import sleep
 from mqtt_hass_manager import MqttHassManager
 from irrigation_station import IrrigationStation
 from logger import Logger
-from watchdog import Watchdog
+from watchdog import Watchdog, flush_before_reset, restart
 from config import Config
 from time_keeper import TimeKeeper
 from wifi_manager import WiFiManager
+from power import PowerManager
+from time import ticks_us, ticks_diff
+import asyncio
 import gc
+import profiler
+import scheduler
 
 PRINT_LOGS = True
+GC_INTERVAL_S = 30
 
 if PRINT_LOGS:
     # Delay initialization for a bit, to ensure
@@ -19,54 +25,71 @@ if PRINT_LOGS:
     sleep(2)
 
 
-def main() -> None:
+async def _blink_onboard_led(onboard_led: Pin) -> None:
+    """Visual heartbeat: LED on for one second, off for two"""
+    while True:
+        onboard_led.on()
+        await asyncio.sleep(1)
+        onboard_led.off()
+        await asyncio.sleep(2)
+
+
+async def _collect_garbage() -> None:
+    """Run garbage collection periodically to prevent memory buildup"""
+    gc_phase = profiler.phase("gc_collect")
+    while True:
+        await asyncio.sleep(GC_INTERVAL_S)
+        start = ticks_us()
+        gc.collect()
+        gc_phase.record(ticks_diff(ticks_us(), start))
+
+
+async def main() -> None:
     # Initialize all components
     logger = Logger(PRINT_LOGS)
-    watchdog = Watchdog(120, logger)
+    watchdog = Watchdog(logger)
     time_keeper = TimeKeeper(logger)
     config = Config("./config.json")
     station = IrrigationStation(config, logger)
     wifi_manager = WiFiManager(config.network, logger)
     mqtt_manager = MqttHassManager(config, logger, station)
+    # Runs after the flushes the components registered, so their errors are logged
+    flush_before_reset(logger.flush)
 
     # Setup components
-    logger.log(str(config))
-    wifi_manager.setup()
-    time_keeper.initialize_ntp_synchronization()
+    logger.set_level(config.log_level)
+    logger.info("%s", config)
+    await wifi_manager.setup()
+    await time_keeper.initialize_ntp_synchronization()
     logger.enable_timestamp_prefix(time_keeper.get_current_cet_datetime_str)
     mqtt_manager.setup()
+    # Armed once setup returned, a setup waiting on the network could
+    # otherwise keep resetting the station before its tasks ever run
+    watchdog.start()
+    asyncio.create_task(watchdog.run())
+    if config.power_save:
+        asyncio.create_task(PowerManager(logger, wifi_manager).run())
 
     # LED for visual feedback
     onboard_led = Pin("LED", Pin.OUT)
 
-    loop_count = 0
-
+    # Every subsystem runs as its own task and sleeps until it has work to do
     try:
-        while True:
-            watchdog.feed()
-            wifi_manager.handle_pending_connection_check()
-            mqtt_manager.check_msg()
-            time_keeper.handle_pending_ntp_sync()
-            mqtt_manager.handle_pending_messages()
-            station.handle_pending_measurement()
-
-            loop_count += 1
-
-            # Run garbage collection every 30 loops (30 seconds) to prevent memory buildup
-            if loop_count % 30 == 0:
-                gc.collect()
-
-            # LED on every third second (loop_count % 3 == 0), off otherwise
-            if loop_count % 3 == 0:
-                onboard_led.on()
-            else:
-                onboard_led.off()
-
-            sleep(1)
+        await asyncio.gather(
+            logger.run(),
+            wifi_manager.run(),
+            mqtt_manager.run(),
+            time_keeper.run(),
+            station.run(),
+            _blink_onboard_led(onboard_led),
+            _collect_garbage(),
+            profiler.run(logger),
+            scheduler.run(),
+        )
     except Exception as e:
-        logger.log(f"Exception in main loop: {e}")
-        reset()
+        logger.error("Exception in main loop: %s", e)
+        restart()
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
@@ -1,13 +1,25 @@
 from typing import Any, Dict
 from json import dumps
 from umqtt.simple import MQTTClient
-from logger import Logger
+from logger import Logger, DEBUG
+from mqtt_payload import JsonPayload, MOISTURE_WIDTH, TIMESTAMP_WIDTH
 
 from irrigation_station import IrrigationPoint
 
 
 from collections import namedtuple
 
+# Queued readings are replayed below the state topic, so an old value never
+# replaces the current state in Home Assistant. Home Assistant has no entity
+# for them, the replay topics are for other consumers of the broker
+REPLAY_TOPIC_SUFFIX = "/replay"
+
+# Valve state payloads, encoded once instead of on every publish
+_VALVE_STATE_PAYLOADS = {
+    IrrigationPoint.STATE_OPEN: IrrigationPoint.STATE_OPEN.encode(),
+    IrrigationPoint.STATE_CLOSED: IrrigationPoint.STATE_CLOSED.encode(),
+}
+
 MessagerParams = namedtuple(
     "MessagerParams",
     [
@@ -16,87 +28,199 @@ MessagerParams = namedtuple(
         "irrigation_point",
         "device_info",
         "availability_topic",
+        "station_state_topic",
+        "device_discovery",
         "logger",
     ],
 )
 
 
 class MqttHassEntity:
+    PLATFORM: str = ""
+
     def __init__(self, params: "MessagerParams") -> None:
         self._client: MQTTClient = params.mqtt_client
         self._station_id: str = params.station_id
         self._point: IrrigationPoint = params.irrigation_point
+        # Station level entities have no irrigation point
+        self._object_id: str = (
+            params.irrigation_point.config.id if params.irrigation_point else ""
+        )
         self._device_info: Dict[str, Any] = params.device_info
         self._availability_topic: str = params.availability_topic
         self._logger: Logger = params.logger
+        self._device_discovery: bool = params.device_discovery
+        self._state_topic: str = ""
+        self._command_topic: str | None = None
+        self._discovery_topic: str = ""
+        self._discovery_payload: bytes = b""
 
-    def publish_discovery_message(self) -> None:
+    def build_discovery_config(self) -> Dict[str, Any]:
+        """Return the entity's discovery config, without the device info."""
         raise NotImplementedError(
-            "publish_discovery_message must be implemented by subclasses"
+            "build_discovery_config must be implemented by subclasses"
         )
 
-    def _log_discovery_message(self, topic: str, payload: dict) -> None:
-        lines = [
-            "Sent discovery message",
-            f"topic:         {topic}",
-            f"state_topic:   {payload['state_topic']}",
-        ]
-        if "command_topic" in payload:
-            lines.append(f"command_topic: {payload['command_topic']}")
-        self._logger.log("\n".join(lines))
+    def publish_state(self) -> None:
+        raise NotImplementedError("publish_state must be implemented by subclasses")
+
+    def publish_discovery_message(self) -> None:
+        """Publish the cached discovery message, followed by the current state."""
+        self._client.publish(
+            self._discovery_topic, self._discovery_payload, retain=True
+        )
+        self._log_discovery_message()
+        # Also publish state after discovery message so the entity has a value from the start
+        self.publish_state()
+
+    def _setup_discovery(self) -> None:
+        """Serialize the discovery message once, the manager publishes it on connect."""
+        if self._device_discovery:
+            # The manager registers all entities in a single device discovery message
+            return
+        self._discovery_topic = (
+            f"homeassistant/{self.PLATFORM}/{self._station_id}-{self._object_id}/config"
+        )
+        payload = self.build_discovery_config()
+        payload["device"] = self._device_info
+        self._discovery_payload = dumps(payload).encode()
+
+    def _log_discovery_message(self) -> None:
+        if self._command_topic is not None:
+            self._logger.info(
+                "Sent discovery message\n"
+                "topic:         %s\n"
+                "state_topic:   %s\n"
+                "command_topic: %s",
+                self._discovery_topic,
+                self._state_topic,
+                self._command_topic,
+            )
+        else:
+            self._logger.info(
+                "Sent discovery message\ntopic:         %s\nstate_topic:   %s",
+                self._discovery_topic,
+                self._state_topic,
+            )
 
 
 class MqttHassSensor(MqttHassEntity):
+    PLATFORM = "sensor"
+
     def __init__(self, params: MessagerParams) -> None:
         super().__init__(params)
-        self._state_topic: str = (
-            f"irrigation/{params.station_id}/{params.irrigation_point.config.id}/sensor"
+        self.state_key: str = params.irrigation_point.config.id
+        # With a station state topic all sensors share one packed document
+        # and are published together by the manager
+        self._uses_station_state: bool = params.station_state_topic is not None
+        if self._uses_station_state:
+            self._state_topic = params.station_state_topic
+            self._value_template: str = f"{{{{ value_json['{self.state_key}'] }}}}"
+        else:
+            self._state_topic = (
+                f"irrigation/{params.station_id}/{self.state_key}/sensor"
+            )
+            self._value_template: str = "{{ value_json.moisture }}"
+        self._state_topic_bytes: bytes = self._state_topic.encode()
+        self._replay_topic_bytes: bytes = (
+            self._state_topic + REPLAY_TOPIC_SUFFIX
+        ).encode()
+        self._payload = JsonPayload((("moisture", MOISTURE_WIDTH, 2),))
+        self._replay_payload = JsonPayload(
+            (("moisture", MOISTURE_WIDTH, 2), ("timestamp", TIMESTAMP_WIDTH, 0))
         )
-        self.publish_discovery_message()
+        self._setup_discovery()
 
-    def publish_discovery_message(self) -> None:
-        discovery_topic: str = (
-            f"homeassistant/sensor/{self._station_id}-{self._point.config.id}/config"
-        )
-        payload: Dict[str, Any] = {
+    def build_discovery_config(self) -> Dict[str, Any]:
+        return {
             "name": f"{self._point.config.name} Moisture",
             "unique_id": f"{self._point.config.id}_sensor",
             "device_class": "moisture",
             "state_class": "measurement",
             "unit_of_measurement": "%",
             "state_topic": self._state_topic,
-            "value_template": "{{ value_json.moisture }}",
+            "value_template": self._value_template,
             "availability_topic": self._availability_topic,
-            "device": self._device_info,
         }
-        self._client.publish(discovery_topic, dumps(payload), retain=True)
-        self._log_discovery_message(discovery_topic, payload)
-        # Also publish state after discovery message so the sensor has a value from the start
-        self.publish_moisture_level()
+
+    def publish_state(self) -> None:
+        # Sensors sharing the station state are published together by the manager
+        if not self._uses_station_state:
+            self.publish_moisture_level()
+
+    def get_moisture_value(self) -> int:
+        """Get the averaged moisture in hundredths of a percent."""
+        return self._point.get_sensor_value()
 
     def publish_moisture_level(self) -> None:
-        value: float = self._point.get_sensor_value()
-        payload: str = dumps({"moisture": round(value * 100, 2)})
-        self._client.publish(self._state_topic, payload)
-        self._logger.log(f"{self._state_topic}::{payload}")
+        self._payload.set(0, self.get_moisture_value())
+        self._client.publish(self._state_topic_bytes, self._payload.buffer)
+        if self._logger.is_enabled(DEBUG):
+            self._logger.debug("%s::%s", self._state_topic, self._payload)
+
+    def publish_replayed_moisture_level(self, value: int, timestamp: int) -> bool:
+        """Publish a queued reading together with the time it was measured."""
+        self._replay_payload.set(0, value)
+        self._replay_payload.set(1, timestamp)
+        if self._logger.is_enabled(DEBUG):
+            self._logger.debug(
+                "%s%s::%s", self._state_topic, REPLAY_TOPIC_SUFFIX, self._replay_payload
+            )
+        return self._client.publish(
+            self._replay_topic_bytes, self._replay_payload.buffer
+        )
+
+
+class MqttHassDiagnosticSensor(MqttHassEntity):
+    """Station health metric, all metrics share one telemetry document."""
+
+    PLATFORM = "sensor"
+
+    def __init__(self, params: MessagerParams, metric: tuple, state_topic: str) -> None:
+        super().__init__(params)
+        key, name, unit, device_class, state_class = metric
+        self._object_id = key
+        self._name: str = name
+        self._unit: str | None = unit
+        self._device_class: str | None = device_class
+        self._state_class: str = state_class
+        self._state_topic = state_topic
+        self._setup_discovery()
+
+    def build_discovery_config(self) -> Dict[str, Any]:
+        config = {
+            "name": self._name,
+            "unique_id": f"{self._station_id}_{self._object_id}",
+            "entity_category": "diagnostic",
+            "state_class": self._state_class,
+            "state_topic": self._state_topic,
+            "value_template": f"{{{{ value_json['{self._object_id}'] }}}}",
+            "availability_topic": self._availability_topic,
+        }
+        if self._unit is not None:
+            config["unit_of_measurement"] = self._unit
+        if self._device_class is not None:
+            config["device_class"] = self._device_class
+        return config
+
+    def publish_state(self) -> None:
+        # Diagnostic sensors are published together by the manager
+        pass
 
 
 class MqttHassValve(MqttHassEntity):
+    PLATFORM = "valve"
+
     def __init__(self, params: MessagerParams) -> None:
         super().__init__(params)
-        self._state_topic: str = (
-            f"irrigation/{params.station_id}/{params.irrigation_point.config.id}/valve/state"
-        )
-        self._command_topic: str = (
-            f"irrigation/{params.station_id}/{params.irrigation_point.config.id}/valve/set"
-        )
-        self.publish_discovery_message()
+        self._state_topic = f"irrigation/{params.station_id}/{params.irrigation_point.config.id}/valve/state"
+        self._command_topic = f"irrigation/{params.station_id}/{params.irrigation_point.config.id}/valve/set"
+        self._state_topic_bytes: bytes = self._state_topic.encode()
+        self._command_topic_bytes: bytes = self._command_topic.encode()
+        self._setup_discovery()
 
-    def publish_discovery_message(self) -> None:
-        discovery_topic: str = (
-            f"homeassistant/valve/{self._station_id}-{self._point.config.id}/config"
-        )
-        payload: Dict[str, Any] = {
+    def build_discovery_config(self) -> Dict[str, Any]:
+        return {
             "name": f"{self._point.config.name} Valve",
             "unique_id": f"{self._point.config.id}_valve",
             "state_topic": self._state_topic,
@@ -106,31 +230,29 @@ class MqttHassValve(MqttHassEntity):
             "state_open": "open",
             "state_closed": "closed",
             "optimistic": True,
+            # Commands are queued by the broker while the station is offline
+            "qos": 1,
             "availability_topic": self._availability_topic,
-            "device": self._device_info,
             "device_class": "water",
         }
-        self._client.publish(discovery_topic, dumps(payload), retain=True)
-        self._log_discovery_message(discovery_topic, payload)
-        # Also publish state after discovery message so the valve has a correct initial state
+
+    def publish_state(self) -> None:
         self.publish_valve_state()
 
     def publish_valve_state(self) -> None:
         state = self._point.get_valve_state()
         # Only allow IrrigationPoint.STATE_OPEN or STATE_CLOSED for Home Assistant
-        if state not in (IrrigationPoint.STATE_OPEN, IrrigationPoint.STATE_CLOSED):
+        payload = _VALVE_STATE_PAYLOADS.get(state)
+        if payload is None:
             raise ValueError(
                 f"Valve state '{state}' is invalid. Must be '{IrrigationPoint.STATE_OPEN}' or '{IrrigationPoint.STATE_CLOSED}'"
             )
-        self._client.publish(self._state_topic, state, retain=True)
-        self._logger.log(f"{self._state_topic}::{state}")
-
-    def subscribe_to_command_topic(self) -> None:
-        self._client.subscribe(self._command_topic)
-        self._logger.log(f"Subscribed::{self._command_topic}")
+        self._client.publish(self._state_topic_bytes, payload, retain=True)
+        if self._logger.is_enabled(DEBUG):
+            self._logger.debug("%s::%s", self._state_topic, state)
 
     def handle_command_message(self, msg: str) -> None:
-        self._logger.log(f"{self._command_topic}::{msg}")
+        self._logger.info("%s::%s", self._command_topic, msg)
         action = msg.strip().lower()
         if action == IrrigationPoint.STATE_OPEN:
             self._point.open_valve()
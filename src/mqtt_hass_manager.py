@@ -1,12 +1,25 @@
-from machine import Timer
 from mqtt_robust_client import MqttRobustClient
 from umqtt.simple import MQTTClient
 from config import Config
 from logger import Logger
 from irrigation_station import IrrigationStation
-from mqtt_hass_entities import MqttHassSensor, MqttHassValve, MessagerParams
+from mqtt_hass_entities import (
+    MqttHassSensor,
+    MqttHassValve,
+    MqttHassDiagnosticSensor,
+    MessagerParams,
+    REPLAY_TOPIC_SUFFIX,
+)
 from ssl import SSLContext, PROTOCOL_TLS_CLIENT
-from time import ticks_ms
+from json import dumps
+from mqtt_payload import JsonPayload, MOISTURE_WIDTH, TIMESTAMP_WIDTH
+from time import ticks_ms, ticks_us, ticks_diff, time
+from reading_queue import ReadingQueue
+from telemetry import Telemetry, METRICS
+import asyncio
+import power
+import profiler
+import scheduler
 
 CA_PATH = "./ca_crt.der"
 CERT_PATH = "./irrigationbackyard_crt.der"
@@ -14,6 +27,15 @@ KEY_PATH = "./irrigationbackyard_key.der"
 PORT = 8883
 KEEPALIVE = 60
 BROKER_CONNECTIVITY_TEST_INTERVAL = 1800000
+# Queued readings are replayed at a controlled rate after a reconnect
+DRAIN_INTERVAL_MS = 250
+DRAIN_COMMIT_EVERY = 20
+TELEMETRY_INTERVAL_MS = 60000
+# Incoming messages are handled for at most this long before the other tasks
+# get a turn, e.g. when Home Assistant sends a scene of valve commands at once
+MESSAGE_DRAIN_BUDGET_MS = 50
+ORIGIN_NAME = "irrigation-mp-hass-mqtt"
+SW_VERSION = "0.1"
 
 
 def create_ssl_context() -> SSLContext:
@@ -33,24 +55,73 @@ class MqttHassManager:
         self._config = config
         self._logger = logger
         self._station = station
-        self._timer = Timer(-1)
-        self._broker_connectivity_timer = Timer(-1)
-        self._pending_publish = False
-        self._pending_reconnect = False
-        self._pending_broker_connectivity_test = False
+        self._publish_job = scheduler.job("mqtt_publish", self._set_pending_publish)
+        self._broker_connectivity_job = scheduler.job(
+            "mqtt_broker_test", self._set_pending_broker_connectivity_test
+        )
+        self._telemetry_job = scheduler.job("telemetry", self._set_pending_telemetry)
+        self._pending_publish = asyncio.ThreadSafeFlag()
+        self._pending_reconnect = asyncio.ThreadSafeFlag()
+        self._pending_broker_connectivity_test = asyncio.ThreadSafeFlag()
+        self._pending_drain = asyncio.ThreadSafeFlag()
+        self._pending_telemetry = asyncio.ThreadSafeFlag()
+        self._check_msg_phase = profiler.phase("mqtt_check_msg")
+        self._publish_phase = profiler.phase("mqtt_publish")
+        self._replay_phase = profiler.phase("mqtt_replay")
+        self._reconnect_phase = profiler.phase("mqtt_reconnect")
+        self._broker_test_phase = profiler.phase("mqtt_broker_test")
+        self._telemetry_phase = profiler.phase("telemetry")
+        self._reading_queue = ReadingQueue(len(self._config.irrigation_points), logger)
         self._availability_topic = f"irrigation/{self._config.station_id}/availability"
+        # One wildcard subscription for the commands of every valve, routed by topic
+        self._command_topic_filter = f"irrigation/{self._config.station_id}/+/valve/set"
+        self._command_topic_prefix = f"irrigation/{self._config.station_id}/".encode()
+        # Subscriptions made since boot, a resumed session keeps them
+        self._subscribed = False
+        # Discovery is retained by the broker, it is only sent on the first connect
+        self._discovery_published = False
         self._broker_connectivity_topic = (
             f"irrigation/{self._config.station_id}/broker_connectivity"
         )
+        self._station_state_topic = (
+            f"irrigation/{self._config.station_id}/state"
+            if self._config.combined_state_topic
+            else None
+        )
+        self._station_state_topic_bytes = (
+            self._station_state_topic.encode()
+            if self._station_state_topic is not None
+            else None
+        )
+        self._station_replay_topic_bytes = (
+            (self._station_state_topic + REPLAY_TOPIC_SUFFIX).encode()
+            if self._station_state_topic is not None
+            else None
+        )
+        # Packed state documents, laid out once the sensors are set up
+        self._station_state_payload: JsonPayload | None = None
+        self._station_replay_payload: JsonPayload | None = None
+        self._device_discovery_topic = (
+            f"homeassistant/device/{self._config.station_id}/config"
+            if self._config.device_discovery
+            else None
+        )
+        self._telemetry_topic = (
+            f"irrigation/{self._config.station_id}/telemetry"
+            if self._config.telemetry
+            else None
+        )
+        self._device_discovery_payload = b""
         self._sensor_messagers = []
         self._valve_messagers = []
+        self._diagnostic_messagers = []
         self._command_topic_to_valve = {}
         self._device_info = {
             "identifiers": [self._config.station_id],
             "name": self._config.station_name,
             "manufacturer": "HenkNet IoT",
             "model": "Raspberry Pi Pico 2 W",
-            "sw_version": "0.1",
+            "sw_version": SW_VERSION,
         }
         self._client = MqttRobustClient(
             client_id=self._config.station_mqtt_id,
@@ -61,88 +132,217 @@ class MqttHassManager:
             logger=self._logger,
             on_reconnect_callback=self._on_reconnect_callback,
         )
+        self._telemetry = Telemetry(logger, station, self._client)
 
     def setup(self) -> None:
-        self._connect()
+        """Set up the entities and jobs without touching the network.
+
+        run() makes the first connection, discovery and subscriptions follow
+        from _handle_pending_reconnect(). Readings taken until then are queued.
+        """
+        self._client.set_last_will(self._availability_topic, "offline", retain=True)
         self._client.set_callback(self._handle_message)
-        self._set_online()
         self._setup_entities()
-        self._monitor_hass_status()
         self._start_periodic_publish()
         self._start_broker_connectivity_monitoring()
-
-    def check_msg(self) -> None:
-        self._client.check_msg()
-
-    def handle_pending_messages(self) -> None:
-        if self._pending_broker_connectivity_test:
-            self._handle_pending_broker_connectivity_test()
-            self._pending_broker_connectivity_test = False
-
-        if self._pending_reconnect:
-            self._handle_pending_reconnect()
-            self._pending_reconnect = False
-
-        if self._pending_publish:
-            for sensor_messager in self._sensor_messagers:
-                sensor_messager.publish_moisture_level()
-            self._pending_publish = False
-
-    def _handle_pending_reconnect(self) -> None:
-        self._logger.log(
-            "Reconnected to MQTT - restoring availability and subscriptions"
+        self._start_telemetry()
+
+    async def run(self) -> None:
+        """Run the MQTT input listener and the pending message handlers."""
+        await asyncio.gather(
+            self._client.run(),
+            self._listen_for_messages(),
+            self._handle_pending_publishes(),
+            self._handle_pending_reconnects(),
+            self._handle_pending_broker_connectivity_tests(),
+            self._drain_reading_queue(),
+            self._handle_pending_telemetry(),
         )
-        self._set_online()
-        self._resubscribe_after_reconnect()
 
-    def _resubscribe_after_reconnect(self) -> None:
-        """Resubscribe to all topics after reconnection since we use clean_session=True initially"""
-        try:
-            # Resubscribe to Home Assistant status
-            self._client.subscribe("homeassistant/status", qos=0)
+    async def _listen_for_messages(self) -> None:
+        # Wake up as soon as the broker sends something instead of polling
+        while True:
+            await self._client.wait_readable()
+            start = ticks_us()
+            # Every message that arrived is handled now, not one per wake-up
+            more = self._client.drain_msgs(MESSAGE_DRAIN_BUDGET_MS)
+            self._check_msg_phase.record(ticks_diff(ticks_us(), start))
+            if more:
+                await asyncio.sleep_ms(0)
+
+    async def _handle_pending_publishes(self) -> None:
+        while True:
+            await self._pending_publish.wait()
+            power.keep_awake()
+            start = ticks_us()
+            self._publish_moisture_levels()
+            self._publish_phase.record(ticks_diff(ticks_us(), start))
+
+    def _publish_moisture_levels(self) -> None:
+        if not self._client.is_connected():
+            # Store and forward: replayed by _drain_reading_queue after reconnecting
+            self._reading_queue.append(
+                time(),
+                [
+                    sensor_messager.get_moisture_value()
+                    for sensor_messager in self._sensor_messagers
+                ],
+            )
+            return
 
-            # Resubscribe to all valve command topics
-            for valve_messager in self._valve_messagers:
-                valve_messager.subscribe_to_command_topic()
+        if self._station_state_topic is None:
+            # Every sensor publishes its own topic, all of them in one write
+            self._client.begin_batch()
+            try:
+                for sensor_messager in self._sensor_messagers:
+                    sensor_messager.publish_moisture_level()
+            finally:
+                self._client.flush()
+            return
+        # One packed document for all sensors instead of a publish per sensor
+        payload = self._station_state_payload
+        sensor_messagers = self._sensor_messagers
+        # Indexing a range doesn't allocate, enumerate() and zip() do
+        for index in range(len(sensor_messagers)):
+            payload.set(index, sensor_messagers[index].get_moisture_value())
+        self._client.publish(self._station_state_topic_bytes, payload.buffer)
+
+    async def _drain_reading_queue(self) -> None:
+        while True:
+            await self._pending_drain.wait()
+            self._reading_queue.flush()
+            replayed = 0
+            while self._client.is_connected():
+                power.keep_awake()
+                start = ticks_us()
+                record = self._reading_queue.peek()
+                if record is None or not self._publish_replayed_reading(*record):
+                    break
+                self._replay_phase.record(ticks_diff(ticks_us(), start))
+                self._reading_queue.pop()
+                replayed += 1
+                if replayed % DRAIN_COMMIT_EVERY == 0:
+                    self._reading_queue.commit()
+                await asyncio.sleep_ms(DRAIN_INTERVAL_MS)
+            if replayed:
+                self._reading_queue.commit()
+                self._logger.info(
+                    "Replayed %d queued readings, %d left",
+                    replayed,
+                    len(self._reading_queue),
+                )
+                if self._client.is_connected():
+                    # The state topics still hold the reading from before the
+                    # outage, bring them up to date instead of waiting a period
+                    self._publish_moisture_levels()
+
+    def _publish_replayed_reading(self, timestamp: int, values: list) -> bool:
+        if self._station_state_topic is None:
+            self._client.begin_batch()
+            try:
+                for sensor_messager, value in zip(self._sensor_messagers, values):
+                    sensor_messager.publish_replayed_moisture_level(value, timestamp)
+            finally:
+                # Batched publishes are only sent, or dropped, here
+                sent = self._client.flush()
+            return sent
+        payload = self._station_replay_payload
+        payload.set(0, timestamp)
+        for index in range(len(values)):
+            payload.set(index + 1, values[index])
+        return self._client.publish(self._station_replay_topic_bytes, payload.buffer)
+
+    async def _handle_pending_reconnects(self) -> None:
+        while True:
+            await self._pending_reconnect.wait()
+            power.keep_awake()
+            start = ticks_us()
+            await self._handle_pending_reconnect()
+            self._reconnect_phase.record(ticks_diff(ticks_us(), start))
+
+    async def _handle_pending_broker_connectivity_tests(self) -> None:
+        while True:
+            await self._pending_broker_connectivity_test.wait()
+            power.keep_awake()
+            start = ticks_us()
+            await self._handle_pending_broker_connectivity_test()
+            self._broker_test_phase.record(ticks_diff(ticks_us(), start))
+
+    async def _handle_pending_telemetry(self) -> None:
+        while True:
+            await self._pending_telemetry.wait()
+            power.keep_awake()
+            start = ticks_us()
+            self._publish_telemetry()
+            self._telemetry_phase.record(ticks_diff(ticks_us(), start))
+
+    def _publish_telemetry(self) -> None:
+        if self._telemetry_topic is None or not self._client.is_connected():
+            # Telemetry describes the present, there is no point in queueing it
+            return
+        self._client.publish(self._telemetry_topic, dumps(self._telemetry.collect()))
 
-            self._logger.log("Resubscribed to all command topics after reconnection")
+    async def _handle_pending_reconnect(self) -> None:
+        if self._discovery_published:
+            self._logger.info(
+                "Reconnected to MQTT - restoring availability and subscriptions"
+            )
+            self._set_online()
+        else:
+            self._logger.info(
+                "Connected to MQTT Broker:\nAddress:   %s:%d\nClient ID: %s",
+                self._config.network.mqtt_broker_ip,
+                PORT,
+                self._config.station_mqtt_id,
+            )
+            self._publish_discovery()
+            # Retried on the next connect if the connection dropped halfway
+            self._discovery_published = self._client.is_connected()
+        # The entities exist, so a resumed session may deliver the commands it
+        # queued as soon as the first packet is read
+        await self._subscribe()
+        # Also replays the readings queued before a reboot
+        self._pending_drain.set()
+
+    async def _subscribe(self) -> None:
+        """Subscribe to the valve commands and Home Assistant status, unless the broker kept them."""
+        if self._subscribed and self._client.session_present:
+            self._logger.info("MQTT session resumed, subscriptions kept")
+            return
+        try:
+            # QoS 1 so the broker queues commands for the session while the
+            # station is disconnected
+            self._subscribed = await self._client.subscribe(
+                (self._command_topic_filter, 1), ("homeassistant/status", 0)
+            )
+            if self._subscribed:
+                self._logger.info(
+                    "Subscribed to %s and Home Assistant status",
+                    self._command_topic_filter,
+                )
         except Exception as e:
-            self._logger.log(f"Failed to resubscribe after reconnection: {e}")
+            self._subscribed = False
+            self._logger.error("Failed to subscribe: %s", e)
 
-    def _handle_pending_broker_connectivity_test(self) -> None:
+    async def _handle_pending_broker_connectivity_test(self) -> None:
         current_time = ticks_ms()
         test_payload = f"broker_connectivity_test_{current_time}"
 
-        self._client.publish(self._broker_connectivity_topic, test_payload, qos=1)
-        self._logger.log(f"Broker connectivity test acknowledged: {test_payload}")
-
-    def _connect(self) -> None:
-        self._client.connect(
-            clean_session=True,
-            timeout=None,
-            lwt_topic=self._availability_topic,
-            lwt_msg="offline",
-            lwt_retain=True,
-            lwt_qos=0,
-        )
-
-        message = "\n".join(
-            [
-                "Connected to MQTT Broker:",
-                f"Address:   {self._config.network.mqtt_broker_ip}:{PORT}",
-                f"Client ID: {self._config.station_mqtt_id}",
-            ]
-        )
-        self._logger.log(message)
+        if await self._client.publish_acked(
+            self._broker_connectivity_topic, test_payload
+        ):
+            self._logger.info("Broker connectivity test acknowledged: %s", test_payload)
+        else:
+            self._logger.warning("Broker connectivity test failed: %s", test_payload)
 
     def _set_online(self) -> None:
         try:
             self._client.publish(self._availability_topic, "online", retain=True)
         except Exception as e:
-            self._logger.log(f"Failed to publish LWT online message: {e}")
+            self._logger.error("Failed to publish LWT online message: %s", e)
 
     def _on_reconnect_callback(self) -> None:
-        self._pending_reconnect = True
+        self._pending_reconnect.set()
 
     def _setup_entities(self) -> None:
         for _, point in self._config.irrigation_points.items():
@@ -154,6 +354,8 @@ class MqttHassManager:
                 irrigation_point=irrigation_point,
                 device_info=self._device_info,
                 availability_topic=self._availability_topic,
+                station_state_topic=self._station_state_topic,
+                device_discovery=self._device_discovery_topic is not None,
                 logger=self._logger,
             )
             sensor_messager = MqttHassSensor(params)
@@ -161,73 +363,149 @@ class MqttHassManager:
 
             self._sensor_messagers.append(sensor_messager)
             self._valve_messagers.append(valve_messager)
-            self._command_topic_to_valve[valve_messager._command_topic] = valve_messager
-            try:
-                valve_messager.subscribe_to_command_topic()
-            except Exception as e:
-                self._logger.log(
-                    f"Failed to subscribe to {valve_messager._command_topic}: {e}"
+            self._command_topic_to_valve[valve_messager._command_topic_bytes] = (
+                valve_messager
+            )
+
+        if self._station_state_topic is not None:
+            self._setup_station_state_payloads()
+
+        if self._telemetry_topic is not None:
+            params = MessagerParams(
+                mqtt_client=self._client,
+                station_id=self._config.station_id,
+                irrigation_point=None,
+                device_info=self._device_info,
+                availability_topic=self._availability_topic,
+                station_state_topic=self._station_state_topic,
+                device_discovery=self._device_discovery_topic is not None,
+                logger=self._logger,
+            )
+            for metric in METRICS:
+                self._diagnostic_messagers.append(
+                    MqttHassDiagnosticSensor(params, metric, self._telemetry_topic)
                 )
 
-    def _handle_message(self, topic_bytes: bytes, msg_bytes: bytes) -> None:
-        topic = topic_bytes.decode()
-        msg = msg_bytes.decode()
+        if self._device_discovery_topic is not None:
+            self._device_discovery_payload = self._build_device_discovery_payload()
 
-        if topic == "homeassistant/status":
-            self._handle_ha_status_message(msg)
-            return
+    def _setup_station_state_payloads(self) -> None:
+        fields = tuple(
+            (sensor_messager.state_key, MOISTURE_WIDTH, 2)
+            for sensor_messager in self._sensor_messagers
+        )
+        self._station_state_payload = JsonPayload(fields)
+        self._station_replay_payload = JsonPayload(
+            (("timestamp", TIMESTAMP_WIDTH, 0),) + fields
+        )
+
+    def _all_messagers(self) -> list:
+        return (
+            self._sensor_messagers + self._valve_messagers + self._diagnostic_messagers
+        )
 
-        valve_messager = self._command_topic_to_valve.get(topic)
-        if valve_messager:
+    def _build_device_discovery_payload(self) -> bytes:
+        """Serialize one discovery message that registers every entity of the station."""
+        components = {}
+        for messager in self._all_messagers():
+            component = messager.build_discovery_config()
+            component["platform"] = messager.PLATFORM
+            components[component["unique_id"]] = component
+        payload = {
+            "device": self._device_info,
+            "origin": {"name": ORIGIN_NAME, "sw_version": SW_VERSION},
+            "components": components,
+        }
+        return dumps(payload).encode()
+
+    def _publish_device_discovery(self) -> None:
+        self._client.publish(
+            self._device_discovery_topic, self._device_discovery_payload, retain=True
+        )
+        self._logger.info(
+            "Sent device discovery message\ntopic:         %s\ncomponents:    %d",
+            self._device_discovery_topic,
+            len(self._all_messagers()),
+        )
+        # Also publish states after discovery so all entities have a value from the start
+        for messager in self._all_messagers():
+            messager.publish_state()
+
+    def _handle_message(self, topic_bytes: bytes, msg_bytes: bytes) -> None:
+        # Everything under the station's prefix comes in through the command
+        # wildcard, the bytes topic is looked up without decoding it
+        if topic_bytes.startswith(self._command_topic_prefix):
+            valve_messager = self._command_topic_to_valve.get(topic_bytes)
+            if valve_messager is None:
+                self._logger.warning(
+                    "Command for unknown irrigation point: %s", topic_bytes.decode()
+                )
+                return
+            # The state update and a follow-up command shouldn't wait for a DTIM
+            power.keep_awake()
             try:
-                valve_messager.handle_command_message(msg)
+                valve_messager.handle_command_message(msg_bytes.decode())
             except Exception as e:
-                self._logger.log(f"Error handling command message for {topic}: {e}")
+                self._logger.error(
+                    "Error handling command message for %s: %s",
+                    topic_bytes.decode(),
+                    e,
+                )
+            return
+
+        if topic_bytes == b"homeassistant/status":
+            self._handle_ha_status_message(msg_bytes.decode())
 
     def _start_periodic_publish(self) -> None:
-        self._timer.init(
-            period=self._config.publish_interval_ms,
-            mode=Timer.PERIODIC,
-            callback=self._set_pending_publish,
-        )
+        self._publish_job.start(self._config.publish_interval_ms, periodic=True)
 
     def _set_pending_publish(self, _=None) -> None:
-        self._pending_publish = True
+        self._pending_publish.set()
 
     def _start_broker_connectivity_monitoring(self) -> None:
-        self._broker_connectivity_timer.init(
-            period=BROKER_CONNECTIVITY_TEST_INTERVAL,
-            mode=Timer.PERIODIC,
-            callback=self._set_pending_broker_connectivity_test,
+        self._broker_connectivity_job.start(
+            BROKER_CONNECTIVITY_TEST_INTERVAL, periodic=True
         )
-        self._logger.log("Broker connectivity monitoring started")
+        self._logger.info("Broker connectivity monitoring started")
 
     def _set_pending_broker_connectivity_test(self, _=None) -> None:
-        self._pending_broker_connectivity_test = True
+        self._pending_broker_connectivity_test.set()
 
-    def _monitor_hass_status(self) -> None:
-        try:
-            self._client.subscribe("homeassistant/status", qos=0)
-            self._logger.log("Subscribed to Home Assistant status messages")
-        except Exception as e:
-            self._logger.log(f"Failed to subscribe to HA status: {e}")
+    def _start_telemetry(self) -> None:
+        if self._telemetry_topic is None:
+            return
+        self._telemetry_job.start(TELEMETRY_INTERVAL_MS, periodic=True)
+
+    def _set_pending_telemetry(self, _=None) -> None:
+        self._pending_telemetry.set()
 
     def _handle_ha_status_message(self, status: str) -> None:
         if status == "online":
-            self._logger.log("Home Assistant came online - republishing availability")
-            self._republish_after_ha_restart()
+            self._logger.info("Home Assistant came online - republishing availability")
+            self._publish_discovery()
         elif status == "offline":
-            self._logger.log("Home Assistant went offline")
+            self._logger.info("Home Assistant went offline")
 
-    def _republish_after_ha_restart(self) -> None:
+    def _publish_discovery(self) -> None:
+        """Publish availability, the discovery messages and the state of every entity."""
+        # Discovery messages and states go out in as few writes as the packet
+        # buffer allows
+        self._client.begin_batch()
         try:
             self._client.publish(self._availability_topic, "online", retain=True)
 
-            for sensor_messager in self._sensor_messagers:
-                sensor_messager.publish_discovery_message()
+            if self._device_discovery_topic is not None:
+                self._publish_device_discovery()
+            else:
+                for messager in self._all_messagers():
+                    messager.publish_discovery_message()
 
-            for valve_messager in self._valve_messagers:
-                valve_messager.publish_discovery_message()
+            if self._station_state_topic is not None:
+                # Sensors sharing the station state are published together
+                self._publish_moisture_levels()
+            self._publish_telemetry()
 
         except Exception as e:
-            self._logger.log(f"Failed to republish after HA online: {e}")
+            self._logger.error("Failed to publish discovery: %s", e)
+        finally:
+            self._client.flush()
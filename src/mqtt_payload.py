@@ -0,0 +1,76 @@
+from json import dumps
+from micropython import const
+
+# Field widths of the published numbers, padded with spaces
+MOISTURE_WIDTH = const(6)  # "100.00", moisture in hundredths of a percent
+TIMESTAMP_WIDTH = const(10)  # Seconds since the epoch, up to 2**31
+
+_SPACE = const(0x20)
+_DOT = const(0x2E)
+_ZERO = const(0x30)
+
+
+def _put_number(field: memoryview, value: int, decimals: int) -> None:
+    """Write a non-negative fixed-point integer right-aligned into `field`."""
+    i = len(field)
+    places = 0
+    while value or places <= decimals:
+        if decimals and places == decimals:
+            i -= 1
+            field[i] = _DOT
+        i -= 1
+        field[i] = _ZERO + value % 10
+        value //= 10
+        places += 1
+    while i:
+        i -= 1
+        field[i] = _SPACE
+
+
+class JsonPayload:
+    """A flat JSON object of numbers, rendered in place into one preallocated buffer.
+
+    Every value has a fixed-width field, right-aligned and padded with
+    spaces, which JSON allows around values. The payload keeps the same
+    length, so `buffer` is published as is and filling in the values through
+    memoryview slices allocates nothing, where building a dict and calling
+    `json.dumps` on every publish fragments the heap over weeks of uptime.
+    """
+
+    def __init__(self, fields: tuple) -> None:
+        """`fields` holds a (key, width, decimals) tuple per value, in order."""
+        layout = []
+        offsets = []
+        size = 1
+        for key, width, _ in fields:
+            name = dumps(key).encode() + b":"
+            layout.append(name + b" " * width)
+            size += len(name)
+            offsets.append(size)
+            size += width + 1
+        self.buffer = bytearray(b"{" + b",".join(layout) + b"}")
+        view = memoryview(self.buffer)
+        self._fields = [
+            (view[offset : offset + width], decimals, _field_limit(width, decimals))
+            for offset, (_, width, decimals) in zip(offsets, fields)
+        ]
+        for index in range(len(fields)):
+            self.set(index, 0)
+
+    def set(self, index: int, value: int) -> None:
+        """Set field `index` to `value`, a fixed-point integer with the field's decimals."""
+        field, decimals, limit = self._fields[index]
+        if not 0 <= value < limit:
+            raise ValueError(f"Value {value} does not fit payload field {index}")
+        _put_number(field, value, decimals)
+
+    def __str__(self) -> str:
+        return str(self.buffer, "utf-8")
+
+
+def _field_limit(width: int, decimals: int) -> int:
+    """First value that no longer fits a field of `width` characters."""
+    digits = width - 1 if decimals else width
+    if digits <= decimals:
+        raise ValueError("Payload field too narrow for its decimals")
+    return 10**digits
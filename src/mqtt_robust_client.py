@@ -1,12 +1,54 @@
-from umqtt.simple import MQTTClient
-from time import sleep
+from umqtt.simple import MQTTClient, MQTTException
+from errno import ECONNRESET, ETIMEDOUT
+from time import ticks_ms, ticks_us, ticks_diff
+from random import getrandbits
 from logger import Logger
+import asyncio
+import profiler
+import watchdog
+import wifi_manager
+
+# Connection states of the reconnect state machine
+STATE_CONNECTED = 0
+STATE_BACKOFF = 1
+STATE_CONNECTING = 2
+
+# Reconnect delays grow exponentially from BACKOFF_BASE_MS up to BACKOFF_MAX_MS
+BACKOFF_BASE_MS = 1000
+BACKOFF_MAX_MS = 60_000
+# Upper bound for a single blocking connect attempt (TCP + TLS + CONNACK)
+CONNECT_TIMEOUT_S = 5
+# A PUBACK or SUBACK that doesn't arrive within this time means the
+# connection is dead. Other tasks keep running while it is awaited
+ACK_TIMEOUT_MS = 5000
+# Packet types of the acknowledgements, umqtt.simple leaves their body unread
+_PUBACK = 0x40
+_SUBACK = 0x90
+# The run loop wakes up at least every ping interval or backoff delay
+HEARTBEAT_TIMEOUT_MS = 3 * BACKOFF_MAX_MS
+# Packets are assembled in one buffer and sent with a single write, which is
+# a single TLS record. It grows for a batch that doesn't fit, such as the
+# discovery messages and states republished when Home Assistant restarts
+PACKET_BUFFER_SIZE = 512
+# A batch beyond this size is split over several writes, only a single
+# packet that is larger grows the buffer further
+BATCH_BUFFER_MAX = 8192
+# Room for the fixed header: the packet type and up to 4 remaining length bytes
+_FIXED_HEADER_MAX = 5
+
+
+def backoff_delay_ms(failures: int) -> int:
+    """Capped exponential backoff with equal jitter: half fixed, half random."""
+    delay = BACKOFF_BASE_MS << min(failures, 16)
+    if delay > BACKOFF_MAX_MS:
+        delay = BACKOFF_MAX_MS
+    half = delay >> 1
+    return half + ((getrandbits(16) * half) >> 16)
 
 
 class MqttRobustClient(MQTTClient):
-    """MQTT Client based on umqtt.robust with threading-safe callback pattern"""
+    """MQTT Client based on umqtt.robust that reconnects from an asyncio task instead of blocking"""
 
-    DELAY = 2
     DEBUG = False
 
     def __init__(
@@ -27,85 +69,395 @@ class MqttRobustClient(MQTTClient):
         )
         self._logger = logger
         self._on_reconnect_callback = on_reconnect_callback
-
-    def delay(self, i):
-        multiplier = i if isinstance(i, int) and i > 0 else 1
-        sleep(self.DELAY * multiplier)
+        # run() makes the first connection, so setup never waits for the broker
+        self._state = STATE_CONNECTING
+        self._failures = 0
+        self._has_connected = False
+        self.reconnect_count = 0
+        # Whether the broker resumed the previous session on the last connect,
+        # with its subscriptions and the QoS 1 messages queued for it
+        self.session_present = False
+        self._connected_event = asyncio.Event()
+        self._disconnected_event = asyncio.Event()
+        self._disconnected_event.set()
+        self._connect_phase = profiler.phase("mqtt_connect")
+        self._heartbeat = watchdog.heartbeat("mqtt", HEARTBEAT_TIMEOUT_MS)
+        self._packet = bytearray(PACKET_BUFFER_SIZE)
+        self._packet_view = memoryview(self._packet)
+        self._packet_bytes = 0
+        self._batching = False
+        # Packets handled since the socket last ran dry, and the most since
+        # take_max_backlog() was last called
+        self._backlog = 0
+        self._max_backlog = 0
+        # One acknowledged publish or subscribe at a time. Its PUBACK or
+        # SUBACK is read by the task that reads the socket, see check_msg()
+        self._ack_lock = asyncio.Lock()
+        self._ack_event = asyncio.Event()
+        self._ack_op = 0
+        self._ack_pid = 0
+        self._ack_result = 0
 
     def log(self, in_reconnect, e):
         if self._logger:
             if in_reconnect:
-                self._logger.log(f"mqtt reconnect: {e}")
+                self._logger.error("mqtt reconnect: %s", e)
             else:
-                self._logger.log(f"mqtt: {e}")
+                self._logger.error("mqtt: %s", e)
+
+    def is_connected(self) -> bool:
+        return self._state == STATE_CONNECTED
 
-    def reconnect(self):
-        reconnect_failures = 0
+    async def run(self) -> None:
+        """Drive the reconnect state machine and keep the connection alive with pings.
 
+        While disconnected, every other task keeps running: publishes are
+        dropped and reconnect attempts are spaced out with capped exponential
+        backoff and jitter instead of blocking the event loop.
+        """
+        ping_interval_ms = (self.keepalive * 1000) // 2 if self.keepalive else 0
         while True:
+            self._heartbeat.beat()
+            if self._state == STATE_CONNECTED:
+                if not ping_interval_ms:
+                    await self._disconnected_event.wait()
+                    continue
+                try:
+                    await asyncio.wait_for_ms(
+                        self._disconnected_event.wait(), ping_interval_ms
+                    )
+                except asyncio.TimeoutError:
+                    self._ping()
+                continue
+
+            if self._state == STATE_BACKOFF:
+                await asyncio.sleep_ms(backoff_delay_ms(self._failures))
+                self._state = STATE_CONNECTING
+                continue
+
+            # STATE_CONNECTING: a single attempt, bounded by CONNECT_TIMEOUT_S
+            start = ticks_us()
             try:
-                result = super().connect(clean_session=False)
-                # Call callback to toggle boolean flag (light work only)
-                if self._on_reconnect_callback:
-                    self._on_reconnect_callback()
-                return result
+                self.session_present = bool(
+                    super().connect(clean_session=False, timeout=CONNECT_TIMEOUT_S)
+                )
             except OSError as e:
-                reconnect_failures += 1
+                self._connect_phase.record(ticks_diff(ticks_us(), start))
+                self._failures += 1
                 # Log on first attempt and then every 5 attempts
-                if reconnect_failures == 0 or reconnect_failures % 5 == 0:
+                if self._failures == 1 or self._failures % 5 == 0:
                     self.log(True, e)
-                self.delay(reconnect_failures)
+                self._close_socket()
+                self._state = STATE_BACKOFF
+                # A link joined through a cached access point may lead nowhere
+                wifi_manager.report_broker_connect(False)
+                continue
 
-    def publish(self, topic, msg, retain=False, qos=0):
-        """Publish with retry and reconnect until reconnect timeout expires"""
-        while 1:
-            try:
-                result = super().publish(topic, msg, retain, qos)
-                return result
-            except OSError as e:
-                self.log(False, e)
-            self.reconnect()
+            self._connect_phase.record(ticks_diff(ticks_us(), start))
+            if self._has_connected:
+                self.reconnect_count += 1
+            self._set_connected()
+            wifi_manager.report_broker_connect(True)
+            # Call callback to toggle boolean flag (light work only)
+            if self._on_reconnect_callback:
+                self._on_reconnect_callback()
 
-    def wait_msg(self):
-        """Wait for message with retry and reconnect until reconnect timeout expires"""
-        while 1:
+    def publish(self, topic, msg, retain=False) -> bool:
+        """Publish with QoS 0 if connected. Returns False when the message was dropped.
+
+        umqtt.simple writes the header, topic and payload separately, each
+        write its own TLS record. Here the packet is written at once, and
+        during a batch the packets wait in the buffer for flush().
+        """
+        if self._state != STATE_CONNECTED:
+            return False
+        try:
+            self._append_publish(topic, msg, retain, 0, 0)
+            if self._batching:
+                return True
+            self._send_packets()
+            return True
+        except OSError as e:
+            self.log(False, e)
+            self._set_disconnected()
+            return False
+
+    async def publish_acked(self, topic, msg, retain=False) -> bool:
+        """Publish with QoS 1 and wait for the PUBACK. Returns False when it didn't arrive."""
+        async with self._ack_lock:
+            if self._state != STATE_CONNECTED:
+                return False
+            pid = self._next_pid()
             try:
-                result = super().wait_msg()
-                return result
+                self._append_publish(topic, msg, retain, 1, pid)
+                # Also sends the publishes batched so far
+                self._send_packets()
+                await self._wait_ack(_PUBACK, pid)
+                return True
             except OSError as e:
                 self.log(False, e)
-            self.reconnect()
+                self._set_disconnected()
+                return False
+
+    async def subscribe(self, *filters) -> bool:
+        """Subscribe to (topic, qos) filters if connected and wait for the SUBACK.
 
-    def check_msg(self, attempts=4):
-        """Check messages like umqtt.robust - limited attempts"""
-        while attempts:
-            self.sock.setblocking(False)
+        All filters go in one SUBSCRIBE packet, so a fresh session waits for
+        one SUBACK. Returns False when it didn't arrive.
+        """
+        assert self.cb is not None, "Subscribe callback is not set"
+        async with self._ack_lock:
+            if self._state != STATE_CONNECTED:
+                return False
+            pid = self._next_pid()
             try:
-                result = super().wait_msg()
-                return result
+                self._append_subscribe(filters, pid)
+                # Also sends the publishes batched so far
+                self._send_packets()
+                granted = await self._wait_ack(_SUBACK, pid)
             except OSError as e:
                 self.log(False, e)
-            self.reconnect()
-            attempts -= 1
+                self._set_disconnected()
+                return False
+        if granted == 0x80:
+            raise MQTTException(granted)
+        return True
 
-    def connect(
-        self,
-        clean_session=True,
-        timeout=None,
-        lwt_topic=None,
-        lwt_msg=None,
-        lwt_retain=False,
-        lwt_qos=0,
-    ):
-        """Connect with LWT support and infinite retry"""
-        if lwt_topic:
-            self.set_last_will(lwt_topic, lwt_msg, lwt_retain, lwt_qos)
+    def begin_batch(self) -> None:
+        """Hold QoS 0 publishes back until flush(), to send them in one write."""
+        self._batching = True
 
-        i = 1
-        while True:
-            try:
-                return super().connect(clean_session, timeout)
-            except OSError as e:
-                self.log(True, e)
-                self.delay(i)
-                i += 1
+    def flush(self) -> bool:
+        """End a batch and send its publishes. Returns False when they were dropped."""
+        self._batching = False
+        if self._state != STATE_CONNECTED:
+            return False
+        try:
+            self._send_packets()
+            return True
+        except OSError as e:
+            self.log(False, e)
+            self._set_disconnected()
+            return False
+
+    async def wait_readable(self) -> None:
+        """Suspend the calling task until the broker socket has data to read"""
+        await self._connected_event.wait()
+        try:
+            # A zero-length read on an asyncio stream parks the task on the event
+            # loop poller until the socket becomes readable, without consuming data
+            await asyncio.StreamReader(self.sock).read(0)
+        except OSError as e:
+            self.log(False, e)
+            self._set_disconnected()
+
+    def check_msg(self):
+        """Handle one incoming message if there is one, without blocking.
+
+        Also completes the acknowledgement awaited by publish_acked() or
+        subscribe(): MicroPython's poller wakes only one task per socket, so
+        the task waiting on wait_readable() reads the acknowledgements too.
+        """
+        if self._state != STATE_CONNECTED:
+            return None
+        self.sock.setblocking(False)
+        try:
+            op = super().wait_msg()
+            if op == _PUBACK or op == _SUBACK:
+                self._read_ack(op)
+            return op
+        except OSError as e:
+            self.log(False, e)
+            self._set_disconnected()
+            return None
+
+    def drain_msgs(self, budget_ms: int) -> bool:
+        """Handle incoming packets until none are left or `budget_ms` has passed.
+
+        Returns True when the budget ran out and packets may still be waiting.
+        """
+        start = ticks_ms()
+        while self.check_msg() is not None:
+            self._backlog += 1
+            if ticks_diff(ticks_ms(), start) >= budget_ms:
+                self._track_backlog()
+                return True
+        self._track_backlog()
+        # A PINGRESP also ends the drain, anything after it makes the
+        # socket readable again
+        self._backlog = 0
+        return False
+
+    def take_max_backlog(self) -> int:
+        """Most packets that arrived in one burst since the previous call."""
+        backlog = self._max_backlog
+        self._max_backlog = self._backlog
+        return backlog
+
+    def connect(self, clean_session=True, timeout=None):
+        """Connect once, outside of run(). Raises OSError when the broker is unreachable."""
+        result = super().connect(clean_session, timeout)
+        self.session_present = bool(result)
+        self._set_connected()
+        return result
+
+    def _append_publish(self, topic, msg, retain, qos, pid) -> None:
+        if isinstance(topic, str):
+            topic = topic.encode()
+        if isinstance(msg, str):
+            msg = msg.encode()
+        topic_size = len(topic)
+        msg_size = len(msg)
+        remaining = 2 + topic_size + msg_size
+        if qos:
+            remaining += 2
+        i = self._reserve(_FIXED_HEADER_MAX + remaining)
+        packet = self._packet
+        packet[i] = 0x30 | qos << 1 | retain
+        i = self._put_remaining_length(i + 1, remaining)
+        i = self._put_bytes(i, topic, topic_size)
+        if qos:
+            packet[i] = pid >> 8
+            packet[i + 1] = pid & 0xFF
+            i += 2
+        self._packet_view[i : i + msg_size] = msg
+        self._packet_bytes = i + msg_size
+
+    def _append_subscribe(self, filters, pid) -> None:
+        filters = [
+            (topic.encode() if isinstance(topic, str) else topic, qos)
+            for topic, qos in filters
+        ]
+        remaining = 2
+        for topic, _ in filters:
+            remaining += 2 + len(topic) + 1
+        i = self._reserve(_FIXED_HEADER_MAX + remaining)
+        packet = self._packet
+        packet[i] = 0x82
+        i = self._put_remaining_length(i + 1, remaining)
+        packet[i] = pid >> 8
+        packet[i + 1] = pid & 0xFF
+        i += 2
+        for topic, qos in filters:
+            i = self._put_bytes(i, topic, len(topic))
+            packet[i] = qos
+            i += 1
+        self._packet_bytes = i
+
+    def _reserve(self, size: int) -> int:
+        """Make room for a packet of at most `size` bytes, return where it starts."""
+        needed = self._packet_bytes + size
+        if needed <= len(self._packet):
+            return self._packet_bytes
+        if needed > BATCH_BUFFER_MAX:
+            # Batched packets go out first, the buffer only grows further
+            # for a packet that doesn't fit on its own
+            self._send_packets()
+            needed = size
+        if needed > len(self._packet):
+            # Doubling keeps a batch of many packets from reallocating per packet
+            packet = bytearray(
+                max(needed, min(2 * len(self._packet), BATCH_BUFFER_MAX))
+            )
+            packet[: self._packet_bytes] = self._packet_view[: self._packet_bytes]
+            self._packet = packet
+            self._packet_view = memoryview(packet)
+        return self._packet_bytes
+
+    def _put_remaining_length(self, i: int, remaining: int) -> int:
+        packet = self._packet
+        while remaining > 0x7F:
+            packet[i] = (remaining & 0x7F) | 0x80
+            remaining >>= 7
+            i += 1
+        packet[i] = remaining
+        return i + 1
+
+    def _put_bytes(self, i: int, data, size: int) -> int:
+        """Write a length prefixed string, as MQTT encodes topics."""
+        self._packet[i] = size >> 8
+        self._packet[i + 1] = size & 0xFF
+        i += 2
+        self._packet_view[i : i + size] = data
+        return i + size
+
+    def _send_packets(self) -> None:
+        if self._packet_bytes:
+            size = self._packet_bytes
+            # Nothing is resent after an error, the broker may have seen a part
+            self._packet_bytes = 0
+            self.sock.write(self._packet, size)
+
+    def _next_pid(self) -> int:
+        self.pid = self.pid % 0xFFFF + 1
+        return self.pid
+
+    async def _wait_ack(self, ack_op: int, pid: int) -> int:
+        """Wait for the PUBACK or SUBACK of `pid`, return 0x80 if a subscription was refused.
+
+        Raises OSError(ETIMEDOUT) when it doesn't arrive within
+        ACK_TIMEOUT_MS, which the callers handle as a lost connection.
+        """
+        self._ack_op = ack_op
+        self._ack_pid = pid
+        self._ack_event.clear()
+        try:
+            await asyncio.wait_for_ms(self._ack_event.wait(), ACK_TIMEOUT_MS)
+        except asyncio.TimeoutError:
+            raise OSError(ETIMEDOUT)
+        finally:
+            self._ack_op = 0
+        if self._state != STATE_CONNECTED:
+            # The connection was lost while waiting
+            raise OSError(ECONNRESET)
+        return self._ack_result
+
+    def _read_ack(self, op: int) -> None:
+        """Read the rest of a PUBACK or SUBACK and complete the awaited one."""
+        size = self.sock.read(1)[0]
+        ack = self.sock.read(size)
+        if op == self._ack_op and ack[0] << 8 | ack[1] == self._ack_pid:
+            # A SUBACK has a return code per filter after the packet id
+            self._ack_result = 0
+            for i in range(2, size):
+                if ack[i] == 0x80:
+                    self._ack_result = 0x80
+            self._ack_event.set()
+
+    def _track_backlog(self) -> None:
+        if self._backlog > self._max_backlog:
+            self._max_backlog = self._backlog
+
+    def _ping(self) -> None:
+        try:
+            self.ping()
+        except OSError as e:
+            self.log(False, e)
+            self._set_disconnected()
+
+    def _set_connected(self) -> None:
+        self._state = STATE_CONNECTED
+        self._has_connected = True
+        self._packet_bytes = 0
+        self._failures = 0
+        self._disconnected_event.clear()
+        self._connected_event.set()
+
+    def _set_disconnected(self) -> None:
+        if self._state != STATE_CONNECTED:
+            return
+        self._close_socket()
+        self._state = STATE_BACKOFF
+        self._connected_event.clear()
+        self._disconnected_event.set()
+        # An acknowledgement can't arrive any more, stop waiting for it
+        self._ack_event.set()
+
+    def _close_socket(self) -> None:
+        sock = getattr(self, "sock", None)
+        if sock is None:
+            return
+        try:
+            sock.close()
+        except OSError:
+            pass
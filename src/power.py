@@ -0,0 +1,101 @@
+from machine import lightsleep
+from time import ticks_ms, ticks_us, ticks_add, ticks_diff
+from logger import Logger
+from sensor_worker import COMMAND_POLL_MS
+from wifi_manager import WiFiManager
+import asyncio
+import profiler
+
+# Shorter idle stretches are spent in the event loop's own WFE wait, the clock
+# switch in and out of lightsleep costs more than it saves
+LIGHTSLEEP_MIN_MS = 10
+# Longest lightsleep, in case the CYW43 interrupt doesn't wake the CPU early
+LIGHTSLEEP_MAX_MS = 1000
+# After a publish or a command the radio stays in performance mode this long,
+# so acknowledgements and follow-up commands aren't held back by power save
+AWAKE_WINDOW_MS = 2000
+# In power save the access point buffers frames for the station until the
+# next DTIM beacon it listens to, typically 1 to 3 beacons of 102.4 ms
+DTIM_LISTEN_MAX_MS = 307
+
+# Worst case extra delay for a valve command in power save: the access point
+# holds it until the next DTIM, a missed wake-up interrupt leaves the CPU in
+# lightsleep for a full window, and core 1 only polls for pin changes
+COMMAND_WAKE_BUDGET_MS = DTIM_LISTEN_MAX_MS + LIGHTSLEEP_MAX_MS + COMMAND_POLL_MS
+
+# Subsystems keep the station awake while they talk to the broker
+_awake_until = ticks_ms()
+_manager = None
+
+
+def keep_awake(duration_ms: int = AWAKE_WINDOW_MS) -> None:
+    """Keep the radio in performance mode and the CPU out of lightsleep for a while."""
+    global _awake_until
+    until = ticks_add(ticks_ms(), duration_ms)
+    if ticks_diff(until, _awake_until) > 0:
+        _awake_until = until
+    if _manager is not None:
+        _manager.wake()
+
+
+def _next_deadline_ms(now: int) -> int:
+    """Time until the event loop has a task to run, capped at LIGHTSLEEP_MAX_MS."""
+    # Tasks sleeping on a deadline wait in the task queue, keyed by their
+    # ticks_ms() wake-up time. Tasks waiting for a socket or ThreadSafeFlag
+    # aren't in it, the interrupt that makes them ready ends the lightsleep
+    task = asyncio.core._task_queue.peek()
+    if task is None:
+        return LIGHTSLEEP_MAX_MS
+    idle_ms = ticks_diff(task.ph_key, now)
+    if idle_ms < 0:
+        return 0
+    return idle_ms if idle_ms < LIGHTSLEEP_MAX_MS else LIGHTSLEEP_MAX_MS
+
+
+class PowerManager:
+    """Duty-cycles the CPU and the radio between the station's bursts of work.
+
+    While nothing keeps the station awake the CYW43 runs in power save and
+    the CPU lightsleeps until the next task deadline. Incoming WiFi frames
+    end a lightsleep through the CYW43 host wake interrupt, so commands
+    only wait for the next DTIM beacon.
+    """
+
+    def __init__(self, logger: Logger, wifi_manager: WiFiManager) -> None:
+        global _manager
+        self._logger = logger
+        self._wifi_manager = wifi_manager
+        self._radio_power_save = False
+        self._sleep_phase = profiler.phase("lightsleep")
+        _manager = self
+
+    async def run(self) -> None:
+        """Lightsleep through the idle stretches of the event loop."""
+        self._logger.info(
+            "Power save enabled, valve commands may take up to %d ms longer",
+            COMMAND_WAKE_BUDGET_MS,
+        )
+        while True:
+            # Let every task that is due run first
+            await asyncio.sleep_ms(0)
+            now = ticks_ms()
+            awake_ms = ticks_diff(_awake_until, now)
+            if awake_ms > 0:
+                await asyncio.sleep_ms(awake_ms)
+                continue
+            self._set_radio_power_save(True)
+            idle_ms = _next_deadline_ms(now)
+            if idle_ms < LIGHTSLEEP_MIN_MS:
+                await asyncio.sleep_ms(idle_ms)
+                continue
+            start = ticks_us()
+            lightsleep(idle_ms)
+            self._sleep_phase.record(ticks_diff(ticks_us(), start))
+
+    def wake(self) -> None:
+        self._set_radio_power_save(False)
+
+    def _set_radio_power_save(self, enabled: bool) -> None:
+        if enabled != self._radio_power_save:
+            self._radio_power_save = enabled
+            self._wifi_manager.set_power_save(enabled)
@@ -0,0 +1,144 @@
+from array import array
+from time import ticks_ms, ticks_us, ticks_diff, ticks_add
+from micropython import const
+import asyncio
+
+# Durations are counted in fixed log-linear buckets: 4 buckets per power of two
+# (25% resolution), from 0 us up to about 33 s. Recording only touches small
+# ints and a preallocated array, so it never allocates
+_SUB_BUCKET_BITS = const(2)
+_SUB_BUCKETS = const(1 << _SUB_BUCKET_BITS)
+_SUB_BUCKET_LIMIT = const(_SUB_BUCKETS << 1)
+BUCKETS = const(96)
+# The loop lag probe wakes up this often and records how late it ran
+LAG_PROBE_INTERVAL_MS = const(100)
+# Histograms are logged and cleared at this interval, so they describe recent behavior
+REPORT_INTERVAL_MS = 900_000
+
+
+def _bucket_index(duration_us: int) -> int:
+    if duration_us < _SUB_BUCKETS:
+        return duration_us if duration_us > 0 else 0
+    octave = 0
+    while duration_us >= _SUB_BUCKET_LIMIT:
+        duration_us >>= 1
+        octave += 1
+    index = _SUB_BUCKETS + (octave << _SUB_BUCKET_BITS) + duration_us - _SUB_BUCKETS
+    return index if index < BUCKETS else BUCKETS - 1
+
+
+def _bucket_upper_bound_us(index: int) -> int:
+    """Smallest duration that no longer falls in bucket `index`."""
+    if index < _SUB_BUCKETS:
+        return index + 1
+    octave = (index - _SUB_BUCKETS) >> _SUB_BUCKET_BITS
+    sub_bucket = (index - _SUB_BUCKETS) & (_SUB_BUCKETS - 1)
+    return (_SUB_BUCKETS + sub_bucket + 1) << octave
+
+
+class Histogram:
+    """Fixed-bucket latency histogram of one phase, in microseconds."""
+
+    __slots__ = ("name", "_counts", "_count", "_max_us")
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self._counts = array("I", [0] * BUCKETS)
+        self._count = 0
+        self._max_us = 0
+
+    def record(self, duration_us: int) -> None:
+        self._counts[_bucket_index(duration_us)] += 1
+        self._count += 1
+        if duration_us > self._max_us:
+            self._max_us = duration_us
+
+    def count(self) -> int:
+        return self._count
+
+    def max_us(self) -> int:
+        return self._max_us
+
+    def percentile_us(self, percent: int) -> int:
+        """Upper bound of the bucket holding the given percentile, 0 without samples."""
+        if self._count == 0:
+            return 0
+        target = (self._count * percent + 99) // 100
+        seen = 0
+        for index in range(BUCKETS):
+            seen += self._counts[index]
+            if seen >= target:
+                bound = _bucket_upper_bound_us(index)
+                return bound if bound < self._max_us else self._max_us
+        return self._max_us
+
+    def reset(self) -> None:
+        for index in range(BUCKETS):
+            self._counts[index] = 0
+        self._count = 0
+        self._max_us = 0
+
+
+# Every subsystem registers its phases here at construction time
+_phases: list[Histogram] = []
+
+
+def phase(name: str) -> Histogram:
+    """Register a phase and return its histogram. Time it with:
+
+    start = ticks_us()
+    ...
+    histogram.record(ticks_diff(ticks_us(), start))
+
+    Handlers that await are timed including the time they were suspended.
+    """
+    histogram = Histogram(name)
+    _phases.append(histogram)
+    return histogram
+
+
+def phases() -> list:
+    return _phases
+
+
+def reset() -> None:
+    for histogram in _phases:
+        histogram.reset()
+
+
+# How late the event loop runs a task that asked to wake up, i.e. how long
+# some handler kept the loop blocked
+loop_lag = phase("loop_lag")
+
+
+def log_summary(logger) -> None:
+    # The logger is untyped: logger.py imports this module to register its own phase
+    lines = []
+    for histogram in _phases:
+        if histogram.count():
+            lines.append(
+                "%-22s n=%-6d p50=%-8d p99=%-8d max=%d"
+                % (
+                    histogram.name,
+                    histogram.count(),
+                    histogram.percentile_us(50),
+                    histogram.percentile_us(99),
+                    histogram.max_us(),
+                )
+            )
+    if lines:
+        logger.info("Phase latencies (us):\n%s", "\n".join(lines))
+
+
+async def run(logger) -> None:
+    """Probe the event loop lag and log all phase histograms every REPORT_INTERVAL_MS."""
+    window_start = ticks_ms()
+    while True:
+        expected = ticks_add(ticks_us(), LAG_PROBE_INTERVAL_MS * 1000)
+        await asyncio.sleep_ms(LAG_PROBE_INTERVAL_MS)
+        late = ticks_diff(ticks_us(), expected)
+        loop_lag.record(late if late > 0 else 0)
+        if ticks_diff(ticks_ms(), window_start) >= REPORT_INTERVAL_MS:
+            log_summary(logger)
+            reset()
+            window_start = ticks_ms()
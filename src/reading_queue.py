@@ -0,0 +1,170 @@
+from struct import calcsize, pack_into, unpack_from
+from os import remove, sync
+from logger import Logger
+import watchdog
+
+QUEUE_FILE_PATH = "./reading-queue.bin"
+# One record per publish interval, one week of readings at the default 5 minutes
+MAX_RECORDS = 2016
+# Records are collected in RAM and written to flash together
+BATCH_RECORDS = 6
+
+_MAGIC = b"RQ01"
+# magic, record size, capacity, head slot, record count
+_HEADER_FORMAT = "<4sHHHH"
+_HEADER_SIZE = calcsize(_HEADER_FORMAT)
+# A record holds the measurement time (epoch seconds) followed by the
+# moisture of every irrigation point in hundredths of a percent
+_TIMESTAMP_FORMAT = "<I"
+_TIMESTAMP_SIZE = calcsize(_TIMESTAMP_FORMAT)
+_VALUE_FORMAT = "<H"
+_VALUE_SIZE = calcsize(_VALUE_FORMAT)
+
+
+class ReadingQueue:
+    """Bounded, flash-backed FIFO of station readings taken while the broker is unreachable.
+
+    The queue file is a fixed-size ring of fixed-size binary records, so
+    records can be replayed one at a time without loading the queue into
+    RAM. When the ring is full the oldest record is overwritten.
+    """
+
+    def __init__(
+        self, point_count: int, logger: Logger, file_path: str = QUEUE_FILE_PATH
+    ) -> None:
+        self._point_count = point_count
+        self._logger = logger
+        self._file_path = file_path
+        self._record_size = _TIMESTAMP_SIZE + point_count * _VALUE_SIZE
+        self._head = 0
+        self._count = 0
+        self._header = bytearray(_HEADER_SIZE)
+        self._record = bytearray(self._record_size)
+        self._batch = bytearray(BATCH_RECORDS * self._record_size)
+        self._batch_count = 0
+        self._open()
+        # Batched records would otherwise be lost when the station resets
+        watchdog.flush_before_reset(self.flush)
+
+    def __len__(self) -> int:
+        return self._count + self._batch_count
+
+    def append(self, timestamp: int, values: list) -> None:
+        """Queue a reading of all points, writing to flash once a batch is full."""
+        offset = self._batch_count * self._record_size
+        pack_into(_TIMESTAMP_FORMAT, self._batch, offset, timestamp)
+        offset += _TIMESTAMP_SIZE
+        for value in values:
+            pack_into(_VALUE_FORMAT, self._batch, offset, value)
+            offset += _VALUE_SIZE
+        self._batch_count += 1
+        if self._batch_count == BATCH_RECORDS:
+            self.flush()
+
+    def flush(self) -> None:
+        """Write the batched records and the updated header with a single open/close."""
+        if self._batch_count == 0:
+            return
+        batch = memoryview(self._batch)
+        try:
+            with open(self._file_path, "r+b") as queue_file:
+                for i in range(self._batch_count):
+                    if self._count == MAX_RECORDS:
+                        # Full: overwrite the oldest record
+                        self._head = (self._head + 1) % MAX_RECORDS
+                        self._count -= 1
+                    slot = (self._head + self._count) % MAX_RECORDS
+                    queue_file.seek(_HEADER_SIZE + slot * self._record_size)
+                    start = i * self._record_size
+                    queue_file.write(batch[start : start + self._record_size])
+                    self._count += 1
+                self._write_header(queue_file)
+            sync()
+        except OSError as e:
+            self._logger.error("Writing reading queue failed: %s", e)
+        self._batch_count = 0
+
+    def peek(self):
+        """Return (timestamp, values) of the oldest flushed record, or None when empty.
+
+        The values are unpacked from a reused buffer, call flush() first to
+        include records that are still batched in RAM.
+        """
+        if self._count == 0:
+            return None
+        try:
+            with open(self._file_path, "rb") as queue_file:
+                queue_file.seek(_HEADER_SIZE + self._head * self._record_size)
+                queue_file.readinto(self._record)
+        except OSError as e:
+            self._logger.error("Reading reading queue failed: %s", e)
+            return None
+        timestamp = unpack_from(_TIMESTAMP_FORMAT, self._record, 0)[0]
+        values = [
+            unpack_from(_VALUE_FORMAT, self._record, _TIMESTAMP_SIZE + i * _VALUE_SIZE)[
+                0
+            ]
+            for i in range(self._point_count)
+        ]
+        return timestamp, values
+
+    def pop(self) -> None:
+        """Drop the oldest record. Call commit() to persist the new head."""
+        if self._count == 0:
+            return
+        self._head = (self._head + 1) % MAX_RECORDS
+        self._count -= 1
+
+    def commit(self) -> None:
+        """Persist the head and count after popping records."""
+        try:
+            with open(self._file_path, "r+b") as queue_file:
+                self._write_header(queue_file)
+        except OSError as e:
+            self._logger.error("Writing reading queue failed: %s", e)
+
+    def _open(self) -> None:
+        """Load the header of an existing queue file, or create a fresh one."""
+        try:
+            with open(self._file_path, "rb") as queue_file:
+                queue_file.readinto(self._header)
+            magic, record_size, capacity, head, count = unpack_from(
+                _HEADER_FORMAT, self._header, 0
+            )
+            if (
+                magic == _MAGIC
+                and record_size == self._record_size
+                and capacity == MAX_RECORDS
+            ):
+                self._head = head
+                self._count = count
+                if count:
+                    self._logger.info("Loaded %d queued readings", count)
+                return
+            # Written for a different station layout, the records can't be replayed
+            self._logger.warning("Discarding incompatible reading queue")
+            remove(self._file_path)
+        except OSError:
+            pass
+        self._create()
+
+    def _create(self) -> None:
+        try:
+            with open(self._file_path, "wb") as queue_file:
+                self._write_header(queue_file)
+        except OSError as e:
+            self._logger.error("Creating reading queue failed: %s", e)
+
+    def _write_header(self, queue_file) -> None:
+        pack_into(
+            _HEADER_FORMAT,
+            self._header,
+            0,
+            _MAGIC,
+            self._record_size,
+            MAX_RECORDS,
+            self._head,
+            self._count,
+        )
+        queue_file.seek(0)
+        queue_file.write(self._header)
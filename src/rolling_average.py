@@ -1,41 +1,110 @@
-from typing import List
+from array import array
+from micropython import const
+
+# Smoothing modes, can be combined as a bit mask
+SMA = const(1)
+EMA = const(2)
+SMA_AND_EMA = const(3)
+MODES = {"sma": SMA, "ema": EMA, "both": SMA_AND_EMA}
+
+# Readings are fixed-point integers, kept to 0-16000 so all arithmetic stays
+# in small ints (no heap allocation). Alpha is scaled to ALPHA_SCALE, which
+# holds a configured alpha of up to 4 decimals exactly, and the EMA keeps
+# _EMA_FRACTION_BITS extra fraction bits. alpha * difference takes up to 42
+# bits, so it is split into the whole and fraction parts of the difference.
+# Rounding each update leaves the EMA within 0.5 / (alpha * 2**14) of the
+# float EMA with the same alpha, 0.003 units at alpha 0.01
+ALPHA_SCALE = const(10000)
+_ALPHA_ROUNDING = const(ALPHA_SCALE // 2)
+_EMA_FRACTION_BITS = const(14)
+_EMA_FRACTION_MASK = const((1 << _EMA_FRACTION_BITS) - 1)
+_EMA_ROUNDING = const(1 << (_EMA_FRACTION_BITS - 1))
 
 
 class RollingAverage:
-    """A class to compute rolling averages for smoothing sensor readings."""
+    """A class to compute rolling averages for smoothing fixed-point sensor readings."""
 
-    def __init__(self, window_size: int = 5, alpha: float = 0.2) -> None:
+    __slots__ = (
+        "_window_size",
+        "_alpha",
+        "_mode",
+        "_values",
+        "_index",
+        "_count",
+        "_sum",
+        "_ema_value",
+        "_has_ema",
+    )
+
+    def __init__(
+        self, window_size: int = 5, alpha: float = 0.2, mode: int = EMA
+    ) -> None:
         """
         Initialize the rolling average.
 
         Args:
             window_size: Number of readings to average for SMA. Ignored for EMA.
             alpha: Smoothing factor for EMA (0 < alpha <= 1). Higher values give more weight to recent readings.
+            mode: SMA, EMA or SMA_AND_EMA. The SMA ring buffer is only allocated when SMA is used.
         """
         self._window_size = window_size
-        self._alpha = alpha
-        self._values: List[float] = []
-        self._ema_value: float = None  # type: ignore
+        self._alpha = int(alpha * ALPHA_SCALE + 0.5)
+        self._mode = mode
+        # Fixed ring buffer with a running sum, so adding a reading doesn't allocate
+        self._values = array("i", [0] * window_size) if mode & SMA else None
+        self._index = 0
+        self._count = 0
+        self._sum = 0
+        self._ema_value = 0
+        self._has_ema = False
 
-    def add_reading(self, value: float) -> None:
+    def add_reading(self, value: int) -> None:
         """Add a new reading to the rolling average."""
-        if self._ema_value is None:
-            # Initialize EMA with the first value
-            self._ema_value = value
-        else:
-            # Update EMA
-            self._ema_value = self._alpha * value + (1 - self._alpha) * self._ema_value
-
-        # Maintain SMA buffer
-        self._values.append(value)
-        if len(self._values) > self._window_size:
-            self._values.pop(0)
-
-    def get_average(self) -> float:
-        """Get the current averaged value. Returns EMA if available, otherwise SMA."""
-        if self._ema_value is not None:
-            return self._ema_value
-        elif self._values:
-            return sum(self._values) / len(self._values)
-        else:
-            return 0.0  # Default if no readings
+        if self._mode & EMA:
+            scaled = value << _EMA_FRACTION_BITS
+            if self._has_ema:
+                # Update EMA by alpha * diff / ALPHA_SCALE, rounded. The whole
+                # units are divided first, their remainder is carried into
+                # the fraction part so the result is exact
+                alpha = self._alpha
+                diff = scaled - self._ema_value
+                whole = alpha * (diff >> _EMA_FRACTION_BITS)
+                quotient = whole // ALPHA_SCALE
+                self._ema_value += (quotient << _EMA_FRACTION_BITS) + (
+                    ((whole - quotient * ALPHA_SCALE) << _EMA_FRACTION_BITS)
+                    + alpha * (diff & _EMA_FRACTION_MASK)
+                    + _ALPHA_ROUNDING
+                ) // ALPHA_SCALE
+            else:
+                # Initialize EMA with the first value
+                self._ema_value = scaled
+                self._has_ema = True
+
+        values = self._values
+        if values is not None:
+            # Replace the oldest reading in the ring buffer
+            index = self._index
+            if self._count < self._window_size:
+                self._count += 1
+            else:
+                self._sum -= values[index]
+            values[index] = value
+            self._sum += value
+            index += 1
+            self._index = 0 if index == self._window_size else index
+
+    def get_sma(self) -> int:
+        """Get the rounded simple moving average over the window, 0 without readings."""
+        if self._count == 0:
+            return 0
+        return (self._sum + self._count // 2) // self._count
+
+    def get_ema(self) -> int:
+        """Get the rounded exponential moving average, 0 without readings."""
+        return (self._ema_value + _EMA_ROUNDING) >> _EMA_FRACTION_BITS
+
+    def get_average(self) -> int:
+        """Get the current averaged value. Returns EMA if enabled, otherwise SMA."""
+        if self._mode & EMA:
+            return self.get_ema()
+        return self.get_sma()
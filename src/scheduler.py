@@ -0,0 +1,86 @@
+from time import ticks_ms, ticks_add, ticks_diff
+import asyncio
+import profiler
+
+
+class Job:
+    """A one-shot or periodic callback on the shared deadline queue.
+
+    Callbacks run on the event loop, between tasks, so they should only
+    hand work over to a task, e.g. by setting a ThreadSafeFlag.
+    """
+
+    __slots__ = ("name", "deadline", "period_ms", "callback", "active", "late")
+
+    def __init__(self, name: str, callback) -> None:
+        self.name = name
+        self.deadline = 0
+        self.period_ms = 0
+        self.callback = callback
+        self.active = False
+        # How late the job fired, in microseconds like every other phase
+        self.late = profiler.phase("late_" + name)
+
+    def start(self, delay_ms: int, periodic: bool = False) -> None:
+        """(Re)start the job after `delay_ms`, repeating at that period if `periodic`."""
+        self.period_ms = delay_ms if periodic else 0
+        self.reschedule(delay_ms)
+
+    def reschedule(self, delay_ms: int) -> None:
+        """Move the next deadline to `delay_ms` from now, keeping the period."""
+        if self.active:
+            _queue.remove(self)
+        self.deadline = ticks_add(ticks_ms(), delay_ms)
+        _insert(self)
+
+    def cancel(self) -> None:
+        if self.active:
+            _queue.remove(self)
+            self.active = False
+
+
+# Active jobs, sorted by deadline
+_queue: list[Job] = []
+_wakeup = asyncio.ThreadSafeFlag()
+
+
+def job(name: str, callback) -> Job:
+    """Create a job, it doesn't run until it is started."""
+    return Job(name, callback)
+
+
+def _insert(job: Job) -> None:
+    index = len(_queue)
+    while index > 0 and ticks_diff(_queue[index - 1].deadline, job.deadline) > 0:
+        index -= 1
+    _queue.insert(index, job)
+    job.active = True
+    if index == 0:
+        # The runner may be sleeping towards a later deadline
+        _wakeup.set()
+
+
+async def run() -> None:
+    """Fire every job when its deadline passes, sleeping until the next deadline."""
+    while True:
+        if not _queue:
+            await _wakeup.wait()
+            continue
+        job = _queue[0]
+        wait_ms = ticks_diff(job.deadline, ticks_ms())
+        if wait_ms > 0:
+            try:
+                await asyncio.wait_for_ms(_wakeup.wait(), wait_ms)
+            except asyncio.TimeoutError:
+                pass
+            continue
+        _queue.pop(0)
+        job.active = False
+        job.late.record(-wait_ms * 1000)
+        if job.period_ms:
+            # Skip periods that were missed entirely instead of firing in a burst
+            job.deadline = ticks_add(job.deadline, job.period_ms)
+            while ticks_diff(job.deadline, ticks_ms()) <= 0:
+                job.deadline = ticks_add(job.deadline, job.period_ms)
+            _insert(job)
+        job.callback()
@@ -1,9 +1,33 @@
 from machine import Pin
 from ads1x15 import ADS1115
-from time import sleep_ms
+import asyncio
 from config import IrrigationPointConfig
 from logger import Logger
 from rolling_average import RollingAverage
+from micropython import const
+
+# Time the sensor needs after powering on before its output is stable
+STABILIZATION_MS = 300
+
+# Moisture is kept as an integer in hundredths of a percent (0-10000) so the
+# pipeline from the raw ADC reading up to MQTT serialization never allocates floats
+MOISTURE_SCALE = const(10000)
+# At gain 0 the ADS1115 spans +/-6.144 V over 32768 counts and the sensor outputs
+# 0-5 V, so moisture = raw * 6.144 / 32768 / 5 * 10000 = raw * 3 / 8
+_RAW_TO_MOISTURE_NUM = const(3)
+_RAW_TO_MOISTURE_DEN = const(8)
+# Readings are rounded to whole percents to handle minor variations between reads
+_READING_RESOLUTION = const(100)
+_READING_DEN = const(_RAW_TO_MOISTURE_DEN * _READING_RESOLUTION)
+# Marks a sample that core 1 could not read
+READ_ERROR = const(-1)
+
+
+def raw_to_moisture(raw: int) -> int:
+    """Convert a raw ADS1115 reading to moisture in hundredths of a percent."""
+    return (
+        (raw * _RAW_TO_MOISTURE_NUM + _READING_DEN // 2) // _READING_DEN
+    ) * _READING_RESOLUTION
 
 
 class Sensor:
@@ -17,52 +41,75 @@ class Sensor:
         self._mosfet = Pin(config.mosfet_pin, Pin.OUT)
         self._ads_channel = config.ads_channel
         self._logger = logger
-        self._value = 0.5  # Initial averaged value
+        self._value = MOISTURE_SCALE // 2  # Initial averaged value
         self._ads = ads
         self._rolling_avg = RollingAverage(
-            window_size=config.rolling_window, alpha=config.ema_alpha
+            window_size=config.rolling_window,
+            alpha=config.ema_alpha,
+            mode=config.smoothing,
         )
 
         # Ensure sensor is powered off initially
         self._mosfet.off()
 
-    def measure(self) -> None:
+    async def measure(self) -> None:
         """Measure the sensor and update the rolling average without returning the value."""
         # Power on the sensor
-        self._mosfet.on()
-
-        # Wait for sensor to stabilize
-        sleep_ms(300)
+        self.power_on()
 
         try:
-            # Read from ADS1115
-            raw = self._ads.read(0, self._ads_channel)
-            voltage = self._ads.raw_to_v(raw)
-
-            # Normalize to 0.0-1.0 range (assuming 0-5V sensor range)
-            # Round to 2 decimal places to handle minor floating-point variations
-            normalized_value = round(voltage / 5.0, 2)
+            # Wait for sensor to stabilize, other tasks keep running meanwhile
+            await asyncio.sleep_ms(STABILIZATION_MS)
+            self.read()
+        finally:
+            # Always power off the sensor
+            self.power_off()
 
-            # Validate the computed value is in expected range
-            if not (0.0 <= normalized_value <= 1.0):
-                raise ValueError(
-                    f"Computed sensor value {normalized_value} is outside valid range [0.0, 1.0]"
-                )
+    def power_on(self) -> None:
+        """Power on the sensor. Callers must wait STABILIZATION_MS before reading."""
+        self._mosfet.on()
 
-            self._rolling_avg.add_reading(normalized_value)
-            self._value = self._rolling_avg.get_average()
+    def power_off(self) -> None:
+        """Power off the sensor."""
+        self._mosfet.off()
 
+    def read(self) -> None:
+        """Read a powered and stabilized sensor and update the rolling average."""
+        try:
+            moisture = self.sample()
         except Exception as e:
-            self._logger.log(f"[Sensor] {self._name}: Error reading sensor - {e}")
-            self._logger.log(
-                f"[Sensor] {self._name}: Using last known averaged value {self._value}"
+            self._log_read_error(e)
+            return
+        self.add_reading(moisture)
+
+    def sample(self) -> int:
+        """Read a powered and stabilized sensor and return its moisture, without averaging."""
+        # Read from ADS1115
+        return raw_to_moisture(self._ads.read(0, self._ads_channel))
+
+    def add_reading(self, moisture: int) -> None:
+        """Validate a sampled moisture and update the rolling average."""
+        if moisture == READ_ERROR:
+            self._log_read_error("ADS1115 read failed on core 1")
+            return
+        # Validate the computed value is in expected range
+        if not (0 <= moisture <= MOISTURE_SCALE):
+            self._log_read_error(
+                f"Computed sensor value {moisture} is outside valid range [0, {MOISTURE_SCALE}]"
             )
-            # Keep the last averaged value on error
+            return
+        self._rolling_avg.add_reading(moisture)
+        self._value = self._rolling_avg.get_average()
 
-        finally:
-            # Always power off the sensor
-            self._mosfet.off()
+    def _log_read_error(self, error) -> None:
+        self._logger.error("[Sensor] %s: Error reading sensor - %s", self._name, error)
+        self._logger.warning(
+            "[Sensor] %s: Using last known averaged value %s",
+            self._name,
+            self._value,
+        )
+        # Keep the last averaged value on error
 
-    def get_value(self) -> float:
-        """Get the current averaged sensor value without measuring."""
+    def get_value(self) -> int:
+        """Get the current averaged moisture in hundredths of a percent without measuring."""
         return self._value
@@ -0,0 +1,213 @@
+from array import array
+from time import sleep_ms, ticks_ms, ticks_us, ticks_add, ticks_diff
+from micropython import const
+from sensor import STABILIZATION_MS, READ_ERROR
+import _thread
+
+# Sweeps that core 0 hasn't collected yet, older ones are overwritten
+RING_CAPACITY = const(8)
+# Valve commands waiting for core 1
+COMMAND_CAPACITY = const(16)
+# Core 1 checks for valve commands this often, also while sensors stabilize.
+# An ADS1115 conversion blocks for about 125 ms, so that is the worst case
+COMMAND_POLL_MS = const(10)
+
+
+class ReadingRing:
+    """Preallocated ring of sweeps, one moisture value per point, shared between the cores.
+
+    Core 1 pushes, core 0 pops. Both only hold the lock while copying a row.
+    """
+
+    __slots__ = (
+        "_lock",
+        "_values",
+        "_durations",
+        "_width",
+        "_head",
+        "_count",
+        "dropped",
+    )
+
+    def __init__(self, width: int, capacity: int = RING_CAPACITY) -> None:
+        self._lock = _thread.allocate_lock()
+        self._values = array("h", [0] * (width * capacity))
+        self._durations = array("I", [0] * capacity)
+        self._width = width
+        self._head = 0
+        self._count = 0
+        self.dropped = 0
+
+    def push(self, row: array, duration_us: int) -> None:
+        """Store a sweep, overwriting the oldest one when core 0 falls behind."""
+        capacity = len(self._durations)
+        width = self._width
+        with self._lock:
+            slot = self._head + self._count
+            if slot >= capacity:
+                slot -= capacity
+            if self._count == capacity:
+                self._head = self._head + 1 if self._head + 1 < capacity else 0
+                self.dropped += 1
+            else:
+                self._count += 1
+            offset = slot * width
+            for index in range(width):
+                self._values[offset + index] = row[index]
+            self._durations[slot] = duration_us
+
+    def pop_into(self, row: array) -> int:
+        """Copy the oldest sweep into `row` and return its duration, -1 when empty."""
+        width = self._width
+        with self._lock:
+            if self._count == 0:
+                return -1
+            slot = self._head
+            offset = slot * width
+            for index in range(width):
+                row[index] = self._values[offset + index]
+            self._head = slot + 1 if slot + 1 < len(self._durations) else 0
+            self._count -= 1
+            return self._durations[slot]
+
+
+class CommandQueue:
+    """Preallocated FIFO of valve commands from core 0 to core 1."""
+
+    __slots__ = ("_lock", "_commands", "_head", "_count")
+
+    def __init__(self, capacity: int = COMMAND_CAPACITY) -> None:
+        self._lock = _thread.allocate_lock()
+        # Per command: the point index and the pin value
+        self._commands = array("B", [0] * (2 * capacity))
+        self._head = 0
+        self._count = 0
+
+    def put(self, index: int, value: int) -> bool:
+        """Queue a pin change, False when the queue is full."""
+        capacity = len(self._commands) // 2
+        with self._lock:
+            if self._count == capacity:
+                return False
+            slot = self._head + self._count
+            if slot >= capacity:
+                slot -= capacity
+            self._commands[2 * slot] = index
+            self._commands[2 * slot + 1] = value
+            self._count += 1
+            return True
+
+    def pending(self) -> bool:
+        # Reading a small int is atomic, so core 1 can poll without the lock
+        return self._count > 0
+
+    def get(self) -> int:
+        """Return the oldest command as index << 1 | value, -1 when empty."""
+        with self._lock:
+            if self._count == 0:
+                return -1
+            slot = self._head
+            command = self._commands[2 * slot] << 1 | self._commands[2 * slot + 1]
+            self._head = slot + 1 if 2 * (slot + 1) < len(self._commands) else 0
+            self._count -= 1
+            return command
+
+
+class SensorWorker:
+    """Runs the sensor sweeps and valve pin changes on core 1 of the RP2350.
+
+    Once started, core 1 owns the I2C bus, the sensor MOSFET pins and the
+    valve pins. It never logs or touches the network: sweeps are handed to
+    core 0 through `ring` and `sweep_done`, valve commands arrive through
+    `commands`.
+    """
+
+    def __init__(
+        self,
+        points: list,
+        read_order: list,
+        interval_ms: int,
+        parallel: bool,
+        commands: CommandQueue,
+        sweep_done,
+    ) -> None:
+        self._points = points
+        self._read_order = read_order
+        self._interval_ms = interval_ms
+        self._parallel = parallel
+        self._sweep_done = sweep_done
+        self._row = array("h", [0] * len(read_order))
+        self.ring = ReadingRing(len(read_order))
+        self.commands = commands
+        self._stop_requested = False
+        self._running = False
+
+    def start(self) -> None:
+        self._running = True
+        _thread.start_new_thread(self._run, ())
+
+    def stop(self) -> None:
+        """Ask core 1 to finish its sweep and return, and wait until it has."""
+        self._stop_requested = True
+        while self._running:
+            sleep_ms(COMMAND_POLL_MS)
+
+    def _run(self) -> None:
+        try:
+            next_sweep = ticks_add(ticks_ms(), self._interval_ms)
+            while not self._stop_requested:
+                self._execute_commands()
+                if ticks_diff(ticks_ms(), next_sweep) >= 0:
+                    start = ticks_us()
+                    self._sweep()
+                    self.ring.push(self._row, ticks_diff(ticks_us(), start))
+                    self._sweep_done.set()
+                    next_sweep = ticks_add(next_sweep, self._interval_ms)
+                sleep_ms(COMMAND_POLL_MS)
+        finally:
+            self._running = False
+
+    def _execute_commands(self) -> None:
+        commands = self.commands
+        while commands.pending():
+            command = commands.get()
+            if command < 0:
+                return
+            self._points[command >> 1].drive_valve(command & 1)
+
+    def _wait_for_stabilization(self) -> None:
+        # Valve commands keep flowing while the sensors settle
+        deadline = ticks_add(ticks_ms(), STABILIZATION_MS)
+        while ticks_diff(deadline, ticks_ms()) > 0:
+            self._execute_commands()
+            sleep_ms(COMMAND_POLL_MS)
+
+    def _sweep(self) -> None:
+        points = self._read_order
+        row = self._row
+        if not self._parallel:
+            for index in range(len(points)):
+                points[index].power_on_sensor()
+                try:
+                    self._wait_for_stabilization()
+                    row[index] = self._sample(points[index])
+                finally:
+                    points[index].power_off_sensor()
+            return
+        try:
+            for point in points:
+                point.power_on_sensor()
+            self._wait_for_stabilization()
+            for index in range(len(points)):
+                row[index] = self._sample(points[index])
+        finally:
+            # Always power off all sensors
+            for point in points:
+                point.power_off_sensor()
+
+    def _sample(self, point) -> int:
+        try:
+            return point.sample_sensor()
+        except Exception:
+            # Reported by core 0 when it applies the reading
+            return READ_ERROR
@@ -0,0 +1,77 @@
+from time import ticks_ms, ticks_diff
+from network import WLAN, STA_IF
+from logger import Logger
+from irrigation_station import IrrigationStation
+from mqtt_robust_client import MqttRobustClient
+import gc
+import profiler
+
+# Largest free block search stops once the bounds are this close, in bytes
+_BLOCK_SEARCH_GRANULARITY = 256
+
+# Diagnostic sensors: key, name, unit, device class, state class
+METRICS = (
+    ("heap_free", "Heap free", "B", "data_size", "measurement"),
+    ("heap_allocated", "Heap allocated", "B", "data_size", "measurement"),
+    ("largest_free_block", "Largest free block", "B", "data_size", "measurement"),
+    ("loop_lag_p99", "Loop latency p99", "ms", "duration", "measurement"),
+    ("uptime", "Uptime", "s", "duration", "total_increasing"),
+    ("wifi_rssi", "WiFi signal", "dBm", "signal_strength", "measurement"),
+    ("mqtt_reconnects", "MQTT reconnects", None, None, "total_increasing"),
+    ("mqtt_backlog", "MQTT message backlog", None, None, "measurement"),
+    ("log_bytes_written", "Log bytes written", "B", "data_size", "total_increasing"),
+    ("last_sweep_duration", "Last sweep duration", "ms", "duration", "measurement"),
+)
+
+
+def largest_free_block() -> int:
+    """Find the largest bytearray the heap can still hold, by binary search.
+
+    MicroPython has no API for this. Each probe allocates and frees one
+    buffer, and a failed probe makes the allocator run a collection, so this
+    costs a few milliseconds and should only run at telemetry intervals.
+    """
+    gc.collect()
+    low = 0
+    high = gc.mem_free()
+    while high - low > _BLOCK_SEARCH_GRANULARITY:
+        size = (low + high) // 2
+        try:
+            block = bytearray(size)
+            del block
+            low = size
+        except MemoryError:
+            high = size
+    return low
+
+
+class Telemetry:
+    """Collects the station's own health metrics for the diagnostic sensors."""
+
+    def __init__(
+        self, logger: Logger, station: IrrigationStation, client: MqttRobustClient
+    ) -> None:
+        self._logger = logger
+        self._station = station
+        self._client = client
+        self._wlan = WLAN(STA_IF)
+        # Uptime is accumulated from tick differences, ticks_ms wraps after 12 days
+        self._uptime_ms = 0
+        self._last_ticks_ms = ticks_ms()
+
+    def collect(self) -> dict:
+        now = ticks_ms()
+        self._uptime_ms += ticks_diff(now, self._last_ticks_ms)
+        self._last_ticks_ms = now
+        return {
+            "heap_free": gc.mem_free(),
+            "heap_allocated": gc.mem_alloc(),
+            "largest_free_block": largest_free_block(),
+            "loop_lag_p99": profiler.loop_lag.percentile_us(99) / 1000,
+            "uptime": self._uptime_ms // 1000,
+            "wifi_rssi": self._wlan.status("rssi"),
+            "mqtt_reconnects": self._client.reconnect_count,
+            "mqtt_backlog": self._client.take_max_backlog(),
+            "log_bytes_written": self._logger.bytes_written,
+            "last_sweep_duration": self._station.last_sweep_ms,
+        }
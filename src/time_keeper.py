@@ -1,11 +1,42 @@
-import ntptime
-from machine import RTC, Timer, reset
-import datetime
-from time import sleep
+from machine import RTC
+import socket
+from json import dump, load
+from struct import unpack_from
 from logger import Logger
+from time import gmtime, mktime, time, ticks_ms, ticks_us, ticks_diff
+import asyncio
+import profiler
+import scheduler
+import watchdog
 
-INITIAL_RETRY_DELAY = 2
-MAX_INITIAL_RETRY_TIME = 30
+# Pool servers are tried in order until one answers
+NTP_HOSTS = ("0.nl.pool.ntp.org", "1.nl.pool.ntp.org", "2.nl.pool.ntp.org")
+NTP_PORT = 123
+NTP_PACKET_SIZE = 48
+# A server that hasn't answered in time is skipped for the next one
+NTP_TIMEOUT_MS = 1000
+NTP_POLL_MS = 20
+# Seconds from 1900-01-01, where NTP time starts, to the epoch of time.time()
+NTP_DELTA = 2208988800 if gmtime(0)[0] == 1970 else 3155673600
+INITIAL_RETRY_DELAY_MS = 2000
+MAX_INITIAL_RETRY_TIME_MS = 30_000
+# The sync interval is stretched until the RTC is expected to drift this far
+MAX_CLOCK_ERROR_MS = 1000
+SYNC_INTERVAL_MAX_MS = 86_400_000
+# Drift is measured against ticks_ms(), which comes from the same crystal as
+# the RTC. Shorter baselines are too noisy, ticks_diff() is only valid for
+# half of the 2**30 ms ticks period
+DRIFT_MIN_BASELINE_MS = 600_000
+DRIFT_MAX_BASELINE_MS = 432_000_000
+# Weight of a new drift measurement in the running estimate
+DRIFT_ALPHA = 0.5
+# The RTC time and drift survive a reboot in this file, the RTC is reset
+STATE_FILE_PATH = "./time-keeper.json"
+STATE_STORE_INTERVAL_MS = 900_000
+# Central European Time and its summer time, as offsets from UTC
+CET_OFFSET_S = 3600
+CEST_OFFSET_S = 7200
+DAY_S = 86400
 
 
 class TimeKeeper:
@@ -13,95 +44,250 @@ class TimeKeeper:
         self, logger: Logger, sync_interval: int = 7200, retry_interval: int = 60
     ) -> None:
         self._rtc: RTC = RTC()
-        self._sync_timer: Timer = Timer(-1)
-        self._sync_interval_ms: int = sync_interval * 1000  # Already in milliseconds
+        self._sync_job = scheduler.job("ntp_sync", self._set_pending_ntp_sync)
+        self._store_job = scheduler.job("time_store", self._set_pending_store)
+        # Shortest sync interval, used until the drift is known
+        self._sync_interval_ms: int = sync_interval * 1000
         self._retry_interval_ms: int = retry_interval * 1000
         self._logger: Logger = logger
-        self._pending_ntp_sync = False
-        ntptime.host = "nl.pool.ntp.org"
-
-    def initialize_ntp_synchronization(self) -> None:
-        """Start NTP sync with 2-hour default interval and 1-minute retries"""
-        # Initial sync should be a blocking operation. Time must be accurate
-        synced = False
-        retry_time = 0
-        while not synced and retry_time <= MAX_INITIAL_RETRY_TIME:
-            try:
-                ntptime.settime()
-                self._logger.log("Initial NTP sync successful")
-                synced = True
-            except Exception:
-                sleep(INITIAL_RETRY_DELAY)
-                retry_time += INITIAL_RETRY_DELAY
-                self._logger.log(f"Trying to sync NTP ({retry_time}s)")
-
-        if not synced:
-            self._logger.log("Failed to sync NTP, resetting")
-            reset()
-
-        self._schedule_normal_sync()
+        self._pending_ntp_sync = asyncio.ThreadSafeFlag()
+        self._pending_store = asyncio.ThreadSafeFlag()
+        self._round_trip_phase = profiler.phase("ntp_round_trip")
+        self._request = bytearray(NTP_PACKET_SIZE)
+        # LI 0, version 3, mode 3: client
+        self._request[0] = 0x1B
+        self._addresses: dict = {}
+        # NTP time in epoch ms and ticks_ms() at the last sync
+        self._anchor_ms: int | None = None
+        self._anchor_ticks = 0
+        # How much faster than NTP the crystal runs, None until measured
+        self._drift_ppm: float | None = None
+        self._stored_time = 0
+        # Log timestamps: the UTC year and its DST transitions in epoch
+        # seconds, the start of the local day and the last formatted stamp
+        self._year_start = 0
+        self._year_end = 0
+        self._dst_start = 0
+        self._dst_end = 0
+        self._day_start = 0
+        self._stamped_at = -1
+        self._stamp = ""
+        self._stamp_buffer = bytearray(b"0000/00/00-00:00:00")
+
+    async def initialize_ntp_synchronization(self) -> None:
+        """Sync with NTP, or continue on the stored time when no server answers."""
+        self._load_state()
+        start = ticks_ms()
+        while True:
+            if await self._sync_ntp():
+                self._schedule_normal_sync()
+                break
+            if self._stored_time:
+                self._restore_stored_time()
+                self._schedule_retry()
+                break
+            waited_ms = ticks_diff(ticks_ms(), start)
+            if waited_ms > MAX_INITIAL_RETRY_TIME_MS:
+                self._logger.error("Failed to sync NTP, resetting")
+                watchdog.restart()
+            await asyncio.sleep_ms(INITIAL_RETRY_DELAY_MS)
+            self._logger.info("Trying to sync NTP (%ds)", waited_ms // 1000)
+        self._store_job.start(STATE_STORE_INTERVAL_MS, periodic=True)
+
+    def _restore_stored_time(self) -> None:
+        if time() < self._stored_time:
+            # The RTC was reset, the stored time is a lower bound
+            tm = gmtime(self._stored_time)
+            self._rtc.datetime((tm[0], tm[1], tm[2], tm[6] + 1, tm[3], tm[4], tm[5], 0))
+        self._logger.warning("NTP not reachable, continuing on the stored RTC time")
 
     def _schedule_normal_sync(self) -> None:
-        self._sync_timer.init(
-            period=self._sync_interval_ms,
-            mode=Timer.ONE_SHOT,
-            callback=self._set_pending_ntp_sync,
-        )
+        self._sync_job.start(self._next_sync_interval_ms())
 
     def _schedule_retry(self) -> None:
-        self._sync_timer.init(
-            period=self._retry_interval_ms,
-            mode=Timer.ONE_SHOT,
-            callback=self._set_pending_ntp_sync,
-        )
+        self._sync_job.start(self._retry_interval_ms)
+
+    def _next_sync_interval_ms(self) -> int:
+        """Sync just often enough to keep the RTC within MAX_CLOCK_ERROR_MS."""
+        if self._drift_ppm is None:
+            return self._sync_interval_ms
+        drift_ppm = abs(self._drift_ppm)
+        if drift_ppm * SYNC_INTERVAL_MAX_MS <= MAX_CLOCK_ERROR_MS * 1_000_000:
+            return SYNC_INTERVAL_MAX_MS
+        interval_ms = int(MAX_CLOCK_ERROR_MS * 1_000_000 / drift_ppm)
+        return max(interval_ms, self._sync_interval_ms)
 
     def _set_pending_ntp_sync(self, _=None) -> None:
-        self._pending_ntp_sync = True
+        self._pending_ntp_sync.set()
 
-    def handle_pending_ntp_sync(self) -> None:
-        if not self._pending_ntp_sync:
-            return
-        try:
-            ntptime.settime()
-            self._logger.log("NTP sync successful")
-            self._schedule_normal_sync()
-        except OSError:
-            self._logger.log(
-                f"NTP sync failed retrying again in {self._retry_interval_ms // 1000}s"
-            )
-            self._schedule_retry()
-        self._pending_ntp_sync = False
+    def _set_pending_store(self, _=None) -> None:
+        self._pending_store.set()
 
-    def get_current_cet_datetime_str(self) -> str:
-        """Return formatted CET string"""
-        u = self._get_utc_datetime()
-        c = self._utc_to_cet(u)
-        return (
-            f"{c.year}/{c.month:02}/{c.day:02}-{c.hour:02}:{c.minute:02}:{c.second:02}"
+    async def run(self) -> None:
+        """Synchronize with NTP and store the RTC time whenever their jobs fire."""
+        await asyncio.gather(
+            self._handle_pending_ntp_syncs(), self._handle_pending_stores()
         )
 
-    # Removed duplicate/legacy _sync_ntp, _schedule_normal_sync, _schedule_retry methods
+    async def _handle_pending_ntp_syncs(self) -> None:
+        while True:
+            await self._pending_ntp_sync.wait()
+            if await self._sync_ntp():
+                self._schedule_normal_sync()
+            else:
+                self._logger.error(
+                    "NTP sync failed retrying again in %ds",
+                    self._retry_interval_ms // 1000,
+                )
+                self._schedule_retry()
+
+    async def _handle_pending_stores(self) -> None:
+        while True:
+            await self._pending_store.wait()
+            self._store_state()
 
-    def _get_utc_datetime(self) -> datetime.datetime:
-        """Get current UTC time from RTC"""
-        t = self._rtc.datetime()
-        return datetime.datetime(t[0], t[1], t[2], t[4], t[5], t[6])
+    async def _sync_ntp(self) -> bool:
+        for host in NTP_HOSTS:
+            if await self._query(host):
+                return True
+        return False
 
-    def _utc_to_cet(self, utc_time: datetime.datetime) -> datetime.datetime:
-        """DST-aware UTC to CET conversion (last Sunday of March to last Sunday of October)"""
-        year = utc_time.year
-        # Last Sunday of March
-        march = datetime.date(year, 3, 31)
-        last_sunday_march = march - datetime.timedelta(
-            days=march.weekday() + 1 if march.weekday() != 6 else 0
+    async def _query(self, host: str) -> bool:
+        """Ask one server for the time and set the RTC from its answer."""
+        try:
+            address = self._addresses.get(host)
+            if address is None:
+                # DNS blocks, so each server is only looked up until it fails
+                address = socket.getaddrinfo(host, NTP_PORT)[0][-1]
+                self._addresses[host] = address
+        except OSError:
+            return False
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            sock.setblocking(False)
+            sent = ticks_us()
+            sock.sendto(self._request, address)
+            response = None
+            while response is None:
+                await asyncio.sleep_ms(NTP_POLL_MS)
+                try:
+                    response = sock.recv(NTP_PACKET_SIZE)
+                except OSError:
+                    # Nothing received yet
+                    if ticks_diff(ticks_us(), sent) > NTP_TIMEOUT_MS * 1000:
+                        break
+            round_trip_us = ticks_diff(ticks_us(), sent)
+        except OSError:
+            response = None
+        finally:
+            sock.close()
+        # Mode 4 is a server reply, stratum 0 a kiss-o'-death
+        if not response or len(response) < NTP_PACKET_SIZE:
+            self._addresses.pop(host, None)
+            return False
+        if response[0] & 0x07 != 4 or response[1] == 0:
+            self._addresses.pop(host, None)
+            return False
+        self._round_trip_phase.record(round_trip_us)
+        seconds, fraction = unpack_from("!II", response, 40)
+        # The server's transmit time, moved to now by half the round trip
+        ntp_ms = (
+            (seconds - NTP_DELTA) * 1000
+            + (fraction * 1000 >> 32)
+            + round_trip_us // 2000
         )
-        dst_start = datetime.datetime.combine(last_sunday_march, datetime.time(1, 0))
-        # Last Sunday of October
-        october = datetime.date(year, 10, 31)
-        last_sunday_october = october - datetime.timedelta(
-            days=october.weekday() + 1 if october.weekday() != 6 else 0
+        self._apply(host, ntp_ms, ticks_ms())
+        return True
+
+    def _apply(self, host: str, ntp_ms: int, now_ticks: int) -> None:
+        offset_ms = ntp_ms - time() * 1000
+        if self._anchor_ms is not None:
+            elapsed_ms = ticks_diff(now_ticks, self._anchor_ticks)
+            if DRIFT_MIN_BASELINE_MS <= elapsed_ms <= DRIFT_MAX_BASELINE_MS:
+                drift_ppm = (elapsed_ms - (ntp_ms - self._anchor_ms)) * 1e6 / elapsed_ms
+                if self._drift_ppm is None:
+                    self._drift_ppm = drift_ppm
+                else:
+                    self._drift_ppm += DRIFT_ALPHA * (drift_ppm - self._drift_ppm)
+        self._anchor_ms = ntp_ms
+        self._anchor_ticks = now_ticks
+        tm = gmtime((ntp_ms + 500) // 1000)
+        self._rtc.datetime((tm[0], tm[1], tm[2], tm[6] + 1, tm[3], tm[4], tm[5], 0))
+        self._logger.info(
+            "NTP sync via %s: RTC was off by %d ms, drift %s, next sync in %d min",
+            host,
+            offset_ms,
+            "unknown" if self._drift_ppm is None else "%.1f ppm" % self._drift_ppm,
+            self._next_sync_interval_ms() // 60000,
         )
-        dst_end = datetime.datetime.combine(last_sunday_october, datetime.time(1, 0))
-        if dst_start <= utc_time < dst_end:
-            return utc_time + datetime.timedelta(hours=2)
-        return utc_time + datetime.timedelta(hours=1)
+        self._store_state()
+
+    def _load_state(self) -> None:
+        try:
+            with open(STATE_FILE_PATH) as state_file:
+                state = load(state_file)
+            self._stored_time = state["time"]
+            self._drift_ppm = state["drift_ppm"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def _store_state(self) -> None:
+        try:
+            with open(STATE_FILE_PATH, "w") as state_file:
+                dump({"time": time(), "drift_ppm": self._drift_ppm}, state_file)
+        except OSError as e:
+            self._logger.error("Failed to store the RTC time: %s", e)
+
+    def get_current_cet_datetime_str(self) -> str:
+        """Return the RTC time in CET/CEST as YYYY/MM/DD-HH:MM:SS."""
+        now = time()
+        if now == self._stamped_at:
+            # Log lines come in bursts, most of them within the same second
+            return self._stamp
+        self._stamped_at = now
+        if not self._year_start <= now < self._year_end:
+            self._compute_dst_transitions(now)
+        if self._dst_start <= now < self._dst_end:
+            local = now + CEST_OFFSET_S
+        else:
+            local = now + CET_OFFSET_S
+        if not self._day_start <= local < self._day_start + DAY_S:
+            self._format_date(local)
+        seconds = local - self._day_start
+        buffer = self._stamp_buffer
+        _put_digits(buffer, 11, seconds // 3600, 2)
+        _put_digits(buffer, 14, seconds // 60 % 60, 2)
+        _put_digits(buffer, 17, seconds % 60, 2)
+        self._stamp = buffer.decode()
+        return self._stamp
+
+    def _compute_dst_transitions(self, now: int) -> None:
+        """Cache the UTC year around `now` and its DST start and end, in epoch seconds."""
+        year = gmtime(now)[0]
+        self._year_start = mktime((year, 1, 1, 0, 0, 0, 0, 0))
+        self._year_end = mktime((year + 1, 1, 1, 0, 0, 0, 0, 0))
+        # Last Sunday of March and of October, at 01:00 UTC
+        self._dst_start = _last_sunday_at_1_utc(year, 3)
+        self._dst_end = _last_sunday_at_1_utc(year, 10)
+
+    def _format_date(self, local: int) -> None:
+        t = gmtime(local)
+        self._day_start = local - (t[3] * 3600 + t[4] * 60 + t[5])
+        buffer = self._stamp_buffer
+        _put_digits(buffer, 0, t[0], 4)
+        _put_digits(buffer, 5, t[1], 2)
+        _put_digits(buffer, 8, t[2], 2)
+
+
+def _last_sunday_at_1_utc(year: int, month: int) -> int:
+    last_day = mktime((year, month, 31, 1, 0, 0, 0, 0))
+    # gmtime() weekdays start at 0 on Monday
+    return last_day - (gmtime(last_day)[6] + 1) % 7 * DAY_S
+
+
+def _put_digits(buffer: bytearray, offset: int, value: int, width: int) -> None:
+    """Write `value` as `width` zero-padded ASCII digits, without allocating."""
+    end = offset + width - 1
+    for index in range(end, offset - 1, -1):
+        buffer[index] = 48 + value % 10
+        value //= 10
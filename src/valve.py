@@ -1,6 +1,7 @@
 from machine import Pin
 from config import IrrigationPointConfig
-from logger import Logger
+from logger import Logger, DEBUG
+from sensor_worker import CommandQueue
 
 
 class Valve:
@@ -9,34 +10,64 @@ class Valve:
     STATE_OPEN = "open"
     STATE_CLOSED = "closed"
 
-    def __init__(self, config: IrrigationPointConfig, logger: Logger) -> None:
-        """Initialize the valve with its GPIO pin configuration."""
+    def __init__(
+        self,
+        config: IrrigationPointConfig,
+        logger: Logger,
+        commands: CommandQueue | None = None,
+        index: int = 0,
+    ) -> None:
+        """Initialize the valve with its GPIO pin configuration.
+
+        With a command queue the pin is owned by core 1: open() and close()
+        queue the change under `index` and core 1 drives the pin.
+        """
         self._name = config.name
         self._valve = Pin(config.valve_pin, Pin.OUT)
         self._pin = config.valve_pin
         self._state = Valve.STATE_CLOSED
         self._logger = logger
+        self._commands = commands
+        self._index = index
 
         # Ensure valve is closed initially
         self._valve.off()
 
     def open(self) -> None:
         """Open the irrigation valve."""
-        self._valve.on()
+        if not self._set_pin(1):
+            return
         self._state = Valve.STATE_OPEN
-        self._logger.log(
-            f"[Valve] {self._name}: Valve opened, sent value 1 to pin {self._pin}"
+        self._logger.info(
+            "[Valve] %s: Valve opened, sent value 1 to pin %d", self._name, self._pin
         )
 
     def close(self) -> None:
         """Close the irrigation valve."""
-        self._valve.off()
+        if not self._set_pin(0):
+            return
         self._state = Valve.STATE_CLOSED
-        self._logger.log(
-            f"[Valve] {self._name}: Valve closed, sent value 0 to pin {self._pin}"
+        self._logger.info(
+            "[Valve] %s: Valve closed, sent value 0 to pin %d", self._name, self._pin
+        )
+
+    def drive(self, value: int) -> None:
+        """Write the pin, on the core that owns it."""
+        self._valve.value(value)
+
+    def _set_pin(self, value: int) -> bool:
+        if self._commands is None:
+            self.drive(value)
+            return True
+        if self._commands.put(self._index, value):
+            return True
+        self._logger.error(
+            "[Valve] %s: Command queue full, core 1 is not responding", self._name
         )
+        return False
 
     def get_state(self) -> str:
         """Return the current state (open/closed) of the valve."""
-        self._logger.log(f"[Valve] {self._name}: Valve state is {self._state}")
+        if self._logger.is_enabled(DEBUG):
+            self._logger.debug("[Valve] %s: Valve state is %s", self._name, self._state)
         return self._state
@@ -1,23 +1,119 @@
-from machine import Timer, reset
-from time import sleep
+from machine import WDT, reset
 from logger import Logger
+from os import remove, sync
+from time import ticks_ms, ticks_diff
+import asyncio
+
+# The RP2350 hardware watchdog resets the chip when it isn't fed within this
+# time, also when interrupts or the event loop are wedged. 8.3 s is the
+# longest timeout the rp2 port accepts
+WDT_TIMEOUT_MS = 8000
+FEED_INTERVAL_MS = 1000
+# Name of the subsystem that stalled, written just before the watchdog resets
+STALL_FILE_PATH = "./watchdog-stall.txt"
+
+
+class Heartbeat:
+    """Liveness of one subsystem: it has to beat at least every `timeout_ms`."""
+
+    __slots__ = ("name", "timeout_ms", "_last_ms")
+
+    def __init__(self, name: str, timeout_ms: int) -> None:
+        self.name = name
+        self.timeout_ms = timeout_ms
+        self._last_ms = ticks_ms()
+
+    def beat(self) -> None:
+        self._last_ms = ticks_ms()
+
+    def silent_ms(self, now_ms: int) -> int:
+        return ticks_diff(now_ms, self._last_ms)
+
+    def stalled(self, now_ms: int) -> bool:
+        return self.silent_ms(now_ms) > self.timeout_ms
+
+
+# Every subsystem registers its heartbeat here at construction time, the
+# timeout starts counting when the watchdog is armed
+_heartbeats: list[Heartbeat] = []
+
+
+def heartbeat(name: str, timeout_ms: int) -> Heartbeat:
+    """Register a subsystem whose stall should reset the station."""
+    beat = Heartbeat(name, timeout_ms)
+    _heartbeats.append(beat)
+    return beat
+
+
+# Flushes of data that is still buffered in RAM, registered by the
+# subsystems that buffer and run before every deliberate reset
+_flushes: list = []
+
+
+def flush_before_reset(flush) -> None:
+    """Register a flush that persists RAM-buffered data before the station resets."""
+    _flushes.append(flush)
+
+
+def restart() -> None:
+    """Run the registered flushes in order and reset the device."""
+    for flush in _flushes:
+        try:
+            flush()
+        except Exception:
+            # A failing flush must not keep the station from resetting
+            pass
+    reset()
 
 
 class Watchdog:
-    def __init__(self, timeout_s: int, logger: Logger):
-        self.timeout_ms = timeout_s * 1000
+    def __init__(self, logger: Logger):
         self.logger = logger
-        self.timer = Timer()
-        self.timer.init(
-            period=self.timeout_ms, mode=Timer.ONE_SHOT, callback=self._timeout_callback
-        )
-        self.logger.log(f"WatchDog initialized with timeout {timeout_s} s")
+        self._wdt: WDT | None = None
+        self._report_previous_stall()
+
+    def _report_previous_stall(self) -> None:
+        try:
+            with open(STALL_FILE_PATH) as stall_file:
+                name = stall_file.read()
+            remove(STALL_FILE_PATH)
+        except OSError:
+            return
+        self.logger.warning("Previous reset: subsystem '%s' stalled", name)
 
-    def _timeout_callback(self, _):
-        self.logger.log("WatchDog timeout occurred, restarting device")
-        reset()
+    def start(self) -> None:
+        """Arm the hardware watchdog, it can't be stopped again."""
+        self._wdt = WDT(timeout=WDT_TIMEOUT_MS)
+        # Time spent in setup doesn't count against the subsystems
+        for beat in _heartbeats:
+            beat.beat()
+        self.logger.info("WatchDog initialized with timeout %d ms", WDT_TIMEOUT_MS)
 
-    def feed(self):
-        self.timer.init(
-            period=self.timeout_ms, mode=Timer.ONE_SHOT, callback=self._timeout_callback
+    def feed(self) -> None:
+        """Feed the hardware watchdog, unless a subsystem stopped beating."""
+        now = ticks_ms()
+        for beat in _heartbeats:
+            if beat.stalled(now):
+                self._reset_for(beat)
+                return
+        self._wdt.feed()
+
+    def _reset_for(self, beat: Heartbeat) -> None:
+        self.logger.error(
+            "WatchDog: %s has not beaten for %d s, restarting device",
+            beat.name,
+            beat.silent_ms(ticks_ms()) // 1000,
         )
+        try:
+            with open(STALL_FILE_PATH, "w") as stall_file:
+                stall_file.write(beat.name)
+            sync()
+        except OSError:
+            pass
+        restart()
+
+    async def run(self) -> None:
+        """Keep feeding the watchdog for as long as the event loop and all subsystems are alive."""
+        while True:
+            self.feed()
+            await asyncio.sleep_ms(FEED_INTERVAL_MS)
@@ -1,84 +1,259 @@
-from machine import Timer
-from time import sleep
-from network import WLAN, STA_IF
+from network import WLAN, STA_IF, STAT_GOT_IP
 from rp2 import country
+from binascii import hexlify, unhexlify
+from json import dump, load
+from os import remove
 from config import NetworkConfig
 from logger import Logger
+from time import ticks_ms, ticks_us, ticks_diff
+import asyncio
+import profiler
+import watchdog
 
-RETRY_DELAY = 2  # seconds
-CHECK_INTERVAL_MS = 600_000  # milliseconds (10 minutes)
+# Last good access point, reused to reconnect without a scan. DHCP stays on,
+# so the lease is renewed by the router instead of reused after it expired
+CACHE_FILE_PATH = "./wifi-cache.json"
+# Link state is polled this often while connected, it only reads a driver flag
+LINK_CHECK_INTERVAL_MS = 1000
+CONNECT_POLL_MS = 50
+# A join with a known BSSID and channel skips the scan, DHCP takes a second or two
+FAST_CONNECT_TIMEOUT_MS = 5000
+CONNECT_TIMEOUT_MS = 20_000
+RETRY_DELAY_MS = 5000
+# Joining the cached access point doesn't block, so it is retried sooner
+FAST_RETRY_DELAY_MS = 1000
+# Scans block the event loop, so while the network is gone retries only try
+# the cached access point and scan at most this often
+SCAN_INTERVAL_MS = 60_000
+# The run loop wakes up at least every retry delay
+HEARTBEAT_TIMEOUT_MS = 60_000
+
+# Connection states of the reconnect state machine
+STATE_CONNECTED = 0
+STATE_CONNECTING = 1
+STATE_BACKOFF = 2
+
+# The manager whose link the broker connection runs over
+_manager = None
+
+
+def report_broker_connect(connected: bool) -> None:
+    """Tell the WiFi manager whether a broker connect attempt succeeded."""
+    if _manager is not None:
+        _manager.verify_link(connected)
 
 
 class WiFiManager:
     def __init__(self, config: NetworkConfig, logger: Logger) -> None:
+        global _manager
         self._config = config
         self._logger = logger
         self._wlan = WLAN(STA_IF)
-        self._retry_time = 0
-        self._timer = Timer(-1)
-        self._pending_connection_check = False
+        self._state = STATE_BACKOFF
+        # Whether the current attempt uses the cached access point
+        self._fast = False
+        # A link joined through the cache is only trusted once the broker answered
+        self._unverified = False
+        self._connect_started = 0
+        self._attempt_started = 0
+        self._attempt_timeout_ms = CONNECT_TIMEOUT_MS
+        self._target: tuple | None = None
+        self._last_scan = ticks_ms()
+        self._scanned = False
+        # (bssid, channel) of the last good connection
+        self._cache: tuple | None = self._load_cache()
+        self._pm = WLAN.PM_PERFORMANCE
+        self._check_phase = profiler.phase("wifi_check")
+        # Time from losing the link, or boot, until connected
+        self._connect_phase = profiler.phase("wifi_connect")
+        self._heartbeat = watchdog.heartbeat("wifi", HEARTBEAT_TIMEOUT_MS)
+        _manager = self
 
         country("nl")
 
-    def setup(self) -> None:
+    async def setup(self) -> None:
+        """Activate the interface and wait for the first connect attempt to finish."""
         self._wlan.active(True)
-        self._connect()  # Attempt to connect immediately
-        self._start_periodic_check()
+        self._start_connect()
+        while self._state == STATE_CONNECTING:
+            await asyncio.sleep_ms(CONNECT_POLL_MS)
+            self._poll_connect()
 
-    def handle_pending_connection_check(self) -> None:
-        """Handle pending connection check if flagged."""
-        if not self._pending_connection_check:
+    async def run(self) -> None:
+        """Watch the link and drive the reconnect state machine."""
+        while True:
+            self._heartbeat.beat()
+            if self._state == STATE_CONNECTED:
+                await asyncio.sleep_ms(LINK_CHECK_INTERVAL_MS)
+                start = ticks_us()
+                self._check_connection()
+                self._check_phase.record(ticks_diff(ticks_us(), start))
+            elif self._state == STATE_CONNECTING:
+                await asyncio.sleep_ms(CONNECT_POLL_MS)
+                self._poll_connect()
+            else:
+                await asyncio.sleep_ms(
+                    FAST_RETRY_DELAY_MS if self._cache is not None else RETRY_DELAY_MS
+                )
+                self._start_attempt()
+
+    def set_power_save(self, enabled: bool) -> None:
+        """Let the radio doze between DTIM beacons, or keep it listening."""
+        self._pm = WLAN.PM_POWERSAVE if enabled else WLAN.PM_PERFORMANCE
+        if self._state == STATE_CONNECTED:
+            self._wlan.config(pm=self._pm)
+
+    def verify_link(self, broker_connected: bool) -> None:
+        """Scan for the network again when the broker is unreachable over a cached join."""
+        if not self._unverified:
             return
-        self._pending_connection_check = False
-        self._check_connection()
+        self._unverified = False
+        if broker_connected or self._state != STATE_CONNECTED:
+            return
+        self._logger.warning(
+            "Broker unreachable through the cached access point, scanning"
+        )
+        self._forget_cache()
+        self._wlan.disconnect()
+        self._start_connect()
 
-    def _connect(self) -> None:
-        """Attempt to connect to the WiFi network."""
-        self._logger.log("Attempting to connect to WiFi...")
-        self._wlan.connect(self._config.wifi_ssid, self._config.wifi_password)
-        self._retry_time = 0
+    def _check_connection(self) -> None:
+        """Check the WiFi connection and reconnect if needed."""
+        # verify_link() may have started a new connect while the check slept
+        if self._state == STATE_CONNECTED and not self._wlan.isconnected():
+            self._logger.warning("WiFi connection lost, attempting to reconnect...")
+            self._start_connect()
 
-        while True:
-            if self._wlan.status() < 0 or self._wlan.status() >= 3:
-                break
-            self._logger.log(f"Trying to connect to WiFi ({self._retry_time}s)")
-            self._retry_time += RETRY_DELAY
-            sleep(RETRY_DELAY)
-
-        if self._wlan.status() == 3:
-            self._log_connection_info()
+    def _start_connect(self) -> None:
+        self._connect_started = ticks_ms()
+        self._start_attempt()
+
+    def _start_attempt(self) -> None:
+        if self._cache is not None:
+            self._connect_fast()
         else:
-            self._connected = False
-            self._logger.log("WiFi connection failed")
+            self._connect_slow()
 
-    def _log_connection_info(self) -> None:
-        """Log the WiFi connection details."""
-        info = self._wlan.ifconfig()
-        message = "\n".join(
-            [
-                f"Connected to WiFi network {self._config.wifi_ssid}:",
-                f"IP:          {info[0]}",
-                f"Subnet mask: {info[1]}",
-                f"Gateway:     {info[2]}",
-                f"Primary DNS: {info[3]}",
-            ]
+    def _connect_fast(self) -> None:
+        """Join the cached access point directly, without a scan."""
+        bssid, channel = self._cache
+        if self._config.static_ip is not None:
+            self._wlan.ifconfig(self._config.static_ip)
+        self._fast = True
+        self._join(bssid, channel, FAST_CONNECT_TIMEOUT_MS)
+
+    def _connect_slow(self) -> None:
+        """Scan for the strongest access point of the network and join it with DHCP."""
+        self._logger.info("Scanning for WiFi network %s...", self._config.wifi_ssid)
+        # Blocks for about two seconds, the driver has no asynchronous scan
+        self._last_scan = ticks_ms()
+        self._scanned = True
+        access_point = self._find_access_point(self._wlan.scan())
+        if access_point is None:
+            self._logger.error("WiFi network %s not found", self._config.wifi_ssid)
+            self._state = STATE_BACKOFF
+            return
+        if self._config.static_ip is not None:
+            self._wlan.ifconfig(self._config.static_ip)
+        self._fast = False
+        self._join(access_point[0], access_point[1], CONNECT_TIMEOUT_MS)
+
+    def _find_access_point(self, networks: list) -> tuple | None:
+        ssid = self._config.wifi_ssid.encode()
+        best = None
+        for network in networks:
+            # (ssid, bssid, channel, rssi, security, hidden)
+            if network[0] == ssid and (best is None or network[3] > best[3]):
+                best = network
+        return None if best is None else (best[1], best[2])
+
+    def _join(self, bssid: bytes, channel: int, timeout_ms: int) -> None:
+        self._target = (bssid, channel)
+        self._attempt_started = ticks_ms()
+        self._attempt_timeout_ms = timeout_ms
+        self._wlan.connect(
+            self._config.wifi_ssid,
+            self._config.wifi_password,
+            bssid=bssid,
+            channel=channel,
         )
-        self._logger.log(message)
+        self._state = STATE_CONNECTING
 
-    def _check_connection(self) -> None:
-        """Check the WiFi connection and reconnect if needed."""
-        if not self._wlan.isconnected():
-            self._logger.log("WiFi connection lost, attempting to reconnect...")
-            self._connect()
-
-    def _start_periodic_check(self) -> None:
-        """Start a timer to periodically check the WiFi connection."""
-        self._timer.init(
-            period=CHECK_INTERVAL_MS,
-            mode=Timer.PERIODIC,
-            callback=self._set_pending_connection_check,
+    def _poll_connect(self) -> None:
+        status = self._wlan.status()
+        if status == STAT_GOT_IP:
+            self._on_connected()
+            return
+        timed_out = (
+            ticks_diff(ticks_ms(), self._attempt_started) > self._attempt_timeout_ms
         )
+        if status >= 0 and not timed_out:
+            return
+        self._wlan.disconnect()
+        if self._fast and (
+            not self._scanned
+            or ticks_diff(ticks_ms(), self._last_scan) >= SCAN_INTERVAL_MS
+        ):
+            # The cached access point didn't answer, look for the network again
+            self._connect_slow()
+            return
+        if not self._fast:
+            self._logger.error("WiFi connection failed (status %d)", status)
+        self._state = STATE_BACKOFF
 
-    def _set_pending_connection_check(self, _=None) -> None:
-        """Set the flag to indicate a pending connection check."""
-        self._pending_connection_check = True
+    def _on_connected(self) -> None:
+        self._state = STATE_CONNECTED
+        self._scanned = False
+        self._unverified = self._fast
+        elapsed_ms = ticks_diff(ticks_ms(), self._connect_started)
+        self._connect_phase.record(elapsed_ms * 1000)
+        self._logger.info(
+            "WiFi connected in %d ms (%s)",
+            elapsed_ms,
+            "cached access point" if self._fast else "scan",
+        )
+        self._log_connection_info()
+        self._wlan.config(pm=self._pm)
+        cache = self._target
+        if cache != self._cache:
+            self._cache = cache
+            self._save_cache()
+
+    def _load_cache(self) -> tuple | None:
+        try:
+            with open(CACHE_FILE_PATH) as cache_file:
+                cache = load(cache_file)
+            return (unhexlify(cache["bssid"]), cache["channel"])
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _save_cache(self) -> None:
+        bssid, channel = self._cache
+        try:
+            with open(CACHE_FILE_PATH, "w") as cache_file:
+                dump({"bssid": hexlify(bssid).decode(), "channel": channel}, cache_file)
+        except OSError as e:
+            self._logger.error("Failed to store the WiFi cache: %s", e)
+
+    def _forget_cache(self) -> None:
+        self._cache = None
+        try:
+            remove(CACHE_FILE_PATH)
+        except OSError:
+            pass
+
+    def _log_connection_info(self) -> None:
+        """Log the WiFi connection details."""
+        info = self._wlan.ifconfig()
+        self._logger.info(
+            "Connected to WiFi network %s:\n"
+            "IP:          %s\n"
+            "Subnet mask: %s\n"
+            "Gateway:     %s\n"
+            "Primary DNS: %s",
+            self._config.wifi_ssid,
+            info[0],
+            info[1],
+            info[2],
+            info[3],
+        )